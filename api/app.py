@@ -9,67 +9,545 @@ MTProxy 白名单管理系统 Flask API
 import os
 import sys
 import json
+import math
+import gzip
+import base64
 import sqlite3
 import hashlib
+import hmac
 import secrets
 import ipaddress
 import subprocess
-import re
-from collections import defaultdict
-from datetime import datetime, timedelta
+import tempfile
+import threading
+import time
+import select
+import ctypes
+import ctypes.util
+import fcntl
+import queue
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from pathlib import Path
 
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.local import LocalProxy
 import jwt
 
+from ip_index import PrefixIndex
+from log_parser import StreamLogParser
+from geoip import GeoIPResolver, open_database
+from metrics import MetricsRegistry
+from haproxy_runtime import RuntimeAPIClient, HAProxyMapSync
+from dns_resolver import DNSError, create_resolver, normalize_hostname
+
 # 应用配置
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')  # 未设置时使用 DATA_DIR 中持久化的随机密钥
 app.config['JWT_EXPIRATION_HOURS'] = int(os.environ.get('JWT_EXPIRATION_HOURS', '24'))
+app.config['WHITELIST_BULK_MAX_ITEMS'] = int(os.environ.get('WHITELIST_BULK_MAX_ITEMS', '10000'))
+app.config['RELOAD_COALESCE_WINDOW'] = float(os.environ.get('RELOAD_COALESCE_WINDOW', '1.0'))
+app.config['RELOAD_MAX_LATENCY'] = float(os.environ.get('RELOAD_MAX_LATENCY', '5.0'))
+app.config['WHITELIST_EXPIRY_CHECK_INTERVAL'] = float(os.environ.get('WHITELIST_EXPIRY_CHECK_INTERVAL', '30'))
+app.config['DNS_RESOLVER'] = os.environ.get('DNS_RESOLVER', '')
+app.config['DNS_TIMEOUT'] = float(os.environ.get('DNS_TIMEOUT', '2.0'))
+app.config['DNS_MIN_TTL'] = float(os.environ.get('DNS_MIN_TTL', '60'))
+app.config['DNS_MAX_TTL'] = float(os.environ.get('DNS_MAX_TTL', '3600'))
+app.config['DNS_RESOLVER_WORKERS'] = int(os.environ.get('DNS_RESOLVER_WORKERS', '4'))
+app.config['DNS_CHECK_INTERVAL'] = float(os.environ.get('DNS_CHECK_INTERVAL', '30'))
+app.config['WHITELIST_CHANGELOG_RETENTION_DAYS'] = float(os.environ.get('WHITELIST_CHANGELOG_RETENTION_DAYS', '30'))
+app.config['REPLICATION_PRIMARY'] = os.environ.get('REPLICATION_PRIMARY', '').rstrip('/')
+app.config['REPLICATION_TOKEN'] = os.environ.get('REPLICATION_TOKEN', '')
+app.config['REPLICATION_INTERVAL'] = float(os.environ.get('REPLICATION_INTERVAL', '5'))
+app.config['REPLICATION_BATCH_SIZE'] = int(os.environ.get('REPLICATION_BATCH_SIZE', '1000'))
+app.config['REPLICATION_TIMEOUT'] = float(os.environ.get('REPLICATION_TIMEOUT', '10'))
+app.config['WHITELIST_AGGREGATE_CIDR'] = os.environ.get('WHITELIST_AGGREGATE_CIDR', 'false').lower() == 'true'
+app.config['INGESTION_POLL_INTERVAL'] = float(os.environ.get('INGESTION_POLL_INTERVAL', '2.0'))
+app.config['INGESTION_BATCH_BYTES'] = int(os.environ.get('INGESTION_BATCH_BYTES', str(1024 * 1024)))
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', '8'))
+app.config['DB_JOURNAL_MODE'] = os.environ.get('DB_JOURNAL_MODE', 'WAL')
+app.config['DB_SYNCHRONOUS'] = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+app.config['DB_BUSY_TIMEOUT'] = int(os.environ.get('DB_BUSY_TIMEOUT', '5000'))
+app.config['DB_CACHE_SIZE'] = int(os.environ.get('DB_CACHE_SIZE', '-16000'))
+app.config['DB_MMAP_SIZE'] = int(os.environ.get('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+app.config['DB_AUTO_VACUUM'] = os.environ.get('DB_AUTO_VACUUM', 'INCREMENTAL')
+app.config['SSE_CLIENT_BUFFER'] = int(os.environ.get('SSE_CLIENT_BUFFER', '256'))
+app.config['SSE_MAX_CLIENTS'] = int(os.environ.get('SSE_MAX_CLIENTS', '20'))
+app.config['SSE_STATS_INTERVAL'] = float(os.environ.get('SSE_STATS_INTERVAL', '5.0'))
+app.config['SSE_HEARTBEAT_INTERVAL'] = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', '15.0'))
+app.config['SSE_TICKET_TTL'] = float(os.environ.get('SSE_TICKET_TTL', '30'))
+app.config['CONNECTION_LOG_RETENTION_DAYS'] = float(os.environ.get('CONNECTION_LOG_RETENTION_DAYS', '7'))
+app.config['ROLLUP_MINUTE_RETENTION_DAYS'] = float(os.environ.get('ROLLUP_MINUTE_RETENTION_DAYS', '30'))
+app.config['ROLLUP_HOUR_RETENTION_DAYS'] = float(os.environ.get('ROLLUP_HOUR_RETENTION_DAYS', '365'))
+app.config['RETENTION_INTERVAL'] = float(os.environ.get('RETENTION_INTERVAL', '3600'))
+app.config['RETENTION_BATCH_SIZE'] = int(os.environ.get('RETENTION_BATCH_SIZE', '5000'))
+app.config['RESPONSE_GZIP_MIN_BYTES'] = int(os.environ.get('RESPONSE_GZIP_MIN_BYTES', '1024'))
+app.config['RESPONSE_GZIP_LEVEL'] = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+app.config['LEADER_RETRY_INTERVAL'] = float(os.environ.get('LEADER_RETRY_INTERVAL', '5.0'))
+app.config['METRICS_SHARE_INTERVAL'] = float(os.environ.get('METRICS_SHARE_INTERVAL', '5.0'))
+# /metrics 允许访问的来源地址（逗号分隔的IP/CIDR），以及可选的抓取令牌（Authorization: Bearer）
+app.config['METRICS_ALLOW'] = os.environ.get('METRICS_ALLOW', '127.0.0.1,::1')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+app.config['GEOIP_CACHE_SIZE'] = int(os.environ.get('GEOIP_CACHE_SIZE', '65536'))
+app.config['HAPROXY_WHITELIST'] = os.environ.get('HAPROXY_WHITELIST', 'false').lower() == 'true'
+app.config['HAPROXY_RUNTIME_API'] = os.environ.get('HAPROXY_RUNTIME_API', 'unix:/var/run/haproxy/admin.sock')
+app.config['HAPROXY_WHITELIST_MAP'] = os.environ.get('HAPROXY_WHITELIST_MAP', '/var/run/haproxy/whitelist.map')
+app.config['HAPROXY_RECONCILE_INTERVAL'] = float(os.environ.get('HAPROXY_RECONCILE_INTERVAL', '30'))
+app.config['HAPROXY_RUNTIME_TIMEOUT'] = float(os.environ.get('HAPROXY_RUNTIME_TIMEOUT', '5'))
+app.config['DATA_DIR'] = os.environ.get('DATA_DIR', '/data')
+app.config['ADMIN_PASSWORD'] = os.environ.get('ADMIN_PASSWORD', 'admin123')
+# 逗号分隔的路径，为空时使用默认值
+app.config['CONNECTION_LOG_FILES'] = os.environ.get('CONNECTION_LOG_FILES', '')
+app.config['GEOIP_DATABASES'] = os.environ.get('GEOIP_DATABASES', '')
 
 # 启用 CORS
 CORS(app, origins=['*'])
 
 # 路径配置
 BASE_DIR = Path(__file__).parent
-DATA_DIR = Path('/data')
-NGINX_WHITELIST_PATH = DATA_DIR / 'nginx' / 'whitelist.txt'  # 新的白名单文件路径
-NGINX_MAP_PATH = DATA_DIR / 'nginx' / 'whitelist_map.conf'  # nginx映射文件
-NGINX_LOG_PATH = Path('/var/log/nginx/stream_access.log')   # 更新日志路径
-DB_PATH = DATA_DIR / 'webapp' / 'users.db'
-CONFIG_PATH = DATA_DIR / 'webapp' / 'config.json'
-LOG_DIR = DATA_DIR / 'webapp' / 'logs'
-
-# 确保目录存在
-for path in [DATA_DIR / 'nginx', DATA_DIR / 'webapp', LOG_DIR]:
-    path.mkdir(parents=True, exist_ok=True)
+# 需要采集的连接日志（nginx各server分别写入不同文件），可通过 CONNECTION_LOG_FILES 用逗号分隔的路径覆盖
+DEFAULT_LOG_PATHS = [
+    Path('/var/log/nginx/stream_access.log'),
+    Path('/var/log/nginx/whitelist_access.log'),
+    Path('/var/log/nginx/proxy_protocol_access.log'),
+    Path('/var/log/nginx/diagnostic.log'),
+    Path('/var/log/nginx/gate_access.log'),  # 内置白名单网关（gate.py）
+]
 
 # 日志配置
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_DIR / 'api.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# 监控指标（/metrics）
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.counter(
+    'mtproxy_http_requests_total', 'HTTP requests by route, method and status code',
+    ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'mtproxy_http_request_duration_seconds', 'HTTP request latency by route', ('route',))
+WHITELIST_UPDATE_SECONDS = metrics.histogram(
+    'mtproxy_whitelist_update_duration_seconds', 'update_nginx_config duration by result', ('result',))
+WHITELIST_UPDATE_FAILURES = metrics.counter(
+    'mtproxy_whitelist_update_failures_total', 'Failed update_nginx_config runs')
+NGINX_RELOAD_SECONDS = metrics.histogram(
+    'mtproxy_nginx_reload_duration_seconds', 'reload_whitelist duration')
+NGINX_RELOAD_FAILURES = metrics.counter(
+    'mtproxy_nginx_reload_failures_total', 'Failed reload_whitelist runs')
+DNS_RESOLUTIONS = metrics.counter(
+    'mtproxy_dns_resolutions_total', 'Hostname whitelist entry resolutions by result', ('result',))
+REPLICATION_BATCHES = metrics.counter(
+    'mtproxy_replication_batches_total', 'Whitelist replication batches pulled from the primary by kind',
+    ('kind',))
+INGESTION_LINES = metrics.counter(
+    'mtproxy_ingestion_lines_total', 'nginx log lines ingested by parse result', ('result',))
+CONNECTIONS_TOTAL = metrics.counter(
+    'mtproxy_connections_total', 'Recorded proxy connections by whitelist decision', ('status',))
+SQLITE_TRANSACTION_SECONDS = metrics.histogram(
+    'mtproxy_sqlite_transaction_duration_seconds', 'Time a pooled SQLite connection is held, by operation',
+    ('operation',))
+
+def parse_utc_time(value):
+    """解析ISO格式时间参数为UTC时间（不带时区的按UTC处理），空值返回None"""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}")
+    if dt.tzinfo is not None:
+        try:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        except OverflowError:
+            raise ValueError(f"Time out of range: {value}")
+    return dt
+
+def encode_page_token(*values):
+    """生成不透明的翻页令牌（上一页最后一行排序键的 base64 编码）"""
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_page_token(token, size=2):
+    """解析翻页令牌，格式错误时抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise ValueError('Invalid page token')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid page token')
+    return values
+
+def keyset_query(cursor, select_sql, conditions, params, sort_column, limit, after=None):
+    """按 (sort_column, id) 倒序执行键集分页查询，返回 (行列表, 下一页令牌)
+    
+    after 为上一页返回的令牌。select_sql 需要选出 id 和 sort_column，
+    查询条件和排序都应能由 (筛选列, sort_column) 索引覆盖，每页开销只与页大小有关。
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after:
+        sort_value, last_id = decode_page_token(after)
+        conditions.append(f"{sort_column} <= ? AND ({sort_column} < ? OR id < ?)")
+        params.extend([sort_value, sort_value, last_id])
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor.execute(f"{select_sql} {where} ORDER BY {sort_column} DESC, id DESC LIMIT ?", params + [limit + 1])
+    rows = cursor.fetchall()
+    
+    next_token = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_token = encode_page_token(rows[-1][sort_column], rows[-1]['id'])
+    return rows, next_token
+
+def time_range_conditions(column, start=None, end=None):
+    """生成时间范围筛选条件 [start, end)，返回 (条件列表, 参数列表)"""
+    conditions, params = [], []
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start.strftime('%Y-%m-%d %H:%M:%S'))
+    if end:
+        conditions.append(f"{column} < ?")
+        params.append(end.strftime('%Y-%m-%d %H:%M:%S'))
+    return conditions, params
+
+def atomic_write_text(path, text):
+    """原子写入文本文件（临时文件 + rename），读取方不会看到写了一半的文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class AppPaths:
+    """数据目录（DATA_DIR）下的文件位置"""
+    
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.nginx_dir = self.data_dir / 'nginx'
+        self.webapp_dir = self.data_dir / 'webapp'
+        self.nginx_whitelist = self.nginx_dir / 'whitelist.txt'  # 新的白名单文件路径
+        self.nginx_map = self.nginx_dir / 'whitelist_map.conf'  # nginx映射文件
+        self.db = self.webapp_dir / 'users.db'
+        self.secret_key = self.webapp_dir / 'secret_key'
+        self.leader_lock = self.webapp_dir / 'leader.lock'  # 持有者运行日志采集和数据清理
+        self.reload_lock = self.webapp_dir / 'reload.lock'  # 串行化各进程的配置生成和nginx重载
+        self.metrics_dir = self.webapp_dir / 'metrics'  # 各 worker 进程的指标快照
+        self.log_position = self.webapp_dir / 'log_position.txt'  # 旧版本保存的日志读取位置
+        self.log_dir = self.webapp_dir / 'logs'
+        self.geoip_dir = self.data_dir / 'geoip'  # 离线IP归属库（*.mmdb / *.csv）
+    
+    def ensure_dirs(self):
+        """创建应用写入的目录"""
+        for path in [self.nginx_dir, self.webapp_dir, self.log_dir]:
+            path.mkdir(parents=True, exist_ok=True)
+    
+    def geoip_databases(self):
+        """geoip 目录下的归属库文件"""
+        return sorted(path for path in self.geoip_dir.glob('*') if path.suffix.lower() in ('.mmdb', '.csv'))
+
+def split_paths(value):
+    """解析逗号分隔的路径配置"""
+    return [Path(p.strip()) for p in value.split(',') if p.strip()]
+
+def configure_logging(log_dir):
+    """输出到 log_dir/api.log 和标准错误（已配置过根日志时不重复添加）"""
+    if logging.getLogger().handlers:
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(Path(log_dir) / 'api.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+def load_secret_key(path):
+    """读取持久化的JWT密钥，不存在时生成
+    
+    多个 worker 进程必须使用同一个密钥，否则一个进程签发的令牌在其他进程验证失败。
+    新密钥先写入临时文件再硬链接到目标路径，并发启动时只有一个进程的密钥生效。
+    """
+    path = Path(path)
+    if not path.exists():
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', dir=path.parent)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.chmod(tmp_path, 0o600)
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    return path.read_text().strip()
+
+def load_geoip_databases(paths):
+    """打开离线IP归属库，无法读取的文件记录错误后跳过"""
+    databases = []
+    for path in paths:
+        try:
+            databases.append(open_database(path))
+            logger.info(f"Loaded GeoIP database {path}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load GeoIP database {path}: {e}")
+    return databases
+
+class FileLock:
+    """基于 fcntl.flock 的进程间互斥锁
+    
+    同一进程内的线程先通过 threading.Lock 互斥，再获取文件锁；
+    持有锁的进程退出时由内核自动释放。
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fd = None
+        self._thread_lock = threading.Lock()
+    
+    def acquire(self, blocking=True):
+        """获取锁，blocking=False 时获取失败立即返回 False"""
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                self._thread_lock.release()
+                return False
+        except Exception:
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+        return True
+    
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        finally:
+            self._thread_lock.release()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
 class DatabaseManager:
-    """数据库管理类"""
+    """数据库管理类
+    
+    连接通过 connection() 上下文管理器借出并归还到连接池，
+    空闲连接最多保留 pool_size 个，池为空时临时新建，不会阻塞等待；pool_size <= 0 时不保留，归还即关闭。
+    各线程共用一个连接池而不是每个线程各持有一个连接：请求线程、SSE 长连接和解析线程池的线程数量不固定，
+    线程级连接会随线程数增长且无法由 close_all() 关闭。
+    """
     
-    def __init__(self, db_path):
+    AUTO_VACUUM_MODES = {'NONE': 0, 'FULL': 1, 'INCREMENTAL': 2}
+    
+    def __init__(self, db_path, pool_size=8, journal_mode='WAL', synchronous='NORMAL',
+                 busy_timeout=5000, cache_size=-16000, mmap_size=64 * 1024 * 1024,
+                 auto_vacuum='INCREMENTAL'):
         self.db_path = db_path
-        self.init_database()
+        self.pool_size = pool_size
+        self.journal_mode = journal_mode
+        self.auto_vacuum = auto_vacuum.upper()
+        self.pragmas = {
+            'synchronous': synchronous,
+            'busy_timeout': int(busy_timeout),
+            'cache_size': int(cache_size),
+            'mmap_size': int(mmap_size)
+        }
+        # queue 的 maxsize 为 0 表示不限大小，不保留空闲连接时不创建连接池
+        self._pool = queue.LifoQueue(maxsize=pool_size) if pool_size > 0 else None
+    
+    def _create_connection(self):
+        """新建连接并应用 PRAGMA 设置"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas['busy_timeout'] / 1000,
+            check_same_thread=False  # 连接在线程间借还，同一时间只被一个线程使用
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+    
+    @contextmanager
+    def connection(self, operation='query'):
+        """借出一个连接，退出时回滚未提交的事务并归还到连接池
+        
+        operation 为指标标签，借出时长记录到 mtproxy_sqlite_transaction_duration_seconds。
+        """
+        conn = None
+        if self._pool is not None:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                pass
+        if conn is None:
+            conn = self._create_connection()
+        
+        started = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            SQLITE_TRANSACTION_SECONDS.observe(time.perf_counter() - started, operation)
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                if self._pool is None:
+                    conn.close()
+                else:
+                    self._pool.put_nowait(conn)
+            except (queue.Full, sqlite3.Error):
+                conn.close()
+    
+    def close_all(self):
+        """关闭连接池中的空闲连接"""
+        while self._pool is not None:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def get_meta(self, key, default=None):
+        """读取 meta 表中的值"""
+        with self.connection() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+    
+    def set_meta(self, key, value):
+        """写入 meta 表中的值"""
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO meta (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            ''', (key, str(value)))
+            conn.commit()
+    
+    def ensure_auto_vacuum(self, conn):
+        """设置 auto_vacuum 模式，已有数据的数据库需要 VACUUM 一次才能切换"""
+        target = self.AUTO_VACUUM_MODES[self.auto_vacuum]
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == target:
+            return
+        
+        conn.execute(f"PRAGMA auto_vacuum = {target}")
+        if conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]:
+            logger.info(f"Converting database to auto_vacuum={self.auto_vacuum}, running VACUUM once")
+            conn.execute('VACUUM')
     
-    def init_database(self):
-        """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def incremental_vacuum(self, max_pages):
+        """归还最多 max_pages 个空闲页给文件系统，返回归还的页数"""
+        with self.connection() as conn:
+            freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            pages = min(freelist, max_pages)
+            if pages > 0:
+                # execute() 只执行一步（每步释放一页），executescript 会执行到完成
+                conn.executescript(f"PRAGMA incremental_vacuum({pages})")
+            return pages
+    
+    def get_storage_info(self):
+        """获取数据库文件大小和各表行数"""
+        with self.connection() as conn:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            )]
+            row_counts = {
+                table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                for table in tables
+            }
+        
+        wal_path = Path(f"{self.db_path}-wal")
+        modes = {value: name for name, value in self.AUTO_VACUUM_MODES.items()}
+        return {
+            'path': str(self.db_path),
+            'file_size': Path(self.db_path).stat().st_size,
+            'wal_size': wal_path.stat().st_size if wal_path.exists() else 0,
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': freelist,
+            'auto_vacuum': modes.get(auto_vacuum, auto_vacuum),
+            'tables': row_counts
+        }
+    
+    def init_database(self, admin_password=None):
+        """初始化数据库：执行未完成的结构迁移，并同步默认管理员密码
+        
+        数据库已是最新版本、PRAGMA 设置也已生效时只读取几个 PRAGMA，不获取文件锁；
+        否则在文件锁内执行迁移（多个 worker 进程同时启动时串行执行）。
+        """
+        conn = self._create_connection()
+        try:
+            if not self._is_current(conn):
+                with FileLock(f'{self.db_path}.init.lock'):
+                    self.migrate(conn)
+            if admin_password is not None:
+                self.sync_admin_password(conn, admin_password)
+        finally:
+            conn.close()
+    
+    def _is_current(self, conn):
+        """结构版本、auto_vacuum 和 journal_mode 是否均已是目标值"""
+        return (conn.execute('PRAGMA user_version').fetchone()[0] >= self.SCHEMA_VERSION
+                and conn.execute('PRAGMA auto_vacuum').fetchone()[0] == self.AUTO_VACUUM_MODES[self.auto_vacuum]
+                and conn.execute('PRAGMA journal_mode').fetchone()[0].upper() == self.journal_mode.upper())
+    
+    def migrate(self, conn):
+        """按版本号执行未完成的迁移，每个迁移与版本号更新在同一事务中提交"""
+        # auto_vacuum 需要在建表之前设置
+        self.ensure_auto_vacuum(conn)
+        # WAL 模式持久保存在数据库文件中，只需设置一次
+        journal_mode = conn.execute(f"PRAGMA journal_mode = {self.journal_mode}").fetchone()[0]
+        logger.info(f"SQLite journal_mode={journal_mode}, pool_size={self.pool_size}")
         
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target, description, migration in self.MIGRATIONS:
+            if target <= version:
+                continue
+            started = time.perf_counter()
+            cursor = conn.cursor()
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                migration(self, cursor)
+                cursor.execute(f'PRAGMA user_version = {target}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"Database migration {target} ({description}) failed")
+                raise
+            logger.info(f"Database migrated to version {target} ({description}) in "
+                        f"{time.perf_counter() - started:.3f}s")
+            version = target
+    
+    def _migrate_initial_schema(self, cursor):
+        """版本 1：基础表结构（兼容未记录版本号的旧数据库，已存在的表只补充缺失字段）"""
         # 创建用户表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -116,10 +594,30 @@ class DatabaseManager:
                 status TEXT NOT NULL,  -- 'allowed' or 'denied'
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 user_agent TEXT,
-                location TEXT
+                location TEXT,
+                protocol TEXT,
+                status_code INTEGER,
+                bytes_sent INTEGER,
+                bytes_received INTEGER,
+                session_time REAL,
+                upstream TEXT,
+                country TEXT,
+                asn INTEGER
             )
         ''')
         
+        # 旧版本数据库补充连接详情字段
+        self.add_missing_columns(cursor, 'connection_logs', {
+            'protocol': 'TEXT',
+            'status_code': 'INTEGER',
+            'bytes_sent': 'INTEGER',
+            'bytes_received': 'INTEGER',
+            'session_time': 'REAL',
+            'upstream': 'TEXT',
+            'country': 'TEXT',
+            'asn': 'INTEGER'
+        })
+        
         # 创建被拒绝IP统计表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS blocked_ip_stats (
@@ -128,65 +626,444 @@ class DatabaseManager:
                 attempt_count INTEGER DEFAULT 1,
                 first_attempt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_attempt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                location TEXT
+                location TEXT,
+                country TEXT,
+                asn INTEGER
             )
         ''')
+        self.add_missing_columns(cursor, 'blocked_ip_stats', {
+            'country': 'TEXT',
+            'asn': 'INTEGER'
+        })
         
         # 创建索引
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connection_logs_ip ON connection_logs(ip_address)')
+        # 按IP/状态筛选的索引带上时间列，筛选后按时间倒序翻页无需排序
+        cursor.execute('DROP INDEX IF EXISTS idx_connection_logs_ip')
+        cursor.execute('DROP INDEX IF EXISTS idx_connection_logs_status')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connection_logs_ip_timestamp ON connection_logs(ip_address, timestamp)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_connection_logs_timestamp ON connection_logs(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connection_logs_status ON connection_logs(status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connection_logs_status_timestamp ON connection_logs(status, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operation_logs_timestamp ON operation_logs(timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operation_logs_user_timestamp ON operation_logs(user, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operation_logs_action_timestamp ON operation_logs(action, timestamp)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocked_ip_stats_ip ON blocked_ip_stats(ip_address)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocked_ip_stats_last_attempt ON blocked_ip_stats(last_attempt)')
         
-        # 创建默认管理员用户
-        self.create_default_admin(cursor)
+        # 创建日志读取游标表（每个日志文件一行，与连接记录同事务更新）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_cursors (
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                head TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 连接统计汇总表（按分钟/小时和状态计数，采集时增量更新，时间为UTC）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS connection_stats_minute (
+                bucket TEXT NOT NULL,  -- 'YYYY-MM-DD HH:MM'
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, status)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS connection_stats_hour (
+                bucket TEXT NOT NULL,  -- 'YYYY-MM-DD HH'
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, status)
+            ) WITHOUT ROWID
+        ''')
+        
+        # 每个来源IP一行，用于统计独立IP数
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS connection_ip_stats (
+                ip_address TEXT PRIMARY KEY,
+                connection_count INTEGER NOT NULL DEFAULT 0,
+                first_seen TIMESTAMP,
+                last_seen TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_connection_ip_stats_last_seen ON connection_ip_stats(last_seen)')
+        
+        # 键值元数据表（白名单版本号等）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('whitelist_version', '0')")
+    
+    def _migrate_backfill_rollups(self, cursor):
+        """版本 2：从旧版本升级时，根据已有的连接日志回填统计汇总表"""
+        cursor.execute('''
+            SELECT EXISTS(SELECT 1 FROM connection_stats_hour),
+                   EXISTS(SELECT 1 FROM connection_logs)
+        ''')
+        has_rollups, has_logs = cursor.fetchone()
+        if has_logs and not has_rollups:
+            self.rebuild_rollups(cursor)
+    
+    def _migrate_whitelist_expiry(self, cursor):
+        """版本 3：白名单条目的过期时间（UTC，NULL 表示永久有效）"""
+        self.add_missing_columns(cursor, 'whitelist', {'expires_at': 'TIMESTAMP'})
+        # 只索引有过期时间的有效条目，查询最近的过期时间和到期条目只需扫描索引
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_whitelist_expires_at ON whitelist(expires_at)
+            WHERE is_active = 1 AND expires_at IS NOT NULL
+        ''')
+    
+    def _migrate_hostname_resolutions(self, cursor):
+        """版本 4：主机名条目的解析结果（后台解析写入，生成映射时读取）"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS hostname_resolutions (
+                entry_id INTEGER PRIMARY KEY,
+                addresses TEXT NOT NULL DEFAULT '',  -- 逗号分隔，已排序
+                ttl INTEGER,
+                resolved_at TIMESTAMP,
+                refresh_at TIMESTAMP NOT NULL,
+                last_error TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_whitelist_hostname ON whitelist(id)
+            WHERE ip_type = 'hostname' AND is_active = 1
+        ''')
+    
+    def _migrate_whitelist_changes(self, cursor):
+        """版本 5：白名单变更日志（从节点按版本号拉取增量）"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS whitelist_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                version INTEGER NOT NULL,  -- 变更后的白名单版本号，同一事务的变更版本号相同
+                action TEXT NOT NULL,  -- add / remove
+                ip TEXT NOT NULL,
+                ip_type TEXT,
+                description TEXT,
+                expires_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_whitelist_changes_version ON whitelist_changes(version)')
+        # 变更日志从当前版本开始记录，更早的版本只能通过全量快照同步
+        cursor.execute('''
+            INSERT OR IGNORE INTO meta (key, value)
+            SELECT 'changelog_start', value FROM meta WHERE key = 'whitelist_version'
+        ''')
+    
+    def _migrate_operation_log_ip_index(self, cursor):
+        """版本 6：操作日志按来源IP筛选的索引（/api/logs?ip=）"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operation_logs_ip_timestamp ON operation_logs(ip_address, timestamp)')
+    
+    def _migrate_legacy_connection_times(self, cursor):
+        """版本 7：旧版本写入的连接时间换算为UTC
+        
+        旧版本保存 nginx $time_local（带时区偏移，如 2024-01-01 10:00:00+08:00）或容器本地时间
+        （datetime.now()，带微秒），与现在的UTC "YYYY-MM-DD HH:MM:SS" 混在一起时时间范围查询和汇总都会错位。
+        带偏移的按偏移换算，不带的按本机时区换算，有换算时重建统计汇总表。
+        """
+        converted = naive = 0
+        for table, columns in (('connection_logs', ('timestamp',)),
+                               ('blocked_ip_stats', ('first_attempt', 'last_attempt'))):
+            for column in columns:
+                last_id = 0
+                while True:
+                    rows = cursor.execute(f'''
+                        SELECT id, {column} FROM {table}
+                        WHERE id > ? AND length({column}) != 19
+                        ORDER BY id LIMIT 5000
+                    ''', (last_id,)).fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+                    updates = []
+                    for row_id, value in rows:
+                        try:
+                            dt = datetime.fromisoformat(value)
+                        except (TypeError, ValueError):
+                            continue
+                        if dt.tzinfo is None:
+                            naive += 1
+                        # 不带时区的 datetime 调用 astimezone() 时按本机时区处理
+                        updates.append((dt.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), row_id))
+                    cursor.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+                    converted += len(updates)
         
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+        if not converted:
+            return
+        if naive and time.timezone != 0:
+            offset = -time.timezone / 3600
+            logger.warning(f"Converted {naive} connection times without a timezone from the local timezone "
+                           f"(UTC{offset:+g}); they are off by the difference if the container timezone "
+                           f"changed after they were written")
+        logger.info(f"Converted {converted} legacy connection times to UTC")
+        self.rebuild_rollups(cursor)
+    
+    # (版本号, 说明, 迁移函数)，已发布的迁移不再修改，结构变更追加新版本
+    MIGRATIONS = (
+        (1, 'initial schema', _migrate_initial_schema),
+        (2, 'backfill connection rollups', _migrate_backfill_rollups),
+        (3, 'whitelist entry expiry', _migrate_whitelist_expiry),
+        (4, 'hostname resolutions', _migrate_hostname_resolutions),
+        (5, 'whitelist change log', _migrate_whitelist_changes),
+        (6, 'operation log ip index', _migrate_operation_log_ip_index),
+        (7, 'legacy connection times to UTC', _migrate_legacy_connection_times),
+    )
+    SCHEMA_VERSION = MIGRATIONS[-1][0]
+    
+    def rebuild_rollups(self, cursor):
+        """根据连接日志重建全部统计汇总表（在调用方的事务中执行）"""
+        cursor.execute('DELETE FROM connection_stats_minute')
+        cursor.execute('DELETE FROM connection_stats_hour')
+        cursor.execute('DELETE FROM connection_ip_stats')
+        cursor.execute('''
+            INSERT INTO connection_stats_minute (bucket, status, count)
+            SELECT substr(timestamp, 1, 16), status, COUNT(*)
+            FROM connection_logs
+            GROUP BY 1, 2
+        ''')
+        cursor.execute('''
+            INSERT INTO connection_stats_hour (bucket, status, count)
+            SELECT substr(bucket, 1, 13), status, SUM(count)
+            FROM connection_stats_minute
+            GROUP BY 1, 2
+        ''')
+        cursor.execute('''
+            INSERT INTO connection_ip_stats (ip_address, connection_count, first_seen, last_seen)
+            SELECT ip_address, COUNT(*), MIN(timestamp), MAX(timestamp)
+            FROM connection_logs
+            GROUP BY ip_address
+        ''')
+        logger.info("Connection statistics rollups rebuilt from connection_logs")
+    
+    def add_missing_columns(self, cursor, table, columns):
+        """为已存在的表补充缺失的字段"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                logger.info(f"Added column {table}.{name}")
     
-    def create_default_admin(self, cursor):
-        """创建或更新默认管理员用户"""
+    def sync_admin_password(self, conn, admin_password):
+        """创建默认管理员用户，或在密码配置变更后更新密码（未变化时不写入）"""
         try:
-            # 从环境变量获取管理员密码
-            admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
             password_hash = hashlib.sha256(admin_password.encode()).hexdigest()
             
-            # 检查是否已存在管理员用户
-            cursor.execute("SELECT COUNT(*) FROM users WHERE username = ?", ('admin',))
-            if cursor.fetchone()[0] == 0:
+            row = conn.execute("SELECT password_hash FROM users WHERE username = ?", ('admin',)).fetchone()
+            if row is None:
                 # 创建新的管理员用户
-                cursor.execute(
+                conn.execute(
                     "INSERT INTO users (username, password_hash) VALUES (?, ?)",
                     ('admin', password_hash)
                 )
+                conn.commit()
                 logger.info(f"Default admin user created with password from environment variable")
-            else:
+            elif row['password_hash'] != password_hash:
                 # 更新现有管理员用户密码（确保密码变更生效）
-                cursor.execute(
+                conn.execute(
                     "UPDATE users SET password_hash = ? WHERE username = ?",
                     (password_hash, 'admin')
                 )
+                conn.commit()
                 logger.info(f"Default admin user password updated from environment variable")
         except Exception as e:
             logger.error(f"Error creating/updating default admin: {e}")
+
+class ReloadScheduler:
+    """白名单重载调度器
     
-    def get_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    白名单变更只标记配置为待更新，由后台线程合并执行：最后一次变更后
+    window 秒内没有新变更即执行，且距离第一次未应用的变更不超过
+    max_latency 秒。所有重载串行执行，互不重叠。window <= 0 时退化为
+    同步执行（每次变更立即重载）。apply_func 返回 False 表示配置内容
+    没有变化、未实际重载。重载失败时由后台线程按指数退避重试，直到成功。
+    """
+    
+    RETRY_BASE = 1.0   # 第一次重试前的等待时间（秒）
+    RETRY_MAX = 60.0   # 重试间隔上限（秒）
+    
+    def __init__(self, apply_func, window=1.0, max_latency=5.0):
+        self.apply_func = apply_func
+        self.window = max(0.0, window)
+        self.max_latency = max(self.window, max_latency)
+        
+        self._cond = threading.Condition()
+        self._apply_lock = threading.Lock()
+        self._thread = None
+        self._first_pending_at = None
+        self._last_pending_at = None
+        self._retry_at = 0.0  # 失败后下一次重试的最早时间
+        self.failures = 0     # 连续失败次数
+        
+        self.pending_version = 0    # 最新的变更版本
+        self.attempted_version = 0  # 已应用或正在应用的版本
+        self.applied_version = 0    # 最近一次成功应用的版本
+        self.reload_count = 0
+        self.skipped_count = 0
+        self.last_reload_at = None
+        self.last_duration = None
+        self.last_error = None
+    
+    @property
+    def enabled(self):
+        return self.window > 0
+    
+    def mark_dirty(self):
+        """标记配置需要更新，返回本次变更的版本号"""
+        with self._cond:
+            self.pending_version += 1
+            version = self.pending_version
+            now = time.monotonic()
+            if self._first_pending_at is None:
+                self._first_pending_at = now
+            self._last_pending_at = now
+            
+            if self.enabled:
+                self._ensure_thread()
+                self._cond.notify_all()
+        
+        if not self.enabled:
+            self.flush()
+        return version
+    
+    def flush(self, **kwargs):
+        """立即同步执行一次配置更新，返回已应用的版本号"""
+        with self._apply_lock:
+            with self._cond:
+                target = self.pending_version
+                self.attempted_version = target
+                self._first_pending_at = None
+                self._last_pending_at = None
+            
+            started = time.monotonic()
+            try:
+                changed = self.apply_func(**kwargs)
+            except Exception as e:
+                with self._cond:
+                    self.last_error = str(e)
+                    self.last_duration = time.monotonic() - started
+                    # 回退到已应用的版本，由后台线程退避后重试
+                    self.attempted_version = self.applied_version
+                    self.failures += 1
+                    now = time.monotonic()
+                    self._retry_at = now + min(self.RETRY_MAX, self.RETRY_BASE * 2 ** (self.failures - 1))
+                    if self._first_pending_at is None:
+                        self._first_pending_at = now
+                    self._last_pending_at = self._last_pending_at or now
+                    self._ensure_thread()
+                    self._cond.notify_all()
+                raise
+            
+            with self._cond:
+                self.applied_version = max(self.applied_version, target)
+                self.failures = 0
+                self._retry_at = 0.0
+                if changed is False:
+                    self.skipped_count += 1
+                else:
+                    self.reload_count += 1
+                    self.last_reload_at = datetime.now()
+                    self.last_duration = time.monotonic() - started
+                self.last_error = None
+            return target
+    
+    def status(self):
+        """获取调度器状态"""
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'window': self.window,
+                'max_latency': self.max_latency,
+                'pending_version': self.pending_version,
+                'applied_version': self.applied_version,
+                'dirty': self.pending_version > self.applied_version,
+                'failures': self.failures,
+                'retry_in': round(max(0.0, self._retry_at - time.monotonic()), 1) if self.failures else None,
+                'reloading': self._apply_lock.locked(),
+                'reload_count': self.reload_count,
+                'skipped_count': self.skipped_count,
+                'last_reload_at': self.last_reload_at.isoformat() if self.last_reload_at else None,
+                'last_duration_ms': round(self.last_duration * 1000, 1) if self.last_duration is not None else None,
+                'last_error': self.last_error
+            }
+    
+    def _ensure_thread(self):
+        """确保后台线程在运行（调用方需持有锁）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='whitelist-reload', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        """后台线程：等待合并窗口结束后执行重载"""
+        while True:
+            with self._cond:
+                while self.pending_version == self.attempted_version:
+                    self._cond.wait()
+                
+                deadline = min(self._last_pending_at + self.window,
+                               self._first_pending_at + self.max_latency)
+                # 上一次失败后的退避时间内不重试
+                deadline = max(deadline, self._retry_at)
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            
+            try:
+                version = self.flush()
+                logger.info(f"Scheduled whitelist reload applied version {version}")
+            except Exception as e:
+                logger.error(f"Scheduled whitelist reload failed ({self.failures} in a row), "
+                             f"retrying in {self._retry_at - time.monotonic():.1f}s: {e}")
 
 class WhitelistManager:
     """白名单管理类"""
     
-    def __init__(self, nginx_path, db_manager):
-        self.nginx_path = nginx_path
+    # 匹配索引检查数据库白名单版本的最短间隔（秒），用于发现其他进程的修改
+    INDEX_CHECK_INTERVAL = 1.0
+    
+    # 始终放行的默认条目（本机测试）
+    DEFAULT_ENTRIES = ('127.0.0.1', '::1')
+    
+    # 临时条目过期时间的上限（约10年）
+    MAX_EXPIRY = timedelta(days=3650)
+    
+    def __init__(self, nginx_path, db_manager, map_path=None, reload_lock_path=None,
+                 reload_window=0, reload_max_latency=0, aggregate_cidr=False, nginx_reload=True):
+        self.nginx_path = Path(nginx_path)
+        # 默认与白名单文件位于同一目录
+        self.map_path = Path(map_path) if map_path else self.nginx_path.with_name('whitelist_map.conf')
         self.db_manager = db_manager
+        self.aggregate_cidr = aggregate_cidr  # 生成映射时合并重叠/相邻网段
+        self._index = None  # 最长前缀匹配索引，首次查询时构建
+        self._index_version = None  # 索引对应的白名单版本
+        self._index_checked_at = 0.0
+        self._index_lock = threading.Lock()
+        self.reload_scheduler = ReloadScheduler(self.update_nginx_config, reload_window, reload_max_latency)
+        self.reload_lock = FileLock(reload_lock_path or self.nginx_path.with_name('reload.lock'))
+        # 由 HAProxy 执行白名单判定时 nginx 不再读取映射，变更无需重载nginx
+        self.nginx_reload = nginx_reload
+        self.haproxy_sync = None  # HAProxyMapSync，启用 HAProxy 运行时 API 同步时设置
+        self.expiry_scheduler = None  # ExpiryScheduler，本进程运行过期调度时设置
+        self.hostname_refresher = None  # HostnameRefresher，本进程运行主机名解析时设置
+        self.replication_follower = None  # ReplicationFollower，本进程作为从节点同步时设置
+    
+    @property
+    def applied_map_hash(self):
+        """最近一次成功重载的映射内容哈希（保存在数据库中，各进程共享）"""
+        return self.db_manager.get_meta('applied_map_hash')
     
     def validate_ip(self, ip_str):
-        """验证IP地址格式"""
+        """验证IP地址格式，返回 (类型, 规范化的地址)
+        
+        不是IP地址/网段但是合法的主机名时类型为 'hostname'，由后台解析为地址。
+        """
         try:
             # 如果包含斜杠，是IP段/网络地址
             if '/' in ip_str:
@@ -200,226 +1077,1003 @@ class WhitelistManager:
                 else:
                     return 'ipv6', str(ip_obj)  # 保持原始格式
         except ValueError as e:
+            # 含字母的非IP输入按主机名处理（动态DNS）
+            if '/' not in ip_str and ':' not in ip_str and ip_str.strip('0123456789.'):
+                try:
+                    return 'hostname', normalize_hostname(ip_str)
+                except ValueError:
+                    pass
             raise ValueError(f"Invalid IP address format: {e}")
     
-    def add_ip(self, ip_str, description='', user=''):
-        """添加IP到白名单"""
-        ip_type, normalized_ip = self.validate_ip(ip_str)
+    @staticmethod
+    def map_keys(item):
+        """条目在映射中对应的键：主机名条目为解析得到的地址（尚未解析时为空）"""
+        if item['ip_type'] == 'hostname':
+            return item.get('addresses') or []
+        return [item['ip']]
+    
+    def _entry_keys(self, cursor, row):
+        """移除条目时对应的映射键 [(键, 条目ID)]，主机名条目同时删除保存的解析结果"""
+        if row['ip_type'] != 'hostname':
+            return [(row['ip'], row['id'])]
+        cursor.execute("SELECT addresses FROM hostname_resolutions WHERE entry_id = ?", (row['id'],))
+        resolution = cursor.fetchone()
+        cursor.execute("DELETE FROM hostname_resolutions WHERE entry_id = ?", (row['id'],))
+        addresses = resolution['addresses'].split(',') if resolution and resolution['addresses'] else []
+        return [(address, row['id']) for address in addresses]
+    
+    def parse_expires_at(self, expires_at=None, expires_in=None):
+        """解析过期时间，返回数据库中保存的UTC时间字符串，不过期时返回 None
         
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
+        expires_at 为ISO格式时间（不带时区的按UTC处理），expires_in 为从现在起的秒数（优先）。
+        过期时间最多为 MAX_EXPIRY 之后，超出范围或无效的值抛出 ValueError。
+        """
+        now = datetime.utcnow()
+        if expires_in not in (None, ''):
+            try:
+                seconds = float(expires_in)
+            except (TypeError, ValueError):
+                raise ValueError("expires_in must be a number of seconds")
+            if not math.isfinite(seconds):
+                raise ValueError("expires_in must be a finite number of seconds")
+            if seconds > self.MAX_EXPIRY.total_seconds():
+                raise ValueError(f"expires_in must not exceed {int(self.MAX_EXPIRY.total_seconds())} seconds")
+            expires = now + timedelta(seconds=seconds)
+        elif expires_at in (None, ''):
+            return None
+        elif isinstance(expires_at, str):
+            expires = parse_utc_time(expires_at)
+        else:
+            raise ValueError("expires_at must be an ISO 8601 time")
         
-        try:
-            # 检查IP是否已存在
-            cursor.execute("SELECT id FROM whitelist WHERE ip = ? AND is_active = 1", (normalized_ip,))
-            if cursor.fetchone():
+        if expires <= now:
+            raise ValueError("Expiry time must be in the future")
+        if expires > now + self.MAX_EXPIRY:
+            raise ValueError(f"Expiry time must be within {self.MAX_EXPIRY.days} days")
+        # 数据库中精确到秒，向上取整，条目不会提前过期
+        if expires.microsecond:
+            expires = expires.replace(microsecond=0) + timedelta(seconds=1)
+        return expires.strftime('%Y-%m-%d %H:%M:%S')
+    
+    def _save_entry(self, cursor, normalized_ip, ip_type, description, user, expires_at=None):
+        """写入白名单条目（已软删除的同名条目会被重新启用）"""
+        cursor.execute("SELECT id, is_active FROM whitelist WHERE ip = ?", (normalized_ip,))
+        row = cursor.fetchone()
+        if row:
+            if row['is_active']:
                 raise ValueError("IP address already exists in whitelist")
             
-            # 添加到数据库
-            cursor.execute('''
-                INSERT INTO whitelist (ip, description, ip_type, created_by)
-                VALUES (?, ?, ?, ?)
-            ''', (normalized_ip, description, ip_type, user))
-            
-            item_id = cursor.lastrowid
-            
-            # 记录操作日志
+            # ip列有UNIQUE约束，重新添加已删除的IP时复用原记录
             cursor.execute('''
-                INSERT INTO operation_logs (user, action, target, details)
-                VALUES (?, ?, ?, ?)
-            ''', (user, 'ADD_IP', normalized_ip, description))
-            
-            conn.commit()
-            
-            # 更新nginx配置文件
-            self.update_nginx_config()
+                UPDATE whitelist
+                SET description = ?, ip_type = ?, created_by = ?, expires_at = ?,
+                    created_at = CURRENT_TIMESTAMP, is_active = 1
+                WHERE id = ?
+            ''', (description, ip_type, user, expires_at, row['id']))
+            return row['id']
+        
+        cursor.execute('''
+            INSERT INTO whitelist (ip, description, ip_type, created_by, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (normalized_ip, description, ip_type, user, expires_at))
+        return cursor.lastrowid
+    
+    def _bump_version(self, cursor):
+        """白名单版本号加一（与变更同事务提交），返回新版本号"""
+        cursor.execute('''
+            UPDATE meta SET value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE key = 'whitelist_version'
+        ''')
+        cursor.execute("SELECT value FROM meta WHERE key = 'whitelist_version'")
+        return int(cursor.fetchone()['value'])
+    
+    def _record_changes(self, cursor, version, action, entry_ids):
+        """把条目的当前内容写入变更日志（与变更同事务提交），action 为 add 或 remove"""
+        cursor.executemany('''
+            INSERT INTO whitelist_changes (version, action, ip, ip_type, description, expires_at)
+            SELECT ?, ?, ip, ip_type, description, expires_at FROM whitelist WHERE id = ?
+        ''', [(version, action, entry_id) for entry_id in entry_ids])
+    
+    def get_version(self):
+        """获取白名单版本号和最后修改时间（UTC），返回 (version, updated_at)"""
+        with self.db_manager.connection() as conn:
+            row = conn.execute(
+                "SELECT value, updated_at FROM meta WHERE key = 'whitelist_version'"
+            ).fetchone()
+        if row is None:
+            return 0, None
+        updated_at = datetime.strptime(row['updated_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        return int(row['value']), updated_at
+    
+    def get_whitelist_count(self):
+        """获取有效白名单条目数"""
+        with self.db_manager.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM whitelist WHERE is_active = 1").fetchone()[0]
+    
+    def add_ip(self, ip_str, description='', user='', expires_at=None, expires_in=None):
+        """添加IP到白名单，设置过期时间（见 parse_expires_at）时到期后自动移除"""
+        ip_type, normalized_ip = self.validate_ip(ip_str)
+        expires_at = self.parse_expires_at(expires_at, expires_in)
+        
+        with self.db_manager.connection('whitelist_write') as conn:
+            cursor = conn.cursor()
             
-            logger.info(f"IP {normalized_ip} added to whitelist by {user}")
-            return item_id
+            try:
+                # 添加到数据库
+                item_id = self._save_entry(cursor, normalized_ip, ip_type, description, user, expires_at)
+                version = self._bump_version(cursor)
+                self._record_changes(cursor, version, 'add', [item_id])
+                
+                # 记录操作日志
+                cursor.execute('''
+                    INSERT INTO operation_logs (user, action, target, details)
+                    VALUES (?, ?, ?, ?)
+                ''', (user, 'ADD_IP', normalized_ip, description))
+                
+                conn.commit()
+                
+                # 更新索引和nginx配置文件（由重载调度器合并执行），主机名条目解析后才会加入映射
+                if ip_type == 'hostname':
+                    self.apply_changes(version=version)
+                    self.notify_hostnames()
+                else:
+                    self.apply_changes(added=[(normalized_ip, item_id)], version=version)
+                if expires_at:
+                    self.notify_expiry()
+                
+                logger.info(f"IP {normalized_ip} added to whitelist by {user}")
+                return item_id
             
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise e
     
     def remove_ip(self, item_id, user=''):
         """从白名单移除IP"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # 获取IP信息
-            cursor.execute("SELECT ip FROM whitelist WHERE id = ? AND is_active = 1", (item_id,))
-            row = cursor.fetchone()
-            if not row:
-                raise ValueError("IP not found in whitelist")
-            
-            ip_addr = row['ip']
-            
-            # 标记为删除（软删除）
-            cursor.execute(
-                "UPDATE whitelist SET is_active = 0 WHERE id = ?",
-                (item_id,)
-            )
+        with self.db_manager.connection('whitelist_write') as conn:
+            cursor = conn.cursor()
             
-            # 记录操作日志
-            cursor.execute('''
-                INSERT INTO operation_logs (user, action, target)
-                VALUES (?, ?, ?)
-            ''', (user, 'REMOVE_IP', ip_addr))
+            try:
+                # 获取IP信息
+                cursor.execute("SELECT id, ip, ip_type FROM whitelist WHERE id = ? AND is_active = 1", (item_id,))
+                row = cursor.fetchone()
+                if not row:
+                    raise ValueError("IP not found in whitelist")
+                
+                ip_addr = row['ip']
+                
+                # 标记为删除（软删除）
+                cursor.execute(
+                    "UPDATE whitelist SET is_active = 0 WHERE id = ?",
+                    (item_id,)
+                )
+                removed = self._entry_keys(cursor, row)
+                version = self._bump_version(cursor)
+                self._record_changes(cursor, version, 'remove', [item_id])
+                
+                # 记录操作日志
+                cursor.execute('''
+                    INSERT INTO operation_logs (user, action, target)
+                    VALUES (?, ?, ?)
+                ''', (user, 'REMOVE_IP', ip_addr))
+                
+                conn.commit()
+                
+                # 更新索引和nginx配置文件（由重载调度器合并执行）
+                self.apply_changes(removed=removed, version=version)
+                
+                logger.info(f"IP {ip_addr} removed from whitelist by {user}")
             
-            conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+    
+    def bulk_add_ips(self, items, user=''):
+        """批量添加IP到白名单（单个事务，只重载一次）
+        
+        items 中每一项可以是IP字符串，或 {'ip': ..., 'description': ..., 'expires_at': ..., 'expires_in': ...} 字典。
+        返回每个条目的处理结果，单个条目失败不影响其他条目。
+        """
+        results = []
+        pending = []
+        seen = set()
+        
+        # 先校验整个批次
+        for index, item in enumerate(items):
+            expiry = {}
+            if isinstance(item, dict):
+                ip_str = str(item.get('ip') or '').strip()
+                description = str(item.get('description') or '').strip()
+                expiry = {'expires_at': item.get('expires_at'), 'expires_in': item.get('expires_in')}
+            else:
+                ip_str = str(item or '').strip()
+                description = ''
             
-            # 更新nginx配置文件
-            self.update_nginx_config()
+            result = {'index': index, 'ip': ip_str, 'success': False}
+            results.append(result)
             
-            logger.info(f"IP {ip_addr} removed from whitelist by {user}")
+            try:
+                if not ip_str:
+                    raise ValueError("IP address is required")
+                ip_type, normalized_ip = self.validate_ip(ip_str)
+                expires_at = self.parse_expires_at(**expiry)
+                if normalized_ip in seen:
+                    raise ValueError("Duplicate IP address in batch")
+                seen.add(normalized_ip)
+            except ValueError as e:
+                result['message'] = str(e)
+                continue
             
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
-    
-    def get_whitelist(self):
-        """获取白名单列表"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
+            result['ip'] = normalized_ip
+            pending.append((result, normalized_ip, ip_type, description, expires_at))
         
-        cursor.execute('''
-            SELECT id, ip, description, ip_type, created_at, created_by
-            FROM whitelist
-            WHERE is_active = 1
-            ORDER BY created_at DESC
-        ''')
+        added_entries = []
+        version = None
+        if pending:
+            with self.db_manager.connection('whitelist_write') as conn:
+                cursor = conn.cursor()
+                
+                try:
+                    log_rows = []
+                    for result, normalized_ip, ip_type, description, expires_at in pending:
+                        try:
+                            result['id'] = self._save_entry(cursor, normalized_ip, ip_type, description, user,
+                                                            expires_at)
+                        except ValueError as e:
+                            result['message'] = str(e)
+                            continue
+                        
+                        result['success'] = True
+                        log_rows.append((user, 'ADD_IP', normalized_ip, description))
+                        if ip_type != 'hostname':
+                            added_entries.append((normalized_ip, result['id']))
+                    
+                    if log_rows:
+                        version = self._bump_version(cursor)
+                        self._record_changes(cursor, version, 'add',
+                                             [result['id'] for result, *_ in pending if result['success']])
+                    
+                    # 记录操作日志
+                    cursor.executemany('''
+                        INSERT INTO operation_logs (user, action, target, details)
+                        VALUES (?, ?, ?, ?)
+                    ''', log_rows)
+                    
+                    conn.commit()
+                
+                except Exception as e:
+                    conn.rollback()
+                    raise e
         
-        items = []
-        for row in cursor.fetchall():
-            items.append({
-                'id': row['id'],
-                'ip': row['ip'],
-                'description': row['description'] or '',
-                'ip_type': row['ip_type'],
-                'created_at': row['created_at'],
-                'created_by': row['created_by'] or ''
-            })
+        added = sum(1 for result in results if result['success'])
+        reload_version = None
+        if added:
+            # 整个批次只更新一次nginx配置
+            reload_version = self.apply_changes(added=added_entries, version=version)
+            if any(expires_at for *_, expires_at in pending):
+                self.notify_expiry()
+            if any(ip_type == 'hostname' for _, _, ip_type, _, _ in pending):
+                self.notify_hostnames()
         
-        conn.close()
-        return items
+        logger.info(f"Bulk add by {user}: {added} added, {len(results) - added} failed")
+        return {
+            'added': added,
+            'failed': len(results) - added,
+            'reload_version': reload_version,
+            'results': results
+        }
     
-    def generate_whitelist_map(self):
-        """生成nginx白名单映射配置文件"""
-        try:
-            map_lines = [
-                f"# 白名单映射文件 - 自动生成 {datetime.now().strftime('%a %b %d %H:%M:%S UTC %Y')}",
-                "# 格式: IP地址 1;"
-            ]
-            
-            # 添加默认条目 (localhost)
-            map_lines.extend([
-                "127.0.0.1 1;",
-                "::1 1;"
-            ])
-            
-            # 从数据库获取活跃的白名单条目
-            whitelist = self.get_whitelist()
-            
-            for item in whitelist:
-                ip = item['ip'].strip()
-                if ip and not ip.startswith('#'):
-                    # 确保IP格式正确并添加映射条目
-                    map_lines.append(f"{ip} 1;")
+    def bulk_remove_ips(self, items, user=''):
+        """批量从白名单移除IP（单个事务，只重载一次）
+        
+        items 中每一项可以是白名单条目ID，或IP/CIDR字符串。
+        """
+        results = []
+        removed_entries = []
+        version = None
+        
+        with self.db_manager.connection('whitelist_write') as conn:
+            cursor = conn.cursor()
             
-            # 确保目录存在
-            map_path = NGINX_MAP_PATH
-            map_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # 写入映射文件
             try:
-                map_path.write_text('\n'.join(map_lines), encoding='utf-8')
-                logger.info(f"Generated whitelist map with {len(map_lines)-2} entries at {map_path}")
-            except PermissionError as pe:
-                logger.error(f"Permission denied writing to {map_path}: {pe}")
-                # 尝试备用方案：直接写入临时位置
-                import tempfile
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.conf', delete=False) as tmp:
-                    tmp.write('\n'.join(map_lines))
-                    tmp.flush()
-                    # 尝试移动到目标位置
-                    import shutil
+                log_rows = []
+                removed_ids = set()
+                for index, item in enumerate(items):
+                    result = {'index': index, 'item': item, 'success': False}
+                    results.append(result)
+                    
                     try:
-                        shutil.move(tmp.name, str(map_path))
-                        logger.info(f"Successfully moved temp file to {map_path}")
-                    except Exception as move_err:
-                        logger.error(f"Failed to move temp file: {move_err}")
-                        raise move_err
+                        if isinstance(item, int) and not isinstance(item, bool):
+                            cursor.execute(
+                                "SELECT id, ip, ip_type FROM whitelist WHERE id = ? AND is_active = 1",
+                                (item,)
+                            )
+                        elif isinstance(item, str) and item.strip():
+                            _, normalized_ip = self.validate_ip(item.strip())
+                            cursor.execute(
+                                "SELECT id, ip, ip_type FROM whitelist WHERE ip = ? AND is_active = 1",
+                                (normalized_ip,)
+                            )
+                        else:
+                            raise ValueError("Item must be a whitelist id or an IP address")
+                        
+                        row = cursor.fetchone()
+                        if not row or row['id'] in removed_ids:
+                            raise ValueError("IP not found in whitelist")
+                    except ValueError as e:
+                        result['message'] = str(e)
+                        continue
+                    
+                    cursor.execute("UPDATE whitelist SET is_active = 0 WHERE id = ?", (row['id'],))
+                    removed_ids.add(row['id'])
+                    log_rows.append((user, 'REMOVE_IP', row['ip']))
+                    
+                    result.update({'success': True, 'id': row['id'], 'ip': row['ip']})
+                    removed_entries.extend(self._entry_keys(cursor, row))
+                
+                if removed_ids:
+                    version = self._bump_version(cursor)
+                    self._record_changes(cursor, version, 'remove',
+                                         [result['id'] for result in results if result['success']])
+                
+                # 记录操作日志
+                cursor.executemany('''
+                    INSERT INTO operation_logs (user, action, target)
+                    VALUES (?, ?, ?)
+                ''', log_rows)
+                
+                conn.commit()
             
-            return len(map_lines) - 2  # 减去注释行数
+            except Exception as e:
+                conn.rollback()
+                raise e
             
-        except Exception as e:
-            logger.error(f"Error generating whitelist map: {e}")
-            logger.error(f"Map path: {NGINX_MAP_PATH}")
-            logger.error(f"Map path exists: {NGINX_MAP_PATH.parent.exists()}")
-            logger.error(f"Map path writable: {os.access(NGINX_MAP_PATH.parent, os.W_OK) if NGINX_MAP_PATH.parent.exists() else 'Unknown'}")
-            raise e
-
-    def update_nginx_config(self):
-        """更新nginx白名单配置文件"""
-        try:
-            logger.info("Starting nginx config update...")
-            whitelist = self.get_whitelist()
-            logger.info(f"Retrieved {len(whitelist)} whitelist entries")
+            removed = len(removed_ids)
+            reload_version = None
+            if removed:
+                # 整个批次只更新一次nginx配置
+                reload_version = self.apply_changes(removed=removed_entries, version=version)
             
-            # 生成白名单IP列表 (新格式: 每行一个IP)
-            ip_lines = [
-                "# MTProxy 白名单配置文件",
-                "# This file is automatically generated and managed by the web interface",
-                f"# Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                f"# Total entries: {len(whitelist)}",
-                "",
-                "# Default entries (localhost for testing)",
-                "127.0.0.1",
-                "::1",
-                "",
-                "# User added entries",
-            ]
+            logger.info(f"Bulk remove by {user}: {removed} removed, {len(results) - removed} failed")
+            return {
+                'removed': removed,
+                'failed': len(results) - removed,
+                'reload_version': reload_version,
+                'results': results
+            }
+    
+    def next_expiry(self):
+        """最近一个有效条目的过期时间（UTC），没有会过期的条目时返回 None"""
+        with self.db_manager.connection() as conn:
+            row = conn.execute('''
+                SELECT MIN(expires_at) FROM whitelist
+                WHERE is_active = 1 AND expires_at IS NOT NULL
+            ''').fetchone()
+        if row[0] is None:
+            return None
+        return datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S')
+    
+    def expire_entries(self, now=None):
+        """移除所有已到期的条目（单个事务，只重载一次），返回移除的 (ip, id) 列表"""
+        now = (now or datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S')
+        with self.db_manager.connection('whitelist_write') as conn:
+            cursor = conn.cursor()
             
-            for item in whitelist:
-                # 添加注释说明 (如果有描述)
-                if item['description']:
-                    ip_lines.append(f"# {item['description']}")
-                ip_lines.append(item['ip'])
+            try:
+                cursor.execute('''
+                    SELECT id, ip, ip_type, expires_at FROM whitelist
+                    WHERE is_active = 1 AND expires_at IS NOT NULL AND expires_at <= ?
+                ''', (now,))
+                rows = cursor.fetchall()
+                if not rows:
+                    return []
+                
+                cursor.executemany("UPDATE whitelist SET is_active = 0 WHERE id = ?",
+                                   [(row['id'],) for row in rows])
+                removed = [key for row in rows for key in self._entry_keys(cursor, row)]
+                version = self._bump_version(cursor)
+                self._record_changes(cursor, version, 'remove', [row['id'] for row in rows])
+                
+                # 记录操作日志
+                cursor.executemany('''
+                    INSERT INTO operation_logs (user, action, target, details)
+                    VALUES (?, ?, ?, ?)
+                ''', [('system', 'EXPIRE_IP', row['ip'], f"expired at {row['expires_at']} UTC") for row in rows])
+                
+                conn.commit()
             
-            # 写入白名单文件
-            logger.info(f"Writing whitelist to {self.nginx_path}")
-            self.nginx_path.write_text('\n'.join(ip_lines), encoding='utf-8')
-            logger.info("Whitelist file written successfully")
+            except Exception as e:
+                conn.rollback()
+                raise e
+        
+        expired = [(row['ip'], row['id']) for row in rows]
+        # 所有到期条目只更新一次nginx配置
+        self.apply_changes(removed=removed, version=version)
+        logger.info(f"Expired {len(expired)} whitelist entries: {', '.join(ip for ip, _ in expired[:10])}")
+        return expired
+    
+    def get_due_hostnames(self, now=None):
+        """需要（重新）解析的主机名条目 [(条目ID, 主机名)]：从未解析过或已到刷新时间"""
+        now = (now or datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S')
+        with self.db_manager.connection() as conn:
+            rows = conn.execute('''
+                SELECT w.id, w.ip FROM whitelist w
+                LEFT JOIN hostname_resolutions r ON r.entry_id = w.id
+                WHERE w.ip_type = 'hostname' AND w.is_active = 1
+                  AND (r.refresh_at IS NULL OR r.refresh_at <= ?)
+            ''', (now,)).fetchall()
+        return [(row['id'], row['ip']) for row in rows]
+    
+    def next_hostname_refresh(self):
+        """最近一个主机名条目的刷新时间（UTC），有未解析的条目时为当前时间，没有主机名条目时返回 None"""
+        with self.db_manager.connection() as conn:
+            row = conn.execute('''
+                SELECT COUNT(*), MIN(COALESCE(r.refresh_at, '')) FROM whitelist w
+                LEFT JOIN hostname_resolutions r ON r.entry_id = w.id
+                WHERE w.ip_type = 'hostname' AND w.is_active = 1
+            ''').fetchone()
+        if not row[0]:
+            return None
+        if not row[1]:
+            return datetime.utcnow()
+        return datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S')
+    
+    def save_resolutions(self, results, now=None):
+        """保存一轮解析结果（单个事务），只有地址集合变化时才更新版本号并请求一次重载
+        
+        results 为 [(条目ID, 地址列表, 刷新间隔秒数, 错误信息)]，解析失败时地址列表为 None，保留上一次的结果。
+        返回 {'changed': 条目数, 'added': 地址数, 'removed': 地址数}。
+        """
+        now = now or datetime.utcnow()
+        resolved_at = now.strftime('%Y-%m-%d %H:%M:%S')
+        added, removed = [], []
+        changed = 0
+        version = None
+        with self.db_manager.connection('whitelist_write') as conn:
+            cursor = conn.cursor()
             
-            # 生成nginx映射文件 - 新增关键步骤
-            logger.info("Generating whitelist map...")
-            map_entries = self.generate_whitelist_map()
-            logger.info(f"Map generation completed with {map_entries} entries")
+            try:
+                # 先取得写锁再读取当前结果，避免与条目删除交错
+                cursor.execute('BEGIN IMMEDIATE')
+                for entry_id, addresses, ttl, error in results:
+                    cursor.execute('''
+                        SELECT w.is_active, r.addresses FROM whitelist w
+                        LEFT JOIN hostname_resolutions r ON r.entry_id = w.id
+                        WHERE w.id = ? AND w.ip_type = 'hostname'
+                    ''', (entry_id,))
+                    row = cursor.fetchone()
+                    if not row or not row['is_active']:
+                        continue  # 解析期间条目已被删除
+                    
+                    refresh_at = (now + timedelta(seconds=ttl)).strftime('%Y-%m-%d %H:%M:%S')
+                    current = set(row['addresses'].split(',')) if row['addresses'] else set()
+                    if addresses is None:
+                        cursor.execute('''
+                            INSERT INTO hostname_resolutions (entry_id, refresh_at, last_error) VALUES (?, ?, ?)
+                            ON CONFLICT(entry_id) DO UPDATE SET
+                                refresh_at = excluded.refresh_at, last_error = excluded.last_error
+                        ''', (entry_id, refresh_at, error))
+                        continue
+                    
+                    new = set(addresses)
+                    if new != current:
+                        changed += 1
+                        added.extend((address, entry_id) for address in sorted(new - current))
+                        removed.extend((address, entry_id) for address in sorted(current - new))
+                    cursor.execute('''
+                        INSERT INTO hostname_resolutions (entry_id, addresses, ttl, resolved_at, refresh_at, last_error)
+                        VALUES (?, ?, ?, ?, ?, NULL)
+                        ON CONFLICT(entry_id) DO UPDATE SET
+                            addresses = excluded.addresses, ttl = excluded.ttl, resolved_at = excluded.resolved_at,
+                            refresh_at = excluded.refresh_at, last_error = NULL
+                    ''', (entry_id, ','.join(sorted(new)), int(ttl), resolved_at, refresh_at))
+                
+                if changed:
+                    version = self._bump_version(cursor)
+                conn.commit()
             
-            # 调用白名单重载脚本
-            logger.info("Calling reload whitelist...")
-            self.reload_whitelist()
-            logger.info("Reload completed successfully")
+            except Exception as e:
+                conn.rollback()
+                raise e
+        
+        if changed:
+            # 整轮解析只更新一次nginx配置
+            self.apply_changes(added=added, removed=removed, version=version)
+            logger.info(f"Hostname resolution changed {changed} entries (+{len(added)} -{len(removed)} addresses)")
+        return {'changed': changed, 'added': len(added), 'removed': len(removed)}
+    
+    def get_changes(self, since, limit=1000):
+        """版本 since 之后的白名单变更（从节点增量同步），每个版本的变更完整返回
+        
+        返回 {'version': 本批次同步到的版本, 'current_version', 'has_more', 'snapshot_required', 'changes'}；
+        since 早于变更日志的起点（已被清理或升级前的版本）或大于当前版本时 snapshot_required 为 True。
+        """
+        with self.db_manager.connection() as conn:
+            # 在同一个读事务中读取版本号和变更日志
+            conn.execute('BEGIN')
+            current = int(conn.execute("SELECT value FROM meta WHERE key = 'whitelist_version'").fetchone()[0])
+            row = conn.execute("SELECT value FROM meta WHERE key = 'changelog_start'").fetchone()
+            start = int(row[0]) if row else current
+            if since < start or since > current:
+                return {'version': current, 'current_version': current, 'has_more': False,
+                        'snapshot_required': True, 'changes': []}
+            
+            query = '''
+                SELECT version, action, ip, ip_type, description, expires_at FROM whitelist_changes
+                WHERE {} ORDER BY seq
+            '''
+            rows = conn.execute(query.format('version > ?') + ' LIMIT ?', (since, limit + 1)).fetchall()
+            has_more = len(rows) > limit
+            if has_more:
+                # 不拆分同一版本的变更，单个版本的变更超过 limit 时整体返回
+                boundary = rows[limit]['version']
+                rows = [row for row in rows[:limit] if row['version'] < boundary]
+                if not rows:
+                    rows = conn.execute(query.format('version = ?'), (boundary,)).fetchall()
+                version = rows[-1]['version']
+            else:
+                version = current
+        
+        return {
+            'version': version,
+            'current_version': current,
+            'has_more': has_more,
+            'snapshot_required': False,
+            'changes': [dict(row) for row in rows]
+        }
+    
+    def get_snapshot(self):
+        """全量快照（新从节点初始化）：当前版本号和全部有效条目"""
+        with self.db_manager.connection() as conn:
+            conn.execute('BEGIN')
+            version = int(conn.execute("SELECT value FROM meta WHERE key = 'whitelist_version'").fetchone()[0])
+            rows = conn.execute('''
+                SELECT ip, ip_type, description, expires_at FROM whitelist
+                WHERE is_active = 1 ORDER BY id
+            ''').fetchall()
+        return {'version': version, 'entries': [dict(row) for row in rows]}
+    
+    def get_replica_version(self):
+        """从节点已同步到的主节点版本号，从未同步时返回 None"""
+        value = self.db_manager.get_meta('replica_version')
+        return int(value) if value is not None else None
+    
+    def apply_replica(self, changes, version, snapshot=False, source=''):
+        """应用从主节点拉取的一批变更（单个事务，只重载一次）
+        
+        changes 为按版本排列的变更（get_changes 的 changes），snapshot 为 True 时为主节点的全部有效条目，
+        本地多出的条目被移除。version 为对应的主节点版本号，保存为 replica_version。
+        条目按IP对应（各节点的条目ID不同），返回 {'added': 数量, 'removed': 数量, 'updated': 数量}。
+        """
+        # 同一IP只需应用最后一次变更
+        final = {}
+        for change in changes:
+            final[change['ip']] = dict(change, action='add') if snapshot else change
+        
+        added, removed = [], []
+        added_ids, removed_ids, updated_ids = [], [], []
+        hostnames = expiring = False
+        local_version = None
+        with self.db_manager.connection('whitelist_write') as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                if snapshot:
+                    cursor.execute("SELECT ip FROM whitelist WHERE is_active = 1")
+                    for row in cursor.fetchall():
+                        final.setdefault(row['ip'], {'action': 'remove', 'ip': row['ip']})
+                
+                for ip, change in final.items():
+                    cursor.execute('''
+                        SELECT id, ip, ip_type, description, expires_at, is_active FROM whitelist WHERE ip = ?
+                    ''', (ip,))
+                    row = cursor.fetchone()
+                    if change['action'] == 'remove':
+                        if row and row['is_active']:
+                            cursor.execute("UPDATE whitelist SET is_active = 0 WHERE id = ?", (row['id'],))
+                            removed.extend(self._entry_keys(cursor, row))
+                            removed_ids.append(row['id'])
+                        continue
+                    
+                    description = change.get('description') or ''
+                    expires_at = change.get('expires_at')
+                    if row and row['is_active']:
+                        if ((row['description'] or ''), row['expires_at']) != (description, expires_at):
+                            cursor.execute("UPDATE whitelist SET description = ?, expires_at = ? WHERE id = ?",
+                                           (description, expires_at, row['id']))
+                            updated_ids.append(row['id'])
+                        continue
+                    
+                    entry_id = self._save_entry(cursor, ip, change['ip_type'], description, 'replication',
+                                                expires_at)
+                    added_ids.append(entry_id)
+                    if change['ip_type'] == 'hostname':
+                        hostnames = True
+                    else:
+                        added.append((ip, entry_id))
+                    expiring = expiring or bool(expires_at)
+                
+                if added_ids or removed_ids or updated_ids:
+                    local_version = self._bump_version(cursor)
+                    # 本节点的变更日志同样记录，可以继续作为其他从节点的主节点
+                    self._record_changes(cursor, local_version, 'add', added_ids + updated_ids)
+                    self._record_changes(cursor, local_version, 'remove', removed_ids)
+                    cursor.execute('''
+                        INSERT INTO operation_logs (user, action, target, details)
+                        VALUES (?, ?, ?, ?)
+                    ''', ('replication', 'REPLICATE', source,
+                          f"{'snapshot' if snapshot else 'changes'} at version {version}: "
+                          f"+{len(added_ids)} -{len(removed_ids)} ~{len(updated_ids)}"))
+                
+                cursor.execute('''
+                    INSERT INTO meta (key, value, updated_at) VALUES ('replica_version', ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+                ''', (str(version),))
+                conn.commit()
             
-            logger.info(f"Nginx whitelist config updated with {len(whitelist)} entries")
-            logger.info(f"Nginx map config updated with {map_entries} map entries")
+            except Exception as e:
+                conn.rollback()
+                raise e
+        
+        if local_version is not None:
+            # 整批变更只更新一次nginx配置
+            self.apply_changes(added=added, removed=removed, version=local_version)
+            if hostnames:
+                self.notify_hostnames()
+            if expiring:
+                self.notify_expiry()
+        return {'added': len(added_ids), 'removed': len(removed_ids), 'updated': len(updated_ids)}
+    
+    def notify_hostnames(self):
+        """新增了主机名条目，唤醒本进程的后台解析"""
+        if self.hostname_refresher is not None:
+            self.hostname_refresher.wake()
+    
+    def notify_expiry(self):
+        """新增了带过期时间的条目，唤醒本进程的过期调度重新计算下一个到期时间"""
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.wake()
+    
+    def request_reload(self):
+        """请求重新生成nginx配置并重载，返回变更版本号"""
+        return self.reload_scheduler.mark_dirty()
+    
+    def apply_changes(self, added=(), removed=(), version=None):
+        """白名单变更提交后调用：增量更新匹配索引和 HAProxy 映射，并请求重载nginx
+        
+        added/removed 为 (ip, entry_id) 列表，version 为本次变更后的白名单版本，
+        返回重载调度的变更版本号（不重载nginx时为 None）。
+        """
+        with self._index_lock:
+            if self._index is not None:
+                if version is not None and version == self._index_version + 1:
+                    for ip, entry_id in removed:
+                        self._index.remove(ip, entry_id)
+                    for ip, entry_id in added:
+                        self._index.add(ip, entry_id)
+                    self._index_version = version
+                else:
+                    # 期间其他进程也修改了白名单，下次查询时重建
+                    self._index = None
+        
+        if self.haproxy_sync is not None:
+            # 默认条目始终保留在映射中；多个条目可能对应同一个键（IP条目与主机名的解析结果相同），
+            # del map 会删除该键的全部条目：只删除变更后不再有条目对应的键，其他条目已对应的键也不重复添加
+            added_keys = list(dict.fromkeys(ip for ip, _ in added))
+            removed_keys = list(dict.fromkeys(ip for ip, _ in removed if ip not in self.DEFAULT_ENTRIES))
+            present = self.mapped_keys(added_keys, exclude_ids={entry_id for _, entry_id in added})
+            still_mapped = self.mapped_keys(removed_keys)
+            self.haproxy_sync.push(
+                added=[ip for ip in added_keys if ip not in present],
+                removed=[ip for ip in removed_keys if ip not in still_mapped]
+            )
+        if not self.nginx_reload:
+            return None
+        return self.request_reload()
+    
+    def mapped_keys(self, keys, exclude_ids=()):
+        """keys 中有有效条目（exclude_ids 以外）对应的映射键：IP/网段条目本身或主机名条目的解析结果"""
+        remaining = set(keys)
+        exclude_ids = set(exclude_ids)
+        found = set()
+        if not remaining:
+            return found
+        with self.db_manager.connection() as conn:
+            pending = sorted(remaining)
+            for start in range(0, len(pending), 500):
+                chunk = pending[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, ip FROM whitelist WHERE is_active = 1 AND ip IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(row['ip'] for row in rows if row['id'] not in exclude_ids)
+            remaining -= found
+            if remaining:
+                rows = conn.execute('''
+                    SELECT r.entry_id, r.addresses FROM hostname_resolutions r
+                    JOIN whitelist w ON w.id = r.entry_id
+                    WHERE w.is_active = 1 AND r.addresses != ''
+                ''').fetchall()
+                for row in rows:
+                    if row['entry_id'] not in exclude_ids:
+                        found.update(remaining.intersection(row['addresses'].split(',')))
+        return found
+    
+    def build_haproxy_entries(self):
+        """HAProxy 映射的键列表（不合并网段，与增量推送的条目一致）"""
+        return self.build_map_entries(aggregate=False)
+    
+    def save_haproxy_map(self, entries):
+        """保存 HAProxy 映射文件（HAProxy 启动时加载，运行中的修改通过运行时 API 完成）"""
+        lines = [f"# 白名单映射文件 - 自动生成 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"]
+        lines.extend(f"{ip} 1" for ip in entries)
+        atomic_write_text(self.haproxy_sync.map_name, '\n'.join(lines) + '\n')
+    
+    def get_index(self):
+        """获取白名单匹配索引（首次使用或白名单版本变化时从数据库构建）"""
+        index = self._index
+        now = time.monotonic()
+        if index is not None and now - self._index_checked_at < self.INDEX_CHECK_INTERVAL:
+            return index
+        
+        version, _ = self.get_version()
+        with self._index_lock:
+            self._index_checked_at = now
+            if self._index is None or self._index_version != version:
+                entries = [(ip, None) for ip in self.DEFAULT_ENTRIES]
+                entries.extend((key, item['id']) for item in self.get_whitelist() for key in self.map_keys(item))
+                self._index = PrefixIndex.build(entries)
+                self._index_version = version
+                logger.info(f"Whitelist index built with {len(self._index)} entries (version {version})")
+            return self._index
+    
+    def check_ip(self, ip_str):
+        """查询IP是否被白名单允许，返回匹配的条目"""
+        match = self.get_index().lookup(ip_str.strip())
+        return {
+            'ip': ip_str,
+            'allowed': match is not None,
+            'entry_id': match[0] if match else None,
+            'cidr': match[1] if match else None
+        }
+    
+    def get_whitelist(self):
+        """获取白名单列表"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT w.id, w.ip, w.description, w.ip_type, w.created_at, w.created_by, w.expires_at,
+                       r.addresses, r.resolved_at, r.last_error
+                FROM whitelist w
+                LEFT JOIN hostname_resolutions r ON r.entry_id = w.id
+                WHERE w.is_active = 1
+                ORDER BY w.created_at DESC
+            ''')
+            
+            items = []
+            for row in cursor.fetchall():
+                item = {
+                    'id': row['id'],
+                    'ip': row['ip'],
+                    'description': row['description'] or '',
+                    'ip_type': row['ip_type'],
+                    'created_at': row['created_at'],
+                    'created_by': row['created_by'] or '',
+                    'expires_at': row['expires_at']
+                }
+                if row['ip_type'] == 'hostname':
+                    # 后台解析的结果，生成映射时使用
+                    item['addresses'] = row['addresses'].split(',') if row['addresses'] else []
+                    item['resolved_at'] = row['resolved_at']
+                    item['resolve_error'] = row['last_error']
+                items.append(item)
+            
+            return items
+    
+    def build_map_entries(self, whitelist=None, aggregate=None):
+        """生成去重后的映射条目列表（包含默认的localhost条目）
+        
+        aggregate 为 None 时按 aggregate_cidr 配置决定是否合并网段。
+        """
+        if whitelist is None:
+            whitelist = self.get_whitelist()
+        if aggregate is None:
+            aggregate = self.aggregate_cidr
+        
+        entries = []
+        seen = set()
+        for ip in list(self.DEFAULT_ENTRIES) + [key for item in whitelist for key in self.map_keys(item)]:
+            ip = ip.strip()
+            if not ip or ip.startswith('#'):
+                continue
+            # 按网络去重，1.2.3.4 与 1.2.3.4/32 视为同一条目
+            try:
+                key = ipaddress.ip_network(ip, strict=False)
+            except ValueError:
+                logger.warning(f"Skipping invalid whitelist entry: {ip}")
+                continue
+            if key in seen:
+                continue
+            seen.add(key)
+            entries.append(ip)
+        
+        if aggregate:
+            entries = self.aggregate_entries(entries)
+        
+        return entries
+    
+    def aggregate_entries(self, entries):
+        """将条目合并为最小的CIDR集合（数据库中的原始条目不变）"""
+        networks = {4: [], 6: []}
+        for ip in entries:
+            net = ipaddress.ip_network(ip, strict=False)
+            networks[net.version].append(net)
+        
+        aggregated = []
+        for version in (4, 6):
+            for net in ipaddress.collapse_addresses(networks[version]):
+                # 单个地址保持不带前缀长度的写法
+                if net.prefixlen == net.max_prefixlen:
+                    aggregated.append(str(net.network_address))
+                else:
+                    aggregated.append(str(net))
+        return aggregated
+    
+    def get_redundancy_report(self):
+        """分析白名单中的冗余条目
+        
+        shadowed: 已被其他（更宽或相同）网段完全覆盖的条目
+        mergeable: 可以与相邻条目合并为更大网段的条目组
+        """
+        whitelist = self.get_whitelist()
+        
+        parsed = {4: [], 6: []}
+        for item in whitelist:
+            try:
+                net = ipaddress.ip_network(item['ip'], strict=False)
+            except ValueError:
+                continue
+            parsed[net.version].append((net, item))
+        
+        shadowed = []
+        mergeable = []
+        for version in (4, 6):
+            # 按起始地址排序，同起点时更宽的网段在前，相同网段按ID排序
+            items = sorted(parsed[version], key=lambda x: (x[0].network_address, x[0].prefixlen, x[1]['id']))
             
+            kept = []
+            cover = None
+            for net, item in items:
+                if cover is not None and net.subnet_of(cover[0]):
+                    shadowed.append({
+                        'id': item['id'],
+                        'ip': item['ip'],
+                        'covered_by_id': cover[1]['id'],
+                        'covered_by': cover[1]['ip']
+                    })
+                    continue
+                cover = (net, item)
+                kept.append((net, item))
+            
+            # collapse_addresses 的结果有序，与 kept 双指针对齐
+            index = 0
+            for collapsed in ipaddress.collapse_addresses([net for net, _ in kept]):
+                group = []
+                while index < len(kept) and kept[index][0].subnet_of(collapsed):
+                    group.append(kept[index][1])
+                    index += 1
+                if len(group) > 1:
+                    mergeable.append({
+                        'cidr': str(collapsed),
+                        'entries': [{'id': item['id'], 'ip': item['ip']} for item in group]
+                    })
+        
+        map_entries = self.aggregate_entries([item['ip'] for item in whitelist if item['ip_type'] != 'hostname'])
+        return {
+            'total_entries': len(whitelist),
+            'aggregated_entries': len(map_entries),
+            'aggregation_enabled': self.aggregate_cidr,
+            'shadowed': shadowed,
+            'mergeable': mergeable
+        }
+    
+    def generate_whitelist_map(self, entries=None):
+        """生成nginx白名单映射配置文件，返回条目数"""
+        if entries is None:
+            entries = self.build_map_entries()
+        
+        map_lines = [
+            f"# 白名单映射文件 - 自动生成 {datetime.now().strftime('%a %b %d %H:%M:%S UTC %Y')}",
+            "# 格式: IP地址 1;"
+        ]
+        map_lines.extend(f"{ip} 1;" for ip in entries)
+        
+        try:
+            atomic_write_text(self.map_path, '\n'.join(map_lines) + '\n')
         except Exception as e:
-            logger.error(f"Error updating nginx config: {e}")
-            import traceback
-            logger.error(f"Full traceback: {traceback.format_exc()}")
+            logger.error(f"Error generating whitelist map at {self.map_path}: {e}")
             raise e
+        
+        logger.info(f"Generated whitelist map with {len(entries)} entries at {self.map_path}")
+        return len(entries)
+    
+    def update_nginx_config(self, force=False):
+        """更新nginx白名单配置文件
+
+        映射内容与上次成功应用的内容相同时跳过写入和重载，返回是否执行了重载。
+        多个 worker 进程之间通过文件锁串行执行。
+        """
+        with self.reload_lock:
+            started = time.perf_counter()
+            try:
+                whitelist = self.get_whitelist()
+                entries = self.build_map_entries(whitelist)
+                
+                map_hash = hashlib.sha256('\n'.join(entries).encode('utf-8')).hexdigest()
+                if not force and map_hash == self.applied_map_hash and self.map_path.exists():
+                    logger.info(f"Whitelist map unchanged ({len(entries)} entries), skipping reload")
+                    WHITELIST_UPDATE_SECONDS.observe(time.perf_counter() - started, 'skipped')
+                    return False
+                
+                # 生成白名单IP列表 (新格式: 每行一个IP)
+                ip_lines = [
+                    "# MTProxy 白名单配置文件",
+                    "# This file is automatically generated and managed by the web interface",
+                    f"# Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                    f"# Total entries: {len(whitelist)}",
+                    "",
+                    "# Default entries (localhost for testing)",
+                    "127.0.0.1",
+                    "::1",
+                    "",
+                    "# User added entries",
+                ]
+                
+                for item in whitelist:
+                    # 添加注释说明 (如果有描述)
+                    if item['description']:
+                        ip_lines.append(f"# {item['description']}")
+                    if item['ip_type'] == 'hostname':
+                        ip_lines.append(f"# {item['ip']}")
+                    ip_lines.extend(self.map_keys(item))
+                
+                # 写入白名单文件和映射文件，nginx只读取映射文件
+                atomic_write_text(self.nginx_path, '\n'.join(ip_lines) + '\n')
+                map_entries = self.generate_whitelist_map(entries)
+                
+                self.reload_whitelist()
+                self.db_manager.set_meta('applied_map_hash', map_hash)
+                
+                logger.info(f"Nginx whitelist config updated with {map_entries} map entries")
+                WHITELIST_UPDATE_SECONDS.observe(time.perf_counter() - started, 'applied')
+                return True
+            
+            except Exception as e:
+                WHITELIST_UPDATE_SECONDS.observe(time.perf_counter() - started, 'failed')
+                WHITELIST_UPDATE_FAILURES.inc()
+                logger.error(f"Error updating nginx config: {e}")
+                import traceback
+                logger.error(f"Full traceback: {traceback.format_exc()}")
+                raise e
     
     def reload_whitelist(self):
-        """重载白名单配置"""
+        """重载白名单配置（记录耗时和失败次数）"""
+        started = time.perf_counter()
+        try:
+            self._run_reload()
+        except Exception:
+            NGINX_RELOAD_FAILURES.inc()
+            raise
+        finally:
+            NGINX_RELOAD_SECONDS.observe(time.perf_counter() - started)
+    
+    def _run_reload(self):
+        """调用重载脚本，脚本不存在时直接重载nginx"""
         try:
             # 调用白名单重载脚本
-            result = subprocess.run(['/usr/local/bin/reload-whitelist.sh', 'reload'], 
+            # 映射文件已由API生成，脚本只需测试并重载nginx
+            result = subprocess.run(['/usr/local/bin/reload-whitelist.sh', 'nginx'], 
                                   capture_output=True, text=True, timeout=30)
             
             if result.returncode != 0:
@@ -447,226 +2101,440 @@ class WhitelistManager:
 class ConnectionMonitor:
     """连接监控管理类"""
     
-    def __init__(self, db_manager, log_path=NGINX_LOG_PATH):
+    # 每个日志文件单批默认最多读取的字节数，落后较多时分多批追赶
+    MAX_READ_BYTES = 1024 * 1024
+    # 游标中记录的文件开头字节数，用于识别 copytruncate 后重写的文件
+    HEAD_BYTES = 64
+    # 趋势查询粒度 -> (步长, 汇总表, 汇总表时间桶格式, 结果时间桶格式)
+    TIMESERIES_INTERVALS = {
+        'minute': (timedelta(minutes=1), 'connection_stats_minute', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M'),
+        'hour': (timedelta(hours=1), 'connection_stats_hour', '%Y-%m-%d %H', '%Y-%m-%d %H'),
+        'day': (timedelta(days=1), 'connection_stats_hour', '%Y-%m-%d %H', '%Y-%m-%d')
+    }
+    MAX_TIMESERIES_POINTS = 5000
+    
+    def __init__(self, db_manager, log_paths=None, batch_bytes=None, geoip=None, legacy_position_path=None):
         self.db_manager = db_manager
-        self.log_path = log_path
-        self.last_position = 0
-        self.load_last_position()
+        self.geoip = geoip or GeoIPResolver()  # 未配置归属库时只区分地址类别
+        self.batch_bytes = batch_bytes or self.MAX_READ_BYTES  # 限制单个写入事务的大小
+        self.log_paths = [Path(p) for p in (log_paths or DEFAULT_LOG_PATHS)]
+        self.legacy_position_path = legacy_position_path  # 旧版本的 log_position.txt
+        self.log_path = self.log_paths[0]  # 主日志文件（调试接口使用）
+        self.cursors = {}                # path -> {'inode', 'offset', 'head'}，与数据库一致
+        self.last_ingested_at = None     # 最近一次写入新连接的时间
+        self.last_event_timestamp = None  # 最近写入的日志行时间（UTC字符串）
+        self._handles = {}               # (path, inode) -> 打开的文件对象，轮转后仍可读完旧文件
+        self._lock = threading.Lock()    # 串行化日志读取，避免共享读取位置的竞争
+        self.parser = StreamLogParser()
+        self.listeners = []              # 新连接写入后的回调（如实时事件推送）
+        self.load_cursors()
     
-    def load_last_position(self):
-        """加载上次读取的日志位置"""
-        try:
-            pos_file = DATA_DIR / 'webapp' / 'log_position.txt'
-            if pos_file.exists():
-                self.last_position = int(pos_file.read_text().strip())
-        except:
-            self.last_position = 0
+    def load_cursors(self):
+        """从数据库加载各日志文件的读取游标"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT path, inode, offset, head FROM log_cursors')
+            self.cursors = {
+                row['path']: {'inode': row['inode'], 'offset': row['offset'], 'head': row['head']}
+                for row in cursor.fetchall()
+            }
+        
+        # 兼容旧版本：迁移 log_position.txt 中保存的主日志读取位置
+        pos_file = self.legacy_position_path
+        primary = str(self.log_path)
+        if primary not in self.cursors and pos_file and pos_file.exists():
+            try:
+                offset = int(pos_file.read_text().strip())
+                inode = self.log_path.stat().st_ino
+                if offset <= self.log_path.stat().st_size:
+                    self.cursors[primary] = {'inode': inode, 'offset': offset}
+                    logger.info(f"Migrated legacy log position {offset} for {primary}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring legacy log position file: {e}")
     
-    def save_last_position(self):
-        """保存当前读取的日志位置"""
-        try:
-            pos_file = DATA_DIR / 'webapp' / 'log_position.txt'
-            pos_file.write_text(str(self.last_position))
-        except Exception as e:
-            logger.error(f"Error saving log position: {e}")
+    def _open(self, path, inode):
+        """获取指定inode的文件对象（复用已打开的句柄）"""
+        handle = self._handles.get((str(path), inode))
+        if handle is None:
+            # 不使用缓冲：文件可能被截断重写，缓冲区中的旧数据会导致误判
+            handle = open(path, 'rb', buffering=0)
+            if os.fstat(handle.fileno()).st_ino != inode:
+                # 打开期间文件又被轮转
+                handle.close()
+                return None
+            self._handles[(str(path), inode)] = handle
+        return handle
     
-    def parse_nginx_logs(self):
-        """解析nginx日志获取连接信息"""
-        if not self.log_path.exists():
-            return []
+    def _find_rotated(self, path, inode):
+        """查找已被轮转的旧日志文件（按inode匹配），找不到返回None"""
+        handle = self._handles.get((str(path), inode))
+        if handle is not None:
+            return handle
         
-        connections = []
+        # 重启后没有已打开的句柄，在同目录下查找 stream_access.log.1 等轮转文件
         try:
-            with open(self.log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                f.seek(self.last_position)
-                
-                for line in f:
-                    try:
-                        # 解析nginx stream log格式，支持多种IP格式
-                        # 标准格式: IP [时间] 协议 状态 发送字节 接收字节 会话时间 whitelist:0/1 upstream:地址
-                        # PROXY protocol格式: proxy_protocol_addr [时间] ...
-                        line_content = line.strip()
-                        
-                        # 匹配标准或PROXY protocol格式
-                        match = re.match(
-                            r'([0-9a-fA-F.:]+|\d+\.\d+\.\d+\.\d+|\[?[0-9a-fA-F:]+\]?|proxy_protocol_addr) \[([^\]]+)\] (\w+) (\d+) (\d+) (\d+) ([\d.]+) whitelist:([01])(?:\s+upstream:([^\s]+))?',
-                            line_content
-                        )
-                        
-                        if match:
-                            ip = match.group(1)
-                            timestamp_str = match.group(2)
-                            protocol = match.group(3)
-                            status_code = match.group(4)
-                            whitelist_status = match.group(8)
-                            
-                            # 解析时间
-                            try:
-                                timestamp = datetime.strptime(timestamp_str, '%d/%b/%Y:%H:%M:%S %z')
-                            except:
-                                timestamp = datetime.now()
-                            
-                            # 确定连接状态
-                            status = 'allowed' if whitelist_status == '1' else 'denied'
-                            
-                            connections.append({
-                                'ip': ip,
-                                'status': status,
-                                'timestamp': timestamp,
-                                'protocol': protocol
-                            })
+            candidates = [p for p in path.parent.iterdir()
+                          if p.name.startswith(path.name) and p != path and not p.name.endswith('.gz')]
+        except OSError:
+            return None
+        for candidate in candidates:
+            try:
+                if candidate.stat().st_ino == inode:
+                    return self._open(candidate, inode)
+            except OSError:
+                continue
+        return None
+    
+    def _read_complete_lines(self, handle, offset):
+        """从offset读取完整的行（不含末尾未写完的行），返回 (行列表, 新offset)"""
+        handle.seek(offset)
+        data = handle.read(self.batch_bytes)
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return [], offset
+        lines = data[:end].decode('utf-8', errors='ignore').splitlines()
+        return lines, offset + end
+    
+    def _make_cursor(self, handle, inode, offset):
+        """生成游标，记录文件开头的若干字节用于识别被截断重写的文件"""
+        handle.seek(0)
+        head = handle.read(min(offset, self.HEAD_BYTES)).hex()
+        return {'inode': inode, 'offset': offset, 'head': head}
+    
+    def _is_same_file(self, handle, cursor):
+        """检查文件开头是否与游标记录一致（copytruncate后文件会被重写）"""
+        head = cursor.get('head')
+        if not head:
+            return True
+        handle.seek(0)
+        return handle.read(len(head) // 2).hex() == head
+    
+    def read_new_lines(self):
+        """读取所有日志文件的新内容
+        
+        返回 (行列表, 新游标)。新游标需要与解析出的连接在同一事务中保存，
+        保存成功后再调用 commit_cursors 更新内存中的游标。
+        """
+        lines = []
+        new_cursors = {}
+        
+        for path in self.log_paths:
+            key = str(path)
+            cursor = self.cursors.get(key)
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                st = None
+            except OSError as e:
+                logger.error(f"Error checking log file {path}: {e}")
+                continue
+            
+            try:
+                if cursor and (st is None or st.st_ino != cursor['inode']):
+                    # 文件已轮转：先把旧文件读到末尾，再切换到新文件
+                    rotated = self._find_rotated(path, cursor['inode'])
+                    if rotated is not None:
+                        rotated_lines, offset = self._read_complete_lines(rotated, cursor['offset'])
+                        lines.extend(rotated_lines)
+                        if rotated_lines and os.fstat(rotated.fileno()).st_size > offset:
+                            # 旧文件还没读完，下一批继续
+                            new_cursors[key] = self._make_cursor(rotated, cursor['inode'], offset)
+                            continue
+                    else:
+                        logger.warning(f"Rotated log file for {path} not found, continuing with new file")
                     
-                    except Exception as e:
-                        logger.debug(f"Error parsing log line: {e}")
+                    if st is None:
                         continue
+                    cursor = {'inode': st.st_ino, 'offset': 0}
+                    new_cursors[key] = cursor
                 
-                self.last_position = f.tell()
-                self.save_last_position()
+                if st is None:
+                    continue
+                
+                handle = self._open(path, st.st_ino)
+                if handle is None:
+                    continue
+                
+                if cursor is None:
+                    cursor = {'inode': st.st_ino, 'offset': 0}
+                    new_cursors[key] = cursor
+                elif st.st_size < cursor['offset'] or not self._is_same_file(handle, cursor):
+                    # copytruncate 方式轮转：文件被截断，从头读取
+                    logger.info(f"Log file {path} was truncated, reading from start")
+                    cursor = {'inode': st.st_ino, 'offset': 0}
+                    new_cursors[key] = cursor
+                
+                if st.st_size > cursor['offset']:
+                    new_lines, offset = self._read_complete_lines(handle, cursor['offset'])
+                    lines.extend(new_lines)
+                    if offset != cursor['offset']:
+                        new_cursors[key] = self._make_cursor(handle, st.st_ino, offset)
+            
+            except Exception as e:
+                logger.error(f"Error reading nginx log {path}: {e}")
         
-        except Exception as e:
-            logger.error(f"Error reading nginx logs: {e}")
+        return lines, new_cursors
+    
+    def commit_cursors(self, new_cursors):
+        """游标已持久化后更新内存状态，并关闭已读完的旧文件句柄"""
+        self.cursors.update(new_cursors)
+        for (path, inode), handle in list(self._handles.items()):
+            cursor = self.cursors.get(path)
+            if cursor is None or cursor['inode'] != inode:
+                handle.close()
+                del self._handles[(path, inode)]
+    
+    def parse_nginx_logs(self, lines):
+        """解析nginx日志行获取连接信息（格式见 log_parser.StreamLogParser）"""
+        return self.parser.parse_lines(lines)
+    
+    def _prepare_batch(self, connections):
+        """将一批连接整理为批量写入的参数
+        
+        返回 (连接日志行, 被拒绝IP统计行, 分钟汇总行, 小时汇总行, 来源IP统计行)。
+        被拒绝的连接按IP预先聚合为 (次数, 最早时间, 最晚时间)，
+        归属信息每批每个IP只查询一次。
+        """
+        geo = {}
+        log_rows = []
+        denied = {}
+        minutes = defaultdict(int)
+        seen = {}
+        
+        for connection in connections:
+            ip = connection['ip']
+            info = geo.get(ip)
+            if info is None:
+                info = geo[ip] = self.geoip.lookup(ip)
+            connection['location'] = location = info['location']
+            
+            timestamp = connection['timestamp']
+            log_rows.append((
+                ip,
+                connection['status'],
+                timestamp,
+                location,
+                connection.get('protocol'),
+                connection.get('status_code'),
+                connection.get('bytes_sent'),
+                connection.get('bytes_received'),
+                connection.get('session_time'),
+                connection.get('upstream'),
+                info['country'],
+                info['asn']
+            ))
+            minutes[(timestamp[:16], connection['status'])] += 1
+            
+            ip_stats = seen.get(ip)
+            if ip_stats is None:
+                seen[ip] = [1, timestamp, timestamp]
+            else:
+                ip_stats[0] += 1
+                if timestamp < ip_stats[1]:
+                    ip_stats[1] = timestamp
+                if timestamp > ip_stats[2]:
+                    ip_stats[2] = timestamp
+            
+            if connection['status'] == 'denied':
+                stats = denied.get(ip)
+                if stats is None:
+                    denied[ip] = [1, timestamp, timestamp]
+                else:
+                    stats[0] += 1
+                    if timestamp < stats[1]:
+                        stats[1] = timestamp
+                    if timestamp > stats[2]:
+                        stats[2] = timestamp
+        
+        blocked_rows = [
+            (ip, geo[ip]['location'], geo[ip]['country'], geo[ip]['asn'], count, first, last)
+            for ip, (count, first, last) in denied.items()
+        ]
+        
+        hours = defaultdict(int)
+        for (minute, status), count in minutes.items():
+            hours[(minute[:13], status)] += count
         
-        return connections
+        minute_rows = [(bucket, status, count) for (bucket, status), count in minutes.items()]
+        hour_rows = [(bucket, status, count) for (bucket, status), count in hours.items()]
+        ip_rows = [(ip, count, first, last) for ip, (count, first, last) in seen.items()]
+        return log_rows, blocked_rows, minute_rows, hour_rows, ip_rows
     
-    def record_connections(self, connections):
-        """记录连接到数据库"""
-        if not connections:
-            return
+    def record_connections(self, connections, cursors=None):
+        """批量记录连接到数据库，日志游标在同一事务中保存，返回是否成功
         
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
+        单次调用的数据量由 batch_bytes 限制（每个日志文件每批最多读取的字节数）。
+        """
+        if not connections and not cursors:
+            return True
         
-        try:
-            for connection in connections:
-                # 记录连接日志
-                cursor.execute('''
-                    INSERT INTO connection_logs (ip_address, status, timestamp, location)
+        log_rows, blocked_rows, minute_rows, hour_rows, ip_rows = self._prepare_batch(connections)
+        
+        with self.db_manager.connection('ingest') as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.executemany('''
+                    INSERT INTO connection_logs
+                    (ip_address, status, timestamp, location, protocol, status_code,
+                     bytes_sent, bytes_received, session_time, upstream, country, asn)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', log_rows)
+                
+                # 被拒绝IP统计：每个IP一条UPSERT，累加次数并合并首次/最近时间
+                if blocked_rows:
+                    cursor.executemany('''
+                        INSERT INTO blocked_ip_stats
+                        (ip_address, location, country, asn, attempt_count, first_attempt, last_attempt)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(ip_address) DO UPDATE SET
+                            attempt_count = attempt_count + excluded.attempt_count,
+                            first_attempt = MIN(first_attempt, excluded.first_attempt),
+                            last_attempt = MAX(last_attempt, excluded.last_attempt)
+                    ''', blocked_rows)
+                
+                # 增量更新统计汇总表
+                cursor.executemany('''
+                    INSERT INTO connection_stats_minute (bucket, status, count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(bucket, status) DO UPDATE SET count = count + excluded.count
+                ''', minute_rows)
+                cursor.executemany('''
+                    INSERT INTO connection_stats_hour (bucket, status, count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(bucket, status) DO UPDATE SET count = count + excluded.count
+                ''', hour_rows)
+                cursor.executemany('''
+                    INSERT INTO connection_ip_stats (ip_address, connection_count, first_seen, last_seen)
                     VALUES (?, ?, ?, ?)
-                ''', (
-                    connection['ip'],
-                    connection['status'],
-                    connection['timestamp'],
-                    self.get_ip_location(connection['ip'])
-                ))
+                    ON CONFLICT(ip_address) DO UPDATE SET
+                        connection_count = connection_count + excluded.connection_count,
+                        first_seen = MIN(first_seen, excluded.first_seen),
+                        last_seen = MAX(last_seen, excluded.last_seen)
+                ''', ip_rows)
                 
-                # 如果是被拒绝的连接，更新统计
-                if connection['status'] == 'denied':
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO blocked_ip_stats 
-                        (ip_address, location, first_attempt, last_attempt)
-                        VALUES (?, ?, ?, ?)
-                    ''', (
-                        connection['ip'],
-                        self.get_ip_location(connection['ip']),
-                        connection['timestamp'],
-                        connection['timestamp']
-                    ))
-                    
-                    cursor.execute('''
-                        UPDATE blocked_ip_stats 
-                        SET attempt_count = attempt_count + 1,
-                            last_attempt = ?
-                        WHERE ip_address = ?
-                    ''', (connection['timestamp'], connection['ip']))
-            
-            conn.commit()
+                # 保存日志游标（与连接记录同一事务，保证不丢不重）
+                if cursors:
+                    cursor.executemany('''
+                        INSERT INTO log_cursors (path, inode, offset, head, updated_at)
+                        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(path) DO UPDATE SET
+                            inode = excluded.inode,
+                            offset = excluded.offset,
+                            head = excluded.head,
+                            updated_at = excluded.updated_at
+                    ''', [(path, c['inode'], c['offset'], c.get('head')) for path, c in cursors.items()])
+                
+                conn.commit()
+                return True
             
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error recording connections: {e}")
-        finally:
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error recording connections: {e}")
+                return False
     
-    def get_recent_connections(self, limit=100):
-        """获取最近的连接记录"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
+    def get_recent_connections(self, limit=100, after=None, ip=None, status=None, start=None, end=None):
+        """分页获取连接记录（按时间倒序），返回 (连接列表, 下一页令牌)"""
+        conditions, params = time_range_conditions('timestamp', start, end)
+        if ip:
+            conditions.append('ip_address = ?')
+            params.append(ip)
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
         
-        cursor.execute('''
-            SELECT ip_address, status, timestamp, location
-            FROM connection_logs
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (limit,))
+        with self.db_manager.connection() as conn:
+            rows, next_token = keyset_query(conn.cursor(), '''
+                SELECT id, ip_address, status, timestamp, location, protocol,
+                       bytes_sent, bytes_received, session_time, upstream, country, asn
+                FROM connection_logs
+            ''', conditions, params, 'timestamp', limit, after)
         
         connections = []
-        for row in cursor.fetchall():
+        for row in rows:
             connections.append({
+                'id': row['id'],
                 'ip': row['ip_address'],
                 'status': row['status'],
                 'timestamp': row['timestamp'],
-                'location': row['location'] or '未知'
+                'location': row['location'] or '未知',
+                'protocol': row['protocol'],
+                'bytes_sent': row['bytes_sent'],
+                'bytes_received': row['bytes_received'],
+                'session_time': row['session_time'],
+                'upstream': row['upstream'],
+                'country': row['country'],
+                'asn': row['asn']
             })
         
-        conn.close()
-        return connections
+        return connections, next_token
     
-    def get_blocked_ips(self, limit=50):
-        """获取被拒绝的IP统计"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
+    def get_blocked_ips(self, limit=50, after=None, ip=None, start=None, end=None):
+        """分页获取被拒绝的IP统计（按最近尝试时间倒序），返回 (列表, 下一页令牌)"""
+        conditions, params = time_range_conditions('last_attempt', start, end)
+        if ip:
+            conditions.append('ip_address = ?')
+            params.append(ip)
         
-        cursor.execute('''
-            SELECT ip_address, attempt_count, first_attempt, last_attempt, location
-            FROM blocked_ip_stats
-            ORDER BY last_attempt DESC
-            LIMIT ?
-        ''', (limit,))
+        with self.db_manager.connection() as conn:
+            rows, next_token = keyset_query(conn.cursor(), '''
+                SELECT id, ip_address, attempt_count, first_attempt, last_attempt, location, country, asn
+                FROM blocked_ip_stats
+            ''', conditions, params, 'last_attempt', limit, after)
         
         blocked_ips = []
-        for row in cursor.fetchall():
+        for row in rows:
             blocked_ips.append({
                 'ip': row['ip_address'],
                 'attempt_count': row['attempt_count'],
                 'first_attempt': row['first_attempt'],
                 'last_attempt': row['last_attempt'],
-                'location': row['location'] or '未知'
+                'location': row['location'] or '未知',
+                'country': row['country'],
+                'asn': row['asn']
             })
         
-        conn.close()
-        return blocked_ips
+        return blocked_ips, next_token
     
     def get_connection_stats(self):
-        """获取连接统计信息"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        # 今天的统计
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('''
-            SELECT status, COUNT(*) as count
-            FROM connection_logs
-            WHERE DATE(timestamp) = ?
-            GROUP BY status
-        ''', (today,))
+        """获取连接统计信息（只读取汇总表，时间按UTC计算）"""
+        now = datetime.utcnow()
+        today = now.strftime('%Y-%m-%d 00')
+        trend_start = (now - timedelta(hours=23)).strftime('%Y-%m-%d %H')
         
-        today_stats = {'allowed': 0, 'denied': 0}
-        for row in cursor.fetchall():
-            today_stats[row['status']] = row['count']
-        
-        # 总体统计
-        cursor.execute('SELECT COUNT(*) as total FROM connection_logs')
-        total_connections = cursor.fetchone()['total']
-        
-        cursor.execute('SELECT COUNT(DISTINCT ip_address) as unique_count FROM connection_logs')
-        unique_ips = cursor.fetchone()['unique_count']
-        
-        # 24小时连接趋势
-        cursor.execute('''
-            SELECT 
-                strftime('%H', timestamp) as hour,
-                status,
-                COUNT(*) as count
-            FROM connection_logs
-            WHERE timestamp >= datetime('now', '-24 hours')
-            GROUP BY hour, status
-            ORDER BY hour
-        ''')
-        
-        hourly_data = defaultdict(lambda: {'allowed': 0, 'denied': 0})
-        for row in cursor.fetchall():
-            hour = int(row['hour'])
-            hourly_data[hour][row['status']] = row['count']
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            # 今天的统计
+            cursor.execute('''
+                SELECT status, SUM(count) as count
+                FROM connection_stats_hour
+                WHERE bucket >= ?
+                GROUP BY status
+            ''', (today,))
+            
+            today_stats = {'allowed': 0, 'denied': 0}
+            for row in cursor.fetchall():
+                today_stats[row['status']] = row['count']
+            
+            # 总体统计
+            cursor.execute('SELECT COALESCE(SUM(count), 0) as total FROM connection_stats_hour')
+            total_connections = cursor.fetchone()['total']
+            
+            cursor.execute('SELECT COUNT(*) as unique_count FROM connection_ip_stats')
+            unique_ips = cursor.fetchone()['unique_count']
+            
+            # 24小时连接趋势
+            cursor.execute('''
+                SELECT bucket, status, count
+                FROM connection_stats_hour
+                WHERE bucket >= ?
+            ''', (trend_start,))
+            
+            hourly_data = defaultdict(lambda: {'allowed': 0, 'denied': 0})
+            for row in cursor.fetchall():
+                hour = int(row['bucket'][11:13])
+                hourly_data[hour][row['status']] = row['count']
         
         # 转换为列表格式
         hourly_list = []
@@ -677,8 +2545,6 @@ class ConnectionMonitor:
                 'denied': hourly_data[hour]['denied']
             })
         
-        conn.close()
-        
         return {
             'allowed_today': today_stats['allowed'],
             'denied_today': today_stats['denied'],
@@ -687,62 +2553,1079 @@ class ConnectionMonitor:
             'hourly_data': hourly_list
         }
     
+    def get_connection_timeseries(self, start=None, end=None, interval=None):
+        """按时间段获取连接趋势（UTC，[start, end)），只读取汇总表
+        
+        interval 为 minute/hour/day，未指定时按时间跨度自动选择。
+        没有连接的时间点补零，点数超过 MAX_TIMESERIES_POINTS 时抛出 ValueError。
+        """
+        end = end or datetime.utcnow()
+        start = start or end - timedelta(hours=24)
+        if start >= end:
+            raise ValueError('start must be earlier than end')
+        
+        if interval is None:
+            span = end - start
+            if span <= timedelta(hours=6):
+                interval = 'minute'
+            elif span <= timedelta(days=14):
+                interval = 'hour'
+            else:
+                interval = 'day'
+        if interval not in self.TIMESERIES_INTERVALS:
+            raise ValueError(f"Invalid interval: {interval}")
+        
+        step, table, table_format, bucket_format = self.TIMESERIES_INTERVALS[interval]
+        first = datetime.strptime(start.strftime(bucket_format), bucket_format)
+        points = int((end - first).total_seconds() // step.total_seconds()) + 1
+        if points > self.MAX_TIMESERIES_POINTS:
+            raise ValueError(f"Too many points ({points}), use a larger interval")
+        
+        length = len(first.strftime(bucket_format))
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT substr(bucket, 1, {length}) as bucket, status, SUM(count) as count
+                FROM {table}
+                WHERE bucket >= ? AND bucket <= ?
+                GROUP BY 1, 2
+            ''', (first.strftime(table_format), end.strftime(table_format)))
+            
+            counts = defaultdict(lambda: {'allowed': 0, 'denied': 0})
+            for row in cursor.fetchall():
+                counts[row['bucket']][row['status']] = row['count']
+        
+        series = []
+        current = first
+        while current < end:
+            bucket = current.strftime(bucket_format)
+            series.append({
+                'time': current.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'allowed': counts[bucket]['allowed'],
+                'denied': counts[bucket]['denied']
+            })
+            current += step
+        
+        return {
+            'start': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'end': end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'interval': interval,
+            'points': series
+        }
+    
+    def rebuild_rollups(self):
+        """根据连接日志重建全部统计汇总表"""
+        with self._lock:
+            with self.db_manager.connection('rollup_rebuild') as conn:
+                try:
+                    self.db_manager.rebuild_rollups(conn.cursor())
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise e
+    
     def clear_logs(self):
         """清空连接日志"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
+        with self._lock:
+            with self.db_manager.connection('clear_logs') as conn:
+                cursor = conn.cursor()
+                
+                try:
+                    cursor.execute('DELETE FROM connection_logs')
+                    cursor.execute('DELETE FROM blocked_ip_stats')
+                    cursor.execute('DELETE FROM connection_stats_minute')
+                    cursor.execute('DELETE FROM connection_stats_hour')
+                    cursor.execute('DELETE FROM connection_ip_stats')
+                    conn.commit()
+                
+                except Exception as e:
+                    conn.rollback()
+                    raise e
+    
+    def get_ip_location(self, ip):
+        """获取IP归属的显示文本（本地/内网/保留地址，公网地址为国家和ASN）"""
+        return self.geoip.lookup(ip)['location']
+    
+    def update_connections(self):
+        """更新连接数据（由后台采集线程调用），返回新记录的连接数"""
+        with self._lock:
+            try:
+                lines, new_cursors = self.read_new_lines()
+                if not new_cursors:
+                    return 0
+                
+                parsed_before, failed_before = self.parser.parsed_lines, self.parser.failed_lines
+                connections = self.parse_nginx_logs(lines)
+                if not self.record_connections(connections, new_cursors):
+                    # 写入失败时不推进游标，下次重新读取
+                    return 0
+                self.commit_cursors(new_cursors)
+                
+                INGESTION_LINES.inc('parsed', amount=self.parser.parsed_lines - parsed_before)
+                INGESTION_LINES.inc('failed', amount=self.parser.failed_lines - failed_before)
+                allowed = sum(1 for c in connections if c['status'] == 'allowed')
+                CONNECTIONS_TOTAL.inc('allowed', amount=allowed)
+                CONNECTIONS_TOTAL.inc('denied', amount=len(connections) - allowed)
+                
+                if connections:
+                    self.last_ingested_at = datetime.now()
+                    self.last_event_timestamp = max(c['timestamp'] for c in connections)
+                    logger.info(f"Recorded {len(connections)} new connections")
+                    self.notify_listeners(connections)
+                else:
+                    logger.debug("No new connections found in nginx logs")
+                return len(connections)
+            
+            except Exception as e:
+                logger.error(f"Error updating connections: {e}")
+                import traceback
+                logger.error(f"Full traceback: {traceback.format_exc()}")
+                return 0
+    
+    def notify_listeners(self, connections):
+        """通知已写入数据库的新连接，回调异常不影响采集"""
+        for listener in self.listeners:
+            try:
+                listener(connections)
+            except Exception as e:
+                logger.error(f"Connection listener failed: {e}")
+    
+    def get_ingestion_lag(self):
+        """获取所有日志文件中未处理的字节数"""
+        lag = 0
+        for path in self.log_paths:
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            cursor = self.cursors.get(str(path))
+            if cursor and cursor['inode'] == st.st_ino:
+                # 文件被截断时读取位置会超过文件大小，下次读取时会重置
+                lag += max(0, st.st_size - cursor['offset'])
+            else:
+                lag += st.st_size
+        return lag
+
+class InotifyWatcher:
+    """基于inotify的目录变化监听（通过ctypes调用libc，无需额外依赖）"""
+    
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
         
+        # 监听目录而不是文件，日志轮转（重命名/重建）后依然有效
+        mask = (self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM |
+                self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask) < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f'inotify_add_watch failed for {directory}')
+    
+    def wait(self, timeout):
+        """等待目录发生变化，返回是否有事件"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # 读空事件队列，只关心“有变化”
         try:
-            cursor.execute('DELETE FROM connection_logs')
-            cursor.execute('DELETE FROM blocked_ip_stats')
-            conn.commit()
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+    
+    def close(self):
+        os.close(self.fd)
+
+class LogIngestionWorker:
+    """后台日志采集线程
+    
+    持续跟踪nginx日志并写入数据库，查询接口只读取数据库。
+    支持inotify时日志变化后立即处理，否则每 poll_interval 秒轮询一次。
+    """
+    
+    def __init__(self, monitor, poll_interval=2.0):
+        self.monitor = monitor
+        self.poll_interval = poll_interval
+        self.mode = None
+        self.running = False
+        self.last_run_at = None
+        self.last_caught_up_at = None
+        self.total_recorded = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """启动后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # 从其他进程接管采集时，内存中的游标可能已过期
+        self.monitor.load_cursors()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='log-ingestion', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _create_watcher(self):
+        try:
+            directories = sorted({str(path.parent) for path in self.monitor.log_paths})
+            watcher = InotifyWatcher(directories)
+            logger.info(f"Log ingestion using inotify on {', '.join(directories)}")
+            return watcher
+        except Exception as e:
+            logger.info(f"inotify unavailable ({e}), log ingestion polling every {self.poll_interval}s")
+            return None
+    
+    def _run(self):
+        self.running = True
+        watcher = self._create_watcher()
+        self.mode = 'inotify' if watcher else 'polling'
+        
+        try:
+            while not self._stop_event.is_set():
+                recorded = self.monitor.update_connections()
+                self.total_recorded += recorded
+                self.last_run_at = datetime.now()
+                if self.monitor.get_ingestion_lag() == 0:
+                    self.last_caught_up_at = self.last_run_at
+                elif recorded:
+                    # 还有积压，立即处理下一批
+                    continue
+                
+                if watcher:
+                    # 无事件时也按轮询间隔兜底检查一次
+                    watcher.wait(self.poll_interval)
+                else:
+                    self._stop_event.wait(self.poll_interval)
+        except Exception as e:
+            logger.error(f"Log ingestion worker stopped unexpectedly: {e}")
+        finally:
+            self.running = False
+            if watcher:
+                watcher.close()
+    
+    def status(self):
+        """获取采集状态和延迟"""
+        bytes_behind = self.monitor.get_ingestion_lag()
+        if bytes_behind == 0:
+            seconds_behind = 0
+        elif self.last_caught_up_at:
+            seconds_behind = round((datetime.now() - self.last_caught_up_at).total_seconds(), 1)
+        else:
+            seconds_behind = None
+        
+        last_event = self.monitor.last_event_timestamp
+        return {
+            'running': self.running,
+            'mode': self.mode,
+            'poll_interval': self.poll_interval,
+            'bytes_behind': bytes_behind,
+            'seconds_behind': seconds_behind,
+            'total_recorded': self.total_recorded,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_ingested_at': self.monitor.last_ingested_at.isoformat() if self.monitor.last_ingested_at else None,
+            'last_event_timestamp': last_event,
+            'parsed_lines': self.monitor.parser.parsed_lines,
+            'failed_lines': self.monitor.parser.failed_lines
+        }
+
+class EventSubscriber:
+    """实时事件订阅者，事件缓存在有界队列中，队列满时丢弃最旧的事件"""
+    
+    def __init__(self, buffer_size):
+        self.queue = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self._cond = threading.Condition()
+    
+    def push(self, item):
+        with self._cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(item)
+            self._cond.notify()
+    
+    def pop_all(self, timeout):
+        """等待最多 timeout 秒，取出全部待发送事件，返回 (事件列表, 丢弃的事件数)"""
+        with self._cond:
+            if not self.queue:
+                self._cond.wait(timeout)
+            items = list(self.queue)
+            self.queue.clear()
+            dropped, self.dropped = self.dropped, 0
+            return items, dropped
+
+class EventBroadcaster:
+    """连接监控实时事件广播（Server-Sent Events）
+    
+    采集线程写入新连接后推送 connections 事件（每批最多 max_batch 条）；
+    后台线程每 stats_interval 秒推送一次 stats 事件，内容为期间新增的允许/拒绝次数。
+    每个客户端的队列最多缓存 buffer_size 个事件，处理慢的客户端只会丢弃自己的旧事件，
+    并收到 reset 事件提示重新加载完整数据。
+    """
+    
+    def __init__(self, buffer_size=256, max_clients=20, stats_interval=5.0, max_batch=200):
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self.stats_interval = stats_interval
+        self.max_batch = max_batch
+        self.published = 0
+        self._subscribers = set()
+        self._pending = {'allowed': 0, 'denied': 0}
+        self._event_id = 0
+        self._lock = threading.Lock()
+        self._stats_thread = None
+    
+    def has_subscribers(self):
+        return bool(self._subscribers)
+    
+    def subscribe(self):
+        """注册订阅者，超过最大客户端数时返回 None"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = EventSubscriber(self.buffer_size)
+            self._subscribers.add(subscriber)
             
-            # 重置日志位置
-            self.last_position = 0
-            self.save_last_position()
+            if self._stats_thread is None or not self._stats_thread.is_alive():
+                self._stats_thread = threading.Thread(target=self._stats_loop, name='sse-stats', daemon=True)
+                self._stats_thread.start()
+            return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def publish(self, event, data):
+        """向所有订阅者推送事件"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            self._event_id += 1
+            item = (self._event_id, event, json.dumps(data, ensure_ascii=False))
+            for subscriber in self._subscribers:
+                subscriber.push(item)
+            self.published += 1
+    
+    def publish_connections(self, connections):
+        """采集线程回调：推送新连接并累计统计增量"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            for connection in connections:
+                self._pending[connection['status']] = self._pending.get(connection['status'], 0) + 1
+        
+        self.publish('connections', {
+            'count': len(connections),
+            'items': [{
+                'ip': c['ip'],
+                'status': c['status'],
+                'timestamp': c['timestamp'],
+                'location': c.get('location'),
+                'protocol': c.get('protocol')
+            } for c in connections[-self.max_batch:]]
+        })
+    
+    def _stats_loop(self):
+        while True:
+            time.sleep(self.stats_interval)
+            with self._lock:
+                if not self._subscribers:
+                    # 没有订阅者时退出，下次订阅时重新启动
+                    self._stats_thread = None
+                    self._pending = {'allowed': 0, 'denied': 0}
+                    return
+                delta = self._pending
+                self._pending = {'allowed': 0, 'denied': 0}
             
-        except Exception as e:
-            conn.rollback()
-            raise e
+            if delta['allowed'] or delta['denied']:
+                self.publish('stats', {
+                    'allowed': delta['allowed'],
+                    'denied': delta['denied'],
+                    'interval': self.stats_interval
+                })
+    
+    def status(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'max_clients': self.max_clients,
+                'buffer_size': self.buffer_size,
+                'published': self.published
+            }
+
+class ConnectionTailer:
+    """非采集进程的实时事件来源
+    
+    多进程部署时只有 leader 进程运行日志采集并直接回调 listeners，其他进程的
+    SSE 客户端改由本线程提供数据：有订阅者时每 interval 秒按自增 id 读取新写入的连接记录。
+    """
+    
+    def __init__(self, db_manager, callback, active, interval=2.0, max_rows=5000):
+        self.db_manager = db_manager
+        self.callback = callback  # 接收新连接列表
+        self.active = active      # 返回当前是否有订阅者
+        self.interval = interval
+        self.max_rows = max_rows
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='connection-tailer', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _run(self):
+        last_id = None
+        while not self._stop_event.wait(self.interval):
+            if not self.active():
+                last_id = None
+                continue
+            
+            try:
+                with self.db_manager.connection() as conn:
+                    if last_id is None:
+                        # 新的订阅从当前位置开始，不推送历史记录
+                        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM connection_logs').fetchone()[0]
+                        continue
+                    rows = conn.execute('''
+                        SELECT id, ip_address, status, timestamp, location, protocol
+                        FROM connection_logs
+                        WHERE id > ?
+                        ORDER BY id
+                        LIMIT ?
+                    ''', (last_id, self.max_rows)).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Connection tailer query failed: {e}")
+                continue
+            
+            if rows:
+                last_id = rows[-1]['id']
+                self.callback([{
+                    'ip': row['ip_address'],
+                    'status': row['status'],
+                    'timestamp': row['timestamp'],
+                    'location': row['location'],
+                    'protocol': row['protocol']
+                } for row in rows])
+
+class BackgroundServices:
+    """按进程角色启动后台线程
+    
+    多个 worker 进程共享同一个数据库时，日志采集和数据清理只能在一个进程中运行。
+    取得 leader 文件锁的进程运行 leader_services，其他进程运行 follower_services，
+    并每 retry_interval 秒重试获取锁；leader 进程退出后锁由内核释放，由其他进程接管。
+    """
+    
+    def __init__(self, lock_path, leader_services, follower_services=(), retry_interval=5.0):
+        self.lock = FileLock(lock_path)
+        self.leader_services = list(leader_services)
+        self.follower_services = list(follower_services)
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self.started = False
+        self.promoted_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """启动本进程的后台服务（重复调用无效果）"""
+        if self.started:
+            return
+        self.started = True
+        self._stop_event.clear()
+        if self._try_promote():
+            return
+        
+        logger.info(f"Process {os.getpid()} running as follower, background services run in the leader process")
+        for service in self.follower_services:
+            service.start()
+        self._thread = threading.Thread(target=self._run, name='leader-election', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止后台服务并释放 leader 锁"""
+        self._stop_event.set()
+        for service in self.leader_services + self.follower_services:
+            service.stop()
+        if self.is_leader:
+            self.lock.release()
+            self.is_leader = False
+        self.started = False
+    
+    def _try_promote(self):
+        if not self.lock.acquire(blocking=False):
+            return False
+        
+        self.is_leader = True
+        self.promoted_at = datetime.now()
+        logger.info(f"Process {os.getpid()} acquired leader lock, starting background services")
+        for service in self.follower_services:
+            service.stop()
+        for service in self.leader_services:
+            service.start()
+        return True
+    
+    def _run(self):
+        while not self._stop_event.wait(self.retry_interval):
+            if self._try_promote():
+                return
+    
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'role': 'leader' if self.is_leader else 'follower',
+            'started': self.started,
+            'promoted_at': self.promoted_at.isoformat() if self.promoted_at else None
+        }
+
+class RetentionPruner:
+    """连接数据保留策略后台线程
+    
+    原始连接日志、分钟汇总、小时汇总分别按各自的保留天数过期（0 表示永久保留），
+    小时汇总即为分钟数据降采样后的长期数据；白名单变更日志按完整版本清理。每批最多删除 batch_size 行并立即提交，
+    批次之间短暂让出写锁；删除后通过 incremental_vacuum 归还空闲页，数据库文件随之缩小。
+    """
+    
+    # (表名, 删除用的键, 子查询选择的列, 时间列, 保留策略)
+    TARGETS = [
+        ('connection_logs', 'id', 'id', 'timestamp', 'raw'),
+        ('connection_stats_minute', '(bucket, status)', 'bucket, status', 'bucket', 'minute'),
+        ('connection_stats_hour', '(bucket, status)', 'bucket, status', 'bucket', 'hour'),
+        ('connection_ip_stats', 'ip_address', 'ip_address', 'last_seen', 'hour'),
+        ('blocked_ip_stats', 'id', 'id', 'last_attempt', 'hour'),
+    ]
+    BATCH_PAUSE = 0.05
+    VACUUM_PAGES_PER_STEP = 2000
+    
+    def __init__(self, db_manager, raw_days=7, minute_days=30, hour_days=365,
+                 interval=3600, batch_size=5000, changelog_days=30):
+        self.db_manager = db_manager
+        self.retention_days = {'raw': raw_days, 'minute': minute_days, 'hour': hour_days,
+                               'changelog': changelog_days}
+        self.interval = interval
+        self.batch_size = batch_size
+        self.running = False
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_deleted = {}
+        self.total_deleted = defaultdict(int)
+        self.vacuumed_pages = 0
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """启动后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='retention-pruner', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _run(self):
+        self.running = True
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self.prune()
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Retention pruning failed: {e}")
+                self._stop_event.wait(self.interval)
         finally:
-            conn.close()
+            self.running = False
     
-    def get_ip_location(self, ip):
-        """获取IP地理位置（简化版）"""
+    def _delete_batches(self, table, key, columns, time_column, cutoff):
+        """分批删除早于 cutoff 的行，返回删除的行数"""
+        deleted = 0
+        while not self._stop_event.is_set():
+            with self.db_manager.connection('retention') as conn:
+                cursor = conn.execute(f'''
+                    DELETE FROM {table} WHERE {key} IN (
+                        SELECT {columns} FROM {table} WHERE {time_column} < ? LIMIT ?
+                    )
+                ''', (cutoff, self.batch_size))
+                conn.commit()
+            
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.batch_size:
+                break
+            # 让出写锁，避免阻塞日志采集和管理操作
+            self._stop_event.wait(self.BATCH_PAUSE)
+        return deleted
+    
+    def _prune_changelog(self, cutoff):
+        """删除早于 cutoff 的白名单变更（整个版本一起删除），并推进变更日志起点，返回删除的行数"""
+        with self.db_manager.connection('retention') as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            version = cursor.execute(
+                'SELECT MAX(version) FROM whitelist_changes WHERE created_at < ?', (cutoff,)
+            ).fetchone()[0]
+            if version is None:
+                return 0
+            cursor.execute('DELETE FROM whitelist_changes WHERE version <= ?', (version,))
+            deleted = cursor.rowcount
+            # 落后于起点的从节点只能通过全量快照同步
+            cursor.execute('''
+                UPDATE meta SET value = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE key = 'changelog_start' AND CAST(value AS INTEGER) < ?
+            ''', (str(version), version))
+            conn.commit()
+        return deleted
+    
+    def prune(self):
+        """执行一次过期数据清理，返回各表删除的行数"""
+        started = time.monotonic()
+        now = datetime.utcnow()
+        deleted = {}
+        
+        for table, key, columns, time_column, policy in self.TARGETS:
+            days = self.retention_days[policy]
+            if not days or days <= 0:
+                continue
+            cutoff = (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            count = self._delete_batches(table, key, columns, time_column, cutoff)
+            if count:
+                deleted[table] = count
+                self.total_deleted[table] += count
+        
+        days = self.retention_days['changelog']
+        if days and days > 0:
+            count = self._prune_changelog((now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S'))
+            if count:
+                deleted['whitelist_changes'] = count
+                self.total_deleted['whitelist_changes'] += count
+        
+        # 归还空闲页，每步页数有限，避免长时间占用写锁
+        while not self._stop_event.is_set():
+            pages = self.db_manager.incremental_vacuum(self.VACUUM_PAGES_PER_STEP)
+            self.vacuumed_pages += pages
+            if pages < self.VACUUM_PAGES_PER_STEP:
+                break
+            self._stop_event.wait(self.BATCH_PAUSE)
+        
+        self.last_run_at = datetime.now()
+        self.last_duration_ms = round((time.monotonic() - started) * 1000, 1)
+        self.last_deleted = deleted
+        self.last_error = None
+        if deleted:
+            logger.info(f"Retention pruned {deleted} in {self.last_duration_ms}ms")
+        return deleted
+    
+    def status(self):
+        """获取保留策略和最近一次清理结果"""
+        return {
+            'running': self.running,
+            'retention_days': self.retention_days,
+            'interval': self.interval,
+            'batch_size': self.batch_size,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_duration_ms': self.last_duration_ms,
+            'last_deleted': self.last_deleted,
+            'total_deleted': dict(self.total_deleted),
+            'vacuumed_pages': self.vacuumed_pages,
+            'last_error': self.last_error
+        }
+
+class ExpiryScheduler:
+    """白名单条目过期调度后台线程
+    
+    休眠到最近一个条目的过期时间，到期后在一个事务中移除所有已到期的条目，只生成一次映射、重载一次。
+    其他进程新增的条目最晚在 interval 秒后被发现；本进程新增带过期时间的条目时立即唤醒重新计算。
+    """
+    
+    def __init__(self, whitelist_manager, interval=30.0):
+        self.whitelist_manager = whitelist_manager
+        self.interval = interval
+        self.running = False
+        self.next_expiry = None
+        self.last_run_at = None
+        self.last_expired = 0
+        self.total_expired = 0
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """启动后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='whitelist-expiry', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def wake(self):
+        self._wake_event.set()
+    
+    def run_once(self):
+        """移除已到期的条目，返回距下一个过期时间的秒数（最长 interval）"""
+        expired = self.whitelist_manager.expire_entries()
+        self.last_run_at = datetime.now()
+        self.last_expired = len(expired)
+        self.total_expired += len(expired)
+        self.next_expiry = self.whitelist_manager.next_expiry()
+        self.last_error = None
+        if self.next_expiry is None:
+            return self.interval
+        # 过期时间精确到秒，多等待一小段时间确保条目已到期
+        delay = (self.next_expiry - datetime.utcnow()).total_seconds() + 0.05
+        return min(max(delay, 0.0), self.interval)
+    
+    def _run(self):
+        self.running = True
         try:
-            # 这里可以集成IP地理位置查询服务
-            # 目前返回简单的分类
-            if ip.startswith('127.') or ip == '::1':
-                return '本地'
-            elif ip.startswith('192.168.') or ip.startswith('10.') or ip.startswith('172.'):
-                return '内网'
+            while not self._stop_event.is_set():
+                self._wake_event.clear()
+                try:
+                    delay = self.run_once()
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Whitelist expiry failed: {e}")
+                    delay = self.interval
+                self._wake_event.wait(delay)
+        finally:
+            self.running = False
+    
+    def status(self):
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'next_expiry': self.next_expiry.isoformat() + 'Z' if self.next_expiry else None,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_expired': self.last_expired,
+            'total_expired': self.total_expired,
+            'last_error': self.last_error
+        }
+
+class HostnameRefresher:
+    """主机名白名单条目的后台解析线程
+    
+    到达刷新时间的条目交给解析线程池并发解析，刷新间隔为记录 TTL 限制在 [min_ttl, max_ttl] 内，
+    解析失败时保留上一次的地址并在 min_ttl 秒后重试。每轮的结果在一个事务中保存，
+    只有地址集合变化时才更新映射、重载一次；请求和重载路径上从不进行 DNS 查询。
+    """
+    
+    def __init__(self, whitelist_manager, resolver, workers=4, min_ttl=60.0, max_ttl=3600.0, interval=30.0):
+        self.whitelist_manager = whitelist_manager
+        self.resolver = resolver
+        self.workers = max(1, workers)
+        self.min_ttl = min_ttl
+        self.max_ttl = max(min_ttl, max_ttl)
+        self.interval = interval
+        self.running = False
+        self.next_refresh = None
+        self.last_run_at = None
+        self.last_resolved = 0
+        self.last_changed = 0
+        self.total_failed = 0
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+        self._executor = None
+    
+    def start(self):
+        """启动后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dns-resolver')
+        self._thread = threading.Thread(target=self._run, name='hostname-refresher', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def wake(self):
+        self._wake_event.set()
+    
+    def clamp_ttl(self, ttl):
+        if ttl is None:
+            return self.max_ttl
+        return min(max(float(ttl), self.min_ttl), self.max_ttl)
+    
+    def resolve(self, entry_id, hostname):
+        """解析一个条目，返回 (条目ID, 地址列表, 刷新间隔, 错误信息)"""
+        try:
+            addresses, ttl = self.resolver.resolve(hostname)
+        except (DNSError, OSError) as e:
+            DNS_RESOLUTIONS.inc('failed')
+            logger.warning(f"Failed to resolve whitelist hostname {hostname}: {e}")
+            return entry_id, None, self.min_ttl, str(e)
+        return entry_id, addresses, self.clamp_ttl(ttl), None
+    
+    def run_once(self):
+        """解析所有到达刷新时间的条目，返回距下一次刷新的秒数（最长 interval）"""
+        due = self.whitelist_manager.get_due_hostnames()
+        if due:
+            executor = self._executor
+            if executor is not None:
+                results = list(executor.map(lambda item: self.resolve(*item), due))
             else:
-                return '外网'
-        except:
-            return '未知'
+                results = [self.resolve(*item) for item in due]
+            summary = self.whitelist_manager.save_resolutions(results)
+            failed = sum(1 for result in results if result[1] is None)
+            DNS_RESOLUTIONS.inc('changed', amount=summary['changed'])
+            DNS_RESOLUTIONS.inc('unchanged', amount=len(results) - failed - summary['changed'])
+            self.last_resolved = len(results)
+            self.last_changed = summary['changed']
+            self.total_failed += failed
+        self.last_run_at = datetime.now()
+        self.next_refresh = self.whitelist_manager.next_hostname_refresh()
+        self.last_error = None
+        if self.next_refresh is None:
+            return self.interval
+        delay = (self.next_refresh - datetime.utcnow()).total_seconds() + 0.05
+        return min(max(delay, 0.0), self.interval)
     
-    def update_connections(self):
-        """更新连接数据（定期调用）"""
+    def _run(self):
+        self.running = True
         try:
-            # 检查日志文件状态
-            if not self.log_path.exists():
-                logger.warning(f"Nginx log file not found: {self.log_path}")
-                return
+            while not self._stop_event.is_set():
+                self._wake_event.clear()
+                try:
+                    delay = self.run_once()
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Hostname refresh failed: {e}")
+                    delay = self.interval
+                self._wake_event.wait(delay)
+        finally:
+            self.running = False
+    
+    def status(self):
+        return {
+            'running': self.running,
+            'resolver': repr(self.resolver),
+            'ttl_range': [self.min_ttl, self.max_ttl],
+            'next_refresh': self.next_refresh.isoformat() + 'Z' if self.next_refresh else None,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_resolved': self.last_resolved,
+            'last_changed': self.last_changed,
+            'total_failed': self.total_failed,
+            'last_error': self.last_error
+        }
+
+class ReplicationFollower:
+    """从节点同步后台线程
+    
+    每隔 interval 秒按本地的 replica_version 向主节点请求增量变更，每批变更在一个事务中应用、只重载一次，
+    有更多变更时立即拉取下一批；首次同步、落后于主节点变更日志的起点或主节点版本回退时改为拉取全量快照。
+    """
+    
+    def __init__(self, whitelist_manager, primary_url, token='', interval=5.0, batch_size=1000, timeout=10.0):
+        self.whitelist_manager = whitelist_manager
+        self.primary_url = primary_url.rstrip('/')
+        self.token = token
+        self.interval = interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.running = False
+        self.primary_version = None
+        self.last_sync_at = None
+        self.last_batches = 0
+        self.total_batches = 0
+        self.snapshots = 0
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """启动后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='replication-follower', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def wake(self):
+        self._wake_event.set()
+    
+    def fetch(self, path, **params):
+        """请求主节点接口，返回 data 字段"""
+        url = self.primary_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as response:
+                body = response.read()
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"{path}: HTTP {e.code} from primary")
+        payload = json.loads(body)
+        if not payload.get('success'):
+            raise RuntimeError(f"{path}: {payload.get('message') or 'request failed'}")
+        return payload['data']
+    
+    def sync_once(self):
+        """拉取并应用变更直到追上主节点，返回应用的批次数"""
+        batches = 0
+        while not self._stop_event.is_set():
+            since = self.whitelist_manager.get_replica_version()
+            data = None
+            if since is not None:
+                data = self.fetch('/api/whitelist/changes', since=since, limit=self.batch_size)
             
-            file_size = self.log_path.stat().st_size
-            logger.debug(f"Nginx log file size: {file_size}, last position: {self.last_position}")
+            if data is None or data['snapshot_required']:
+                snapshot = self.fetch('/api/whitelist/snapshot')
+                result = self.whitelist_manager.apply_replica(snapshot['entries'], snapshot['version'],
+                                                              snapshot=True, source=self.primary_url)
+                REPLICATION_BATCHES.inc('snapshot')
+                self.primary_version = snapshot['version']
+                self.snapshots += 1
+                batches += 1
+                logger.info(f"Whitelist snapshot from {self.primary_url} applied at version "
+                            f"{snapshot['version']}: {result}")
+                continue
             
-            connections = self.parse_nginx_logs()
-            if connections:
-                self.record_connections(connections)
-                logger.info(f"Recorded {len(connections)} new connections")
-            else:
-                logger.debug("No new connections found in nginx logs")
-                
-        except Exception as e:
-            logger.error(f"Error updating connections: {e}")
-            import traceback
-            logger.error(f"Full traceback: {traceback.format_exc()}")
+            self.primary_version = data['current_version']
+            if data['changes'] or data['version'] != since:
+                self.whitelist_manager.apply_replica(data['changes'], data['version'], source=self.primary_url)
+                if data['changes']:
+                    REPLICATION_BATCHES.inc('changes')
+                    batches += 1
+            if not data['has_more']:
+                break
+        
+        self.last_sync_at = datetime.now()
+        self.last_batches = batches
+        self.total_batches += batches
+        self.last_error = None
+        return batches
+    
+    def _run(self):
+        self.running = True
+        try:
+            while not self._stop_event.is_set():
+                self._wake_event.clear()
+                try:
+                    self.sync_once()
+                except Exception as e:
+                    REPLICATION_BATCHES.inc('failed')
+                    self.last_error = str(e)
+                    logger.warning(f"Whitelist replication from {self.primary_url} failed: {e}")
+                self._wake_event.wait(self.interval)
+        finally:
+            self.running = False
+    
+    def status(self):
+        replica_version = self.whitelist_manager.get_replica_version()
+        return {
+            'running': self.running,
+            'primary': self.primary_url,
+            'replica_version': replica_version,
+            'primary_version': self.primary_version,
+            'lag': (self.primary_version - replica_version
+                    if self.primary_version is not None and replica_version is not None else None),
+            'last_sync_at': self.last_sync_at.isoformat() if self.last_sync_at else None,
+            'last_batches': self.last_batches,
+            'total_batches': self.total_batches,
+            'snapshots': self.snapshots,
+            'last_error': self.last_error
+        }
+
+class ResponseCache:
+    """只读接口的响应缓存
+    
+    每个键缓存序列化后的响应体及其 gzip 压缩结果，并记录生成时的白名单版本；
+    版本号变化后条目自动失效，下一次请求重新生成。
+    """
+    
+    def __init__(self, gzip_min_size=1024, gzip_level=6):
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+        self._entries = {}  # key -> (version, body, gzip_body)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def compress(self, body):
+        """压缩响应体，小于阈值时返回 None"""
+        if len(body) < self.gzip_min_size:
+            return None
+        return gzip.compress(body, self.gzip_level)
+    
+    def get(self, key, version, build):
+        """返回 (body, gzip_body)，缓存缺失或版本不一致时调用 build() 重新生成"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+        
+        # 先读版本再生成内容：并发修改时内容只会比版本新，下次请求会按新版本重新生成
+        body = build()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        compressed = self.compress(body)
+        with self._lock:
+            self._entries[key] = (version, body, compressed)
+        return body, compressed
+    
+    def status(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
 
 class AuthManager:
     """认证管理类"""
@@ -753,10 +3636,9 @@ class AuthManager:
     
     def authenticate_user(self, username, password):
         """用户认证"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             
             cursor.execute('''
@@ -779,9 +3661,6 @@ class AuthManager:
                 'id': user['id'],
                 'username': user['username']
             }
-            
-        finally:
-            conn.close()
     
     def generate_token(self, user):
         """生成JWT token"""
@@ -801,12 +3680,306 @@ class AuthManager:
             return None
         except jwt.InvalidTokenError:
             return None
+    
+    def _ticket_key(self, purpose):
+        # 票据使用按用途派生的密钥签名，不能当作登录 token 使用，也不能用于其他用途
+        return hmac.new(self.secret_key.encode(), f'ticket:{purpose}'.encode(), hashlib.sha256).hexdigest()
+    
+    def generate_ticket(self, payload, purpose, ttl):
+        """为已登录用户签发单一用途的短期票据（放在URL中，代替登录 token）
+        
+        票据在 ttl 秒后失效；token_exp 为登录 token 的过期时间，用票据建立的长连接在此时结束。
+        """
+        ticket = {
+            'user_id': payload.get('user_id'),
+            'username': payload.get('username'),
+            'purpose': purpose,
+            'token_exp': payload.get('exp'),
+            'exp': datetime.utcnow() + timedelta(seconds=ttl)
+        }
+        return jwt.encode(ticket, self._ticket_key(purpose), algorithm='HS256')
+    
+    def verify_ticket(self, ticket, purpose):
+        """验证票据，无效、过期或用途不符时返回 None"""
+        try:
+            payload = jwt.decode(ticket, self._ticket_key(purpose), algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return None
+        return payload if payload.get('purpose') == purpose else None
+
+class lazy_service:
+    """Services 的属性：首次访问时调用被装饰的方法创建实例，之后返回同一个实例"""
+    
+    def __init__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+    
+    def __get__(self, services, owner=None):
+        if services is None:
+            return self
+        instance = services._instances.get(self.name)
+        if instance is None:
+            with services._lock:
+                instance = services._instances.get(self.name)
+                if instance is None:
+                    started = time.perf_counter()
+                    instance = self.build(services)
+                    services.build_seconds[self.name] = time.perf_counter() - started
+                    services._instances[self.name] = instance
+        return instance
+
+class Services:
+    """本进程使用的管理器
+    
+    create_app() 只创建本对象，各管理器在首次使用时才按配置和数据目录创建：
+    只处理 API 请求的 worker 不会加载 GeoIP 库或读取日志游标，
+    数据库迁移在首次访问数据库时执行（已是最新版本时只检查版本号）。
+    """
+    
+    def __init__(self, config, paths):
+        self.config = config
+        self.paths = paths
+        self.build_seconds = {}  # 各管理器的创建耗时（秒）
+        self._instances = {}
+        self._lock = threading.RLock()  # 创建管理器时会递归创建它依赖的管理器
+    
+    @lazy_service
+    def db_manager(self):
+        db_manager = DatabaseManager(
+            self.paths.db,
+            pool_size=self.config['DB_POOL_SIZE'],
+            journal_mode=self.config['DB_JOURNAL_MODE'],
+            synchronous=self.config['DB_SYNCHRONOUS'],
+            busy_timeout=self.config['DB_BUSY_TIMEOUT'],
+            cache_size=self.config['DB_CACHE_SIZE'],
+            mmap_size=self.config['DB_MMAP_SIZE'],
+            auto_vacuum=self.config['DB_AUTO_VACUUM']
+        )
+        db_manager.init_database(admin_password=self.config['ADMIN_PASSWORD'])
+        return db_manager
+    
+    @lazy_service
+    def whitelist_manager(self):
+        haproxy_enabled = self.config['HAPROXY_WHITELIST']
+        manager = WhitelistManager(
+            self.paths.nginx_whitelist, self.db_manager,
+            map_path=self.paths.nginx_map,
+            reload_lock_path=self.paths.reload_lock,
+            reload_window=self.config['RELOAD_COALESCE_WINDOW'],
+            reload_max_latency=self.config['RELOAD_MAX_LATENCY'],
+            aggregate_cidr=self.config['WHITELIST_AGGREGATE_CIDR'],
+            nginx_reload=not haproxy_enabled
+        )
+        if haproxy_enabled:
+            # 映射文件所在目录与 HAProxy 容器共享时同时保存文件，HAProxy 重启后直接加载
+            map_name = self.config['HAPROXY_WHITELIST_MAP']
+            manager.haproxy_sync = HAProxyMapSync(
+                RuntimeAPIClient(self.config['HAPROXY_RUNTIME_API'], timeout=self.config['HAPROXY_RUNTIME_TIMEOUT']),
+                map_name, manager.build_haproxy_entries,
+                interval=self.config['HAPROXY_RECONCILE_INTERVAL'],
+                save_entries=manager.save_haproxy_map if Path(map_name).parent.is_dir() else None
+            )
+        return manager
+    
+    @lazy_service
+    def auth_manager(self):
+        return AuthManager(self.db_manager, self.config['SECRET_KEY'])
+    
+    @lazy_service
+    def geoip(self):
+        paths = split_paths(self.config['GEOIP_DATABASES']) or self.paths.geoip_databases()
+        return GeoIPResolver(load_geoip_databases(paths), cache_size=self.config['GEOIP_CACHE_SIZE'])
+    
+    @lazy_service
+    def connection_monitor(self):
+        monitor = ConnectionMonitor(
+            self.db_manager,
+            log_paths=split_paths(self.config['CONNECTION_LOG_FILES']),
+            batch_bytes=self.config['INGESTION_BATCH_BYTES'],
+            geoip=self.geoip,
+            legacy_position_path=self.paths.log_position
+        )
+        monitor.listeners.append(self.event_broadcaster.publish_connections)
+        return monitor
+    
+    @lazy_service
+    def ingestion_worker(self):
+        return LogIngestionWorker(self.connection_monitor, self.config['INGESTION_POLL_INTERVAL'])
+    
+    @lazy_service
+    def event_broadcaster(self):
+        return EventBroadcaster(
+            buffer_size=self.config['SSE_CLIENT_BUFFER'],
+            max_clients=self.config['SSE_MAX_CLIENTS'],
+            stats_interval=self.config['SSE_STATS_INTERVAL']
+        )
+    
+    @lazy_service
+    def response_cache(self):
+        return ResponseCache(
+            gzip_min_size=self.config['RESPONSE_GZIP_MIN_BYTES'],
+            gzip_level=self.config['RESPONSE_GZIP_LEVEL']
+        )
+    
+    @lazy_service
+    def retention_pruner(self):
+        return RetentionPruner(
+            self.db_manager,
+            raw_days=self.config['CONNECTION_LOG_RETENTION_DAYS'],
+            minute_days=self.config['ROLLUP_MINUTE_RETENTION_DAYS'],
+            hour_days=self.config['ROLLUP_HOUR_RETENTION_DAYS'],
+            interval=self.config['RETENTION_INTERVAL'],
+            batch_size=self.config['RETENTION_BATCH_SIZE'],
+            changelog_days=self.config['WHITELIST_CHANGELOG_RETENTION_DAYS']
+        )
+    
+    @lazy_service
+    def expiry_scheduler(self):
+        scheduler = ExpiryScheduler(self.whitelist_manager, interval=self.config['WHITELIST_EXPIRY_CHECK_INTERVAL'])
+        self.whitelist_manager.expiry_scheduler = scheduler
+        return scheduler
+    
+    @lazy_service
+    def hostname_refresher(self):
+        refresher = HostnameRefresher(
+            self.whitelist_manager,
+            create_resolver(self.config['DNS_RESOLVER'], timeout=self.config['DNS_TIMEOUT']),
+            workers=self.config['DNS_RESOLVER_WORKERS'],
+            min_ttl=self.config['DNS_MIN_TTL'],
+            max_ttl=self.config['DNS_MAX_TTL'],
+            interval=self.config['DNS_CHECK_INTERVAL']
+        )
+        self.whitelist_manager.hostname_refresher = refresher
+        return refresher
+    
+    @lazy_service
+    def replication_follower(self):
+        follower = ReplicationFollower(
+            self.whitelist_manager,
+            self.config['REPLICATION_PRIMARY'],
+            token=self.config['REPLICATION_TOKEN'],
+            interval=self.config['REPLICATION_INTERVAL'],
+            batch_size=self.config['REPLICATION_BATCH_SIZE'],
+            timeout=self.config['REPLICATION_TIMEOUT']
+        )
+        self.whitelist_manager.replication_follower = follower
+        return follower
+    
+    @lazy_service
+    def background_services(self):
+        # leader 服务通过代理传入，follower 进程在取得 leader 锁之前不会创建采集线程和连接监控
+        leader_services = [
+            LocalProxy(lambda: self.ingestion_worker),
+            LocalProxy(lambda: self.retention_pruner),
+            LocalProxy(lambda: self.expiry_scheduler),
+            LocalProxy(lambda: self.hostname_refresher)
+        ]
+        if self.config['HAPROXY_WHITELIST']:
+            # 各进程都推送增量，全量对账只在 leader 进程中运行
+            leader_services.append(LocalProxy(lambda: self.whitelist_manager.haproxy_sync))
+        if self.config['REPLICATION_PRIMARY']:
+            # 从节点：白名单由主节点同步
+            leader_services.append(LocalProxy(lambda: self.replication_follower))
+        return BackgroundServices(
+            self.paths.leader_lock,
+            leader_services=leader_services,
+            follower_services=[ConnectionTailer(
+                self.db_manager, self.event_broadcaster.publish_connections, self.event_broadcaster.has_subscribers,
+                interval=self.config['INGESTION_POLL_INTERVAL']
+            )],
+            retry_interval=self.config['LEADER_RETRY_INTERVAL']
+        )
 
-# 初始化管理器
-db_manager = DatabaseManager(DB_PATH)
-whitelist_manager = WhitelistManager(NGINX_WHITELIST_PATH, db_manager)
-auth_manager = AuthManager(db_manager, app.config['SECRET_KEY'])
-connection_monitor = ConnectionMonitor(db_manager)
+# 本进程的管理器，由 create_app() 创建
+services = None
+
+def get_services():
+    if services is None:
+        raise RuntimeError('create_app() must be called before the application services are used')
+    return services
+
+# 路由和后台线程通过代理访问管理器
+db_manager = LocalProxy(lambda: get_services().db_manager)
+whitelist_manager = LocalProxy(lambda: get_services().whitelist_manager)
+auth_manager = LocalProxy(lambda: get_services().auth_manager)
+connection_monitor = LocalProxy(lambda: get_services().connection_monitor)
+ingestion_worker = LocalProxy(lambda: get_services().ingestion_worker)
+event_broadcaster = LocalProxy(lambda: get_services().event_broadcaster)
+response_cache = LocalProxy(lambda: get_services().response_cache)
+retention_pruner = LocalProxy(lambda: get_services().retention_pruner)
+background_services = LocalProxy(lambda: get_services().background_services)
+
+def whitelist_map_stats():
+    """nginx 映射文件的条目数和字节数，文件不存在时返回 None"""
+    try:
+        data = whitelist_manager.map_path.read_bytes()
+    except OSError:
+        return None
+    entries = sum(1 for line in data.splitlines() if line and not line.startswith(b'#'))
+    return {('entries',): entries, ('bytes',): len(data)}
+
+def ingestion_lag_bytes():
+    """未采集的日志字节数（采集在其他进程中运行时先从数据库读取游标）"""
+    if background_services.started and not background_services.is_leader:
+        connection_monitor.load_cursors()
+    return connection_monitor.get_ingestion_lag()
+
+def haproxy_map_drift():
+    """最近一次 HAProxy 映射对账补齐/删除的条目数，未启用时返回 None"""
+    sync = whitelist_manager.haproxy_sync
+    if sync is None or not sync.reconcile_count:
+        return None
+    return {(change,): count for change, count in sync.last_drift.items()}
+
+metrics.gauge('mtproxy_whitelist_map', 'nginx whitelist map entry count and file size in bytes',
+              whitelist_map_stats, ('kind',))
+metrics.gauge('mtproxy_ingestion_lag_bytes', 'Unread bytes in the nginx connection logs', ingestion_lag_bytes)
+metrics.gauge('mtproxy_reload_pending', 'Whitelist changes waiting for a reload in this process',
+              lambda: int(whitelist_manager.reload_scheduler.status()['dirty']))
+metrics.gauge('mtproxy_haproxy_map_drift', 'Entries corrected by the last HAProxy map reconcile in this process',
+              haproxy_map_drift, ('change',))
+metrics.gauge('mtproxy_sse_clients', 'Live connection stream clients in this process',
+              lambda: event_broadcaster.status()['clients'])
+
+def startup_durations():
+    """create_app() 和各管理器的创建耗时"""
+    if services is None:
+        return None
+    return {(name,): seconds for name, seconds in services.build_seconds.items()}
+
+metrics.gauge('mtproxy_startup_duration_seconds', 'Time spent in create_app and building each service in this process',
+              startup_durations, ('component',))
+
+def create_app(config=None, start_services=True):
+    """应用工厂：准备数据目录和日志，启动本进程的后台服务并返回应用
+    
+    导入本模块不读写任何文件；config 中的键覆盖环境变量配置（如 {'DATA_DIR': '/tmp/mtproxy'}），
+    在本进程首次调用时生效。gunicorn 的每个 worker 进程在 fork 之后各调用一次（见 gunicorn.conf.py），
+    日志采集和数据清理只在取得 leader 锁的进程中运行；各进程的指标快照写入数据目录供合并。
+    start_services=False 时不启动后台线程（脚本和基准测试使用）。
+    """
+    global services
+    started = time.perf_counter()
+    if services is None:
+        if config:
+            app.config.update(config)
+        paths = AppPaths(app.config['DATA_DIR'])
+        paths.ensure_dirs()
+        configure_logging(paths.log_dir)
+        # 多进程部署时各 worker 共享同一个JWT密钥
+        if not app.config['SECRET_KEY']:
+            app.config['SECRET_KEY'] = load_secret_key(paths.secret_key)
+        services = Services(app.config, paths)
+    
+    if start_services:
+        services.background_services.start()
+        metrics.start_sharing(services.paths.metrics_dir, app.config['METRICS_SHARE_INTERVAL'])
+    
+    elapsed = time.perf_counter() - started
+    services.build_seconds['create_app'] = elapsed
+    logger.info(f"Application created in {elapsed:.3f}s (pid {os.getpid()})")
+    return app
 
 def require_auth(f):
     """认证装饰器"""
@@ -833,27 +4006,150 @@ def require_auth(f):
     
     return decorated_function
 
+def require_replication_auth(f):
+    """复制接口的认证：从节点使用 REPLICATION_TOKEN，也接受登录 Token"""
+    authenticated = require_auth(f)
+    
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = app.config['REPLICATION_TOKEN']
+        auth_header = request.headers.get('Authorization', '')
+        if token and secrets.compare_digest(auth_header.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+            g.current_user = {'username': 'replication'}
+            return f(*args, **kwargs)
+        return authenticated(*args, **kwargs)
+    
+    return decorated_function
+
+def require_writable(f):
+    """从节点的白名单由主节点同步，拒绝本地修改"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if app.config['REPLICATION_PRIMARY']:
+            return jsonify({
+                'success': False,
+                'message': f"This node replicates the whitelist from {app.config['REPLICATION_PRIMARY']}, "
+                           f"make changes on the primary"
+            }), 409
+        return f(*args, **kwargs)
+    
+    return decorated_function
+
+def metrics_access_allowed():
+    """/metrics 只允许 METRICS_ALLOW 中的来源地址，或携带 METRICS_TOKEN 的请求"""
+    token = app.config['METRICS_TOKEN']
+    auth_header = request.headers.get('Authorization', '')
+    if token and secrets.compare_digest(auth_header.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+        return True
+    
+    try:
+        remote = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    if remote.version == 6 and remote.ipv4_mapped:
+        remote = remote.ipv4_mapped
+    for item in app.config['METRICS_ALLOW'].split(','):
+        try:
+            if item.strip() and remote in ipaddress.ip_network(item.strip(), strict=False):
+                return True
+        except ValueError:
+            logger.warning(f"Ignoring invalid METRICS_ALLOW entry: {item.strip()}")
+    return False
+
 def log_operation(action, target='', details=''):
     """记录操作日志"""
     try:
         user = g.current_user.get('username', 'unknown') if hasattr(g, 'current_user') else 'system'
         ip_address = request.remote_addr if request else ''
         
-        conn = db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO operation_logs (user, action, target, details, ip_address)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user, action, target, details, ip_address))
-        
-        conn.commit()
-        conn.close()
+        with db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO operation_logs (user, action, target, details, ip_address)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user, action, target, details, ip_address))
+            
+            conn.commit()
     except Exception as e:
         logger.error(f"Error logging operation: {e}")
 
 # API 路由
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板记录请求数和延迟（未匹配的路由归为 unmatched，避免标签数量无限增长）"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+    return response
+
+def accepts_gzip():
+    """客户端是否接受 gzip 编码"""
+    return request.accept_encodings['gzip'] > 0
+
+def is_not_modified(etag, updated_at):
+    """条件请求是否命中（可以返回 304）
+    
+    有 If-None-Match 时只比较 ETag（即白名单版本号）。最后修改时间只精确到秒，同一秒内的多次修改
+    Last-Modified 相同，因此 If-Modified-Since 只有晚于最后修改时间（而不是相等）时才算未修改。
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and updated_at is not None and updated_at < since
+
+def versioned_response(key, build, mimetype='application/json'):
+    """按白名单版本生成带 ETag/Last-Modified 的响应
+    
+    条件请求命中时（见 is_not_modified）返回 304，否则从响应缓存取出响应体，
+    客户端支持时直接返回缓存的 gzip 压缩结果。
+    """
+    version, updated_at = whitelist_manager.get_version()
+    etag = f'wl-{version}-{key}'
+    
+    if is_not_modified(etag, updated_at):
+        response = Response(status=304)
+    else:
+        body, compressed = response_cache.get(key, version, build)
+        if compressed is not None and accepts_gzip():
+            response = Response(compressed, mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype=mimetype)
+    
+    response.set_etag(etag, weak=True)
+    response.last_modified = updated_at
+    response.vary.add('Accept-Encoding')
+    # 响应与登录用户相关，只允许客户端缓存，每次使用前重新验证
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.after_request
+def compress_response(response):
+    """压缩较大的 JSON 响应（已编码和流式响应不处理）"""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    if not accepts_gzip():
+        return response
+    
+    compressed = response_cache.compress(response.get_data())
+    if compressed is not None:
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     """用户登录"""
@@ -904,13 +4200,12 @@ def verify_token():
 @app.route('/api/whitelist', methods=['GET'])
 @require_auth
 def get_whitelist():
-    """获取白名单列表"""
+    """获取白名单列表（按白名单版本缓存，支持 ETag 条件请求）"""
     try:
-        whitelist = whitelist_manager.get_whitelist()
-        return jsonify({
+        return versioned_response('whitelist', lambda: json.dumps({
             'success': True,
-            'data': whitelist
-        })
+            'data': whitelist_manager.get_whitelist()
+        }, ensure_ascii=False))
     except Exception as e:
         logger.error(f"Error getting whitelist: {e}")
         return jsonify({
@@ -920,6 +4215,7 @@ def get_whitelist():
 
 @app.route('/api/whitelist', methods=['POST'])
 @require_auth
+@require_writable
 def add_whitelist_ip():
     """添加IP到白名单"""
     try:
@@ -934,7 +4230,9 @@ def add_whitelist_ip():
             }), 400
         
         user = g.current_user.get('username', '')
-        item_id = whitelist_manager.add_ip(ip, description, user)
+        # 可选的过期时间：expires_at（ISO时间）或 expires_in（秒）
+        item_id = whitelist_manager.add_ip(ip, description, user, expires_at=data.get('expires_at'),
+                                           expires_in=data.get('expires_in'))
         
         log_operation('ADD_IP', ip, description)
         
@@ -958,6 +4256,7 @@ def add_whitelist_ip():
 
 @app.route('/api/whitelist/<int:item_id>', methods=['DELETE'])
 @require_auth
+@require_writable
 def remove_whitelist_ip(item_id):
     """从白名单移除IP"""
     try:
@@ -983,34 +4282,220 @@ def remove_whitelist_ip(item_id):
             'message': 'Failed to remove IP'
         }), 500
 
-@app.route('/api/whitelist/export', methods=['GET'])
+@app.route('/api/whitelist/bulk', methods=['POST'])
 @require_auth
-def export_whitelist():
-    """导出白名单配置"""
+@require_writable
+def bulk_update_whitelist():
+    """批量添加/移除白名单IP"""
     try:
-        whitelist = whitelist_manager.get_whitelist()
+        data = request.get_json() or {}
+        action = data.get('action', 'add')
+        items = data.get('items')
         
-        lines = [
-            "# MTProxy Whitelist Export",
-            f"# Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            f"# Total entries: {len(whitelist)}",
-            ""
-        ]
+        if action not in ('add', 'remove'):
+            return jsonify({
+                'success': False,
+                'message': "Action must be 'add' or 'remove'"
+            }), 400
         
-        for item in whitelist:
-            if item['description']:
-                lines.append(f"# {item['description']}")
-            lines.append(f"{item['ip']} 1;")
-            lines.append("")
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'success': False,
+                'message': 'Items must be a non-empty list'
+            }), 400
+        
+        max_items = app.config['WHITELIST_BULK_MAX_ITEMS']
+        if len(items) > max_items:
+            return jsonify({
+                'success': False,
+                'message': f'Too many items in one batch (max {max_items})'
+            }), 400
+        
+        user = g.current_user.get('username', '')
+        if action == 'add':
+            result = whitelist_manager.bulk_add_ips(items, user)
+            summary = f"{result['added']} added, {result['failed']} failed"
+            log_operation('BULK_ADD_IP', f'{len(items)} items', summary)
+        else:
+            result = whitelist_manager.bulk_remove_ips(items, user)
+            summary = f"{result['removed']} removed, {result['failed']} failed"
+            log_operation('BULK_REMOVE_IP', f'{len(items)} items', summary)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Bulk {action} completed: {summary}',
+            'data': result
+        })
+    
+    except Exception as e:
+        logger.error(f"Error in bulk whitelist update: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to update whitelist in bulk'
+        }), 500
+
+@app.route('/api/whitelist/changes', methods=['GET'])
+@require_replication_auth
+def get_whitelist_changes():
+    """白名单增量变更（从节点同步用）：版本 since 之后的变更，最多约 limit 条"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', app.config['REPLICATION_BATCH_SIZE']))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'since and limit must be integers'
+        }), 400
+    
+    try:
+        limit = max(1, min(limit, app.config['WHITELIST_BULK_MAX_ITEMS']))
+        return jsonify({
+            'success': True,
+            'data': whitelist_manager.get_changes(since, limit)
+        })
+    except Exception as e:
+        logger.error(f"Error getting whitelist changes: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to get whitelist changes'
+        }), 500
+
+@app.route('/api/whitelist/snapshot', methods=['GET'])
+@require_replication_auth
+def get_whitelist_snapshot():
+    """白名单全量快照（新从节点初始化用，按白名单版本缓存）"""
+    try:
+        return versioned_response('snapshot', lambda: json.dumps({
+            'success': True,
+            'data': whitelist_manager.get_snapshot()
+        }, ensure_ascii=False))
+    except Exception as e:
+        logger.error(f"Error getting whitelist snapshot: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to get whitelist snapshot'
+        }), 500
+
+@app.route('/api/whitelist/check', methods=['GET'])
+@require_auth
+def check_whitelist_ip():
+    """查询单个IP是否在白名单中"""
+    ip = request.args.get('ip', '').strip()
+    if not ip:
+        return jsonify({
+            'success': False,
+            'message': 'IP address is required'
+        }), 400
+    
+    try:
+        return jsonify({
+            'success': True,
+            'data': whitelist_manager.check_ip(ip)
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error checking IP: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to check IP'
+        }), 500
+
+@app.route('/api/whitelist/check', methods=['POST'])
+@require_auth
+def check_whitelist_ips():
+    """批量查询IP是否在白名单中"""
+    try:
+        data = request.get_json() or {}
+        ips = data.get('ips')
+        
+        if not isinstance(ips, list) or not ips:
+            return jsonify({
+                'success': False,
+                'message': 'IPs must be a non-empty list'
+            }), 400
         
-        config_text = '\n'.join(lines)
+        max_items = app.config['WHITELIST_BULK_MAX_ITEMS']
+        if len(ips) > max_items:
+            return jsonify({
+                'success': False,
+                'message': f'Too many IPs in one batch (max {max_items})'
+            }), 400
         
-        log_operation('EXPORT_WHITELIST')
+        results = []
+        for ip in ips:
+            try:
+                results.append(whitelist_manager.check_ip(str(ip)))
+            except ValueError as e:
+                results.append({'ip': ip, 'allowed': False, 'error': str(e)})
         
         return jsonify({
             'success': True,
-            'data': config_text
+            'data': results
+        })
+    
+    except Exception as e:
+        logger.error(f"Error checking IPs: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to check IPs'
+        }), 500
+
+@app.route('/api/whitelist/redundancy', methods=['GET'])
+@require_auth
+def get_whitelist_redundancy():
+    """获取白名单冗余条目报告"""
+    try:
+        report = whitelist_manager.get_redundancy_report()
+        return jsonify({
+            'success': True,
+            'data': report
         })
+    except Exception as e:
+        logger.error(f"Error building redundancy report: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to build redundancy report'
+        }), 500
+
+def build_whitelist_export():
+    """生成白名单导出文本"""
+    whitelist = whitelist_manager.get_whitelist()
+    
+    lines = [
+        "# MTProxy Whitelist Export",
+        f"# Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"# Total entries: {len(whitelist)}",
+        ""
+    ]
+    
+    for item in whitelist:
+        if item['description']:
+            lines.append(f"# {item['description']}")
+        if item['ip_type'] == 'hostname':
+            # 主机名条目导出当前解析得到的地址
+            lines.append(f"# {item['ip']}")
+        lines.extend(f"{ip} 1;" for ip in whitelist_manager.map_keys(item))
+        lines.append("")
+    
+    return '\n'.join(lines)
+
+@app.route('/api/whitelist/export', methods=['GET'])
+@require_auth
+def export_whitelist():
+    """导出白名单配置（按白名单版本缓存，支持 ETag 条件请求）"""
+    try:
+        response = versioned_response('export', lambda: json.dumps({
+            'success': True,
+            'data': build_whitelist_export()
+        }, ensure_ascii=False))
+        # 304 没有返回内容，不记为一次导出
+        if response.status_code == 200:
+            log_operation('EXPORT_WHITELIST')
+        return response
         
     except Exception as e:
         logger.error(f"Error exporting whitelist: {e}")
@@ -1032,16 +4517,29 @@ def get_status():
         except:
             nginx_status = 'unknown'
         
-        # 检查白名单条目数
-        whitelist_count = len(whitelist_manager.get_whitelist())
+        # 检查白名单条目数（只计数，不加载整个列表）
+        whitelist_count = whitelist_manager.get_whitelist_count()
+        version, _ = whitelist_manager.get_version()
+        next_expiry = whitelist_manager.next_expiry()
+        
+        data = {
+            'nginx_status': nginx_status,
+            'whitelist_count': whitelist_count,
+            'whitelist_version': version,
+            'next_expiry': next_expiry.isoformat() + 'Z' if next_expiry else None,
+            'response_cache': response_cache.status(),
+            'reload': reload_status(),
+            'timestamp': datetime.now().isoformat()
+        }
+        if whitelist_manager.hostname_refresher is not None:
+            # 只有运行后台解析的（leader）进程有该状态
+            data['hostname_resolution'] = whitelist_manager.hostname_refresher.status()
+        if whitelist_manager.replication_follower is not None:
+            data['replication'] = whitelist_manager.replication_follower.status()
         
         return jsonify({
             'success': True,
-            'data': {
-                'nginx_status': nginx_status,
-                'whitelist_count': whitelist_count,
-                'timestamp': datetime.now().isoformat()
-            }
+            'data': data
         })
         
     except Exception as e:
@@ -1051,26 +4549,101 @@ def get_status():
             'message': 'Failed to get status'
         }), 500
 
+@app.route('/api/storage', methods=['GET'])
+@require_auth
+def get_storage():
+    """获取数据库大小、各表行数和数据保留策略状态"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': {
+                'database': db_manager.get_storage_info(),
+                'retention': retention_pruner.status()
+            }
+        })
+    
+    except Exception as e:
+        logger.error(f"Error getting storage info: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to get storage info'
+        }), 500
+
+def reload_status():
+    """nginx 重载调度状态，启用 HAProxy 同步时附带同步状态"""
+    status = whitelist_manager.reload_scheduler.status()
+    status['nginx_reload'] = whitelist_manager.nginx_reload
+    if whitelist_manager.haproxy_sync is not None:
+        status['haproxy'] = whitelist_manager.haproxy_sync.status()
+    return status
+
+@app.route('/api/reload', methods=['POST'])
+@require_auth
+def reload_config():
+    """立即重新生成白名单配置并重载nginx（启用 HAProxy 同步时同时执行一次全量对账）"""
+    try:
+        details = []
+        if whitelist_manager.haproxy_sync is not None:
+            drift = whitelist_manager.haproxy_sync.reconcile()
+            details.append(f"haproxy +{drift['added']}/-{drift['removed']}")
+        if whitelist_manager.nginx_reload:
+            # 手动重载不检查映射内容是否变化
+            version = whitelist_manager.reload_scheduler.flush(force=True)
+            details.append(f'version {version}')
+        
+        log_operation('RELOAD_WHITELIST', '', ', '.join(details))
+        
+        return jsonify({
+            'success': True,
+            'message': 'Whitelist reloaded successfully',
+            'data': reload_status()
+        })
+    
+    except Exception as e:
+        logger.error(f"Error reloading whitelist: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to reload whitelist',
+            'error': str(e)
+        }), 500
+
+@app.route('/api/reload/status', methods=['GET'])
+@require_auth
+def get_reload_status():
+    """获取白名单重载调度状态"""
+    status = reload_status()
+    status['applied_map_hash'] = whitelist_manager.applied_map_hash
+    
+    return jsonify({
+        'success': True,
+        'data': status
+    })
+
 @app.route('/api/logs', methods=['GET'])
 @require_auth
 def get_logs():
-    """获取操作日志"""
+    """获取操作日志（支持按用户/操作/IP/时间筛选，使用 after 令牌翻页）"""
     try:
         limit = min(int(request.args.get('limit', 100)), 1000)
-        offset = int(request.args.get('offset', 0))
+        conditions, params = time_range_conditions(
+            'timestamp',
+            parse_utc_time(request.args.get('start')),
+            parse_utc_time(request.args.get('end'))
+        )
+        for arg, column in (('user', 'user'), ('action', 'action'), ('ip', 'ip_address')):
+            value = request.args.get(arg)
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
         
-        conn = db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user, action, target, details, ip_address, timestamp
-            FROM operation_logs
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        ''', (limit, offset))
+        with db_manager.connection() as conn:
+            rows, next_token = keyset_query(conn.cursor(), '''
+                SELECT id, user, action, target, details, ip_address, timestamp
+                FROM operation_logs
+            ''', conditions, params, 'timestamp', limit, request.args.get('after'))
         
         logs = []
-        for row in cursor.fetchall():
+        for row in rows:
             logs.append({
                 'user': row['user'],
                 'action': row['action'],
@@ -1080,13 +4653,17 @@ def get_logs():
                 'timestamp': row['timestamp']
             })
         
-        conn.close()
-        
         return jsonify({
             'success': True,
-            'data': logs
+            'data': logs,
+            'next': next_token
         })
-        
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"Error getting logs: {e}")
         return jsonify({
@@ -1096,31 +4673,49 @@ def get_logs():
 
 # 连接监控API端点
 
+def refresh_ingestion_cursors():
+    """采集在其他进程（leader）中运行时，从数据库读取最新游标，本进程内存中的游标不会前进"""
+    if background_services.started and not background_services.is_leader:
+        connection_monitor.load_cursors()
+
 @app.route('/api/connections/recent', methods=['GET'])
 @require_auth
 def get_recent_connections():
     """获取最近的连接记录"""
     try:
-        # 更新连接数据
-        connection_monitor.update_connections()
-        
+        # 日志由后台采集线程写入，这里只查询数据库
         limit = min(int(request.args.get('limit', 100)), 500)
-        connections = connection_monitor.get_recent_connections(limit)
+        connections, next_token = connection_monitor.get_recent_connections(
+            limit,
+            after=request.args.get('after'),
+            ip=request.args.get('ip'),
+            status=request.args.get('status'),
+            start=parse_utc_time(request.args.get('start')),
+            end=parse_utc_time(request.args.get('end'))
+        )
         
         # 调试信息：返回日志解析状态
+        refresh_ingestion_cursors()
         debug_info = {
             'log_file_exists': connection_monitor.log_path.exists(),
             'log_file_size': connection_monitor.log_path.stat().st_size if connection_monitor.log_path.exists() else 0,
-            'last_position': connection_monitor.last_position
+            'cursors': connection_monitor.cursors,
+            'ingestion': ingestion_worker.status()
         }
         
         return jsonify({
             'success': True,
             'data': connections,
+            'next': next_token,
             'debug': debug_info,
             'total_connections': len(connections)
         })
-        
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"Error getting recent connections: {e}")
         import traceback
@@ -1137,13 +4732,25 @@ def get_blocked_ips():
     """获取被拒绝的IP统计"""
     try:
         limit = min(int(request.args.get('limit', 50)), 200)
-        blocked_ips = connection_monitor.get_blocked_ips(limit)
+        blocked_ips, next_token = connection_monitor.get_blocked_ips(
+            limit,
+            after=request.args.get('after'),
+            ip=request.args.get('ip'),
+            start=parse_utc_time(request.args.get('start')),
+            end=parse_utc_time(request.args.get('end'))
+        )
         
         return jsonify({
             'success': True,
-            'data': blocked_ips
+            'data': blocked_ips,
+            'next': next_token
         })
-        
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"Error getting blocked IPs: {e}")
         return jsonify({
@@ -1156,9 +4763,6 @@ def get_blocked_ips():
 def get_connection_stats():
     """获取连接统计信息"""
     try:
-        # 更新连接数据
-        connection_monitor.update_connections()
-        
         stats = connection_monitor.get_connection_stats()
         
         return jsonify({
@@ -1173,6 +4777,112 @@ def get_connection_stats():
             'message': 'Failed to get connection stats'
         }), 500
 
+@app.route('/api/connections/timeseries', methods=['GET'])
+@require_auth
+def get_connection_timeseries():
+    """获取任意时间段的连接趋势"""
+    try:
+        start = parse_utc_time(request.args.get('start'))
+        end = parse_utc_time(request.args.get('end'))
+        interval = request.args.get('interval') or None
+        data = connection_monitor.get_connection_timeseries(start, end, interval)
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error getting connection timeseries: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to get connection timeseries'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'data': data
+    })
+
+STREAM_TICKET_PURPOSE = 'connections-stream'
+
+@app.route('/api/connections/stream/ticket', methods=['POST'])
+@require_auth
+def create_stream_ticket():
+    """签发实时事件流的短期票据（EventSource 无法设置请求头，URL 中只传递票据，不传递登录 token）"""
+    ttl = app.config['SSE_TICKET_TTL']
+    return jsonify({
+        'success': True,
+        'ticket': auth_manager.generate_ticket(g.current_user, STREAM_TICKET_PURPOSE, ttl),
+        'expires_in': ttl
+    })
+
+@app.route('/api/connections/stream', methods=['GET'])
+def stream_connections():
+    """连接监控实时事件流（SSE）
+    
+    浏览器通过 ?ticket= 传递 /api/connections/stream/ticket 签发的票据，其他客户端也可以使用 Authorization 头。
+    """
+    ticket = request.args.get('ticket')
+    auth_header = request.headers.get('Authorization', '')
+    if ticket:
+        payload = auth_manager.verify_ticket(ticket, STREAM_TICKET_PURPOSE)
+        expires_at = payload.get('token_exp') if payload else None
+    elif auth_header.startswith('Bearer '):
+        payload = auth_manager.verify_token(auth_header[7:])
+        expires_at = payload.get('exp') if payload else None
+    else:
+        payload = None
+    if not payload:
+        return jsonify({'success': False, 'message': 'Stream ticket is invalid or expired'}), 401
+    
+    subscriber = event_broadcaster.subscribe()
+    if subscriber is None:
+        return jsonify({'success': False, 'message': 'Too many stream clients'}), 503
+    
+    heartbeat = app.config['SSE_HEARTBEAT_INTERVAL']
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                if expires_at and time.time() >= expires_at:
+                    # 登录 token 过期后结束事件流，客户端需要重新登录
+                    yield 'event: expired\ndata: {}\n\n'
+                    return
+                
+                items, dropped = subscriber.pop_all(heartbeat)
+                if dropped:
+                    # 有事件被丢弃时剩余的增量已不完整，通知客户端重新加载
+                    yield f'event: reset\ndata: {{"dropped": {dropped}}}\n\n'
+                    continue
+                if not items:
+                    yield ': keep-alive\n\n'
+                    continue
+                for event_id, event, data in items:
+                    yield f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+        finally:
+            event_broadcaster.unsubscribe(subscriber)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/connections/ingestion', methods=['GET'])
+@require_auth
+def get_ingestion_status():
+    """获取日志采集状态和延迟"""
+    refresh_ingestion_cursors()
+    data = ingestion_worker.status()
+    data['stream'] = event_broadcaster.status()
+    data['process'] = background_services.status()
+    data['geoip'] = connection_monitor.geoip.status()
+    return jsonify({
+        'success': True,
+        'data': data
+    })
+
 @app.route('/api/connections/logs', methods=['DELETE'])
 @require_auth
 def clear_connection_logs():
@@ -1220,41 +4930,22 @@ def test_log_parsing():
             })
         
         lines = result.stdout.strip().split('\n')
+        parser = StreamLogParser()
         parsed_lines = []
         
         for line in lines:
             if not line.strip():
                 continue
-                
-            # 使用相同的解析逻辑
-            try:
-                match = re.match(
-                    r'([0-9a-fA-F.:]+|\d+\.\d+\.\d+\.\d+|\[?[0-9a-fA-F:]+\]?|proxy_protocol_addr) \[([^\]]+)\] (\w+) (\d+) (\d+) (\d+) ([\d.]+) whitelist:([01])(?:\s+upstream:([^\s]+))?',
-                    line.strip()
-                )
-                
-                if match:
-                    parsed_lines.append({
-                        'raw_line': line,
-                        'parsed': True,
-                        'ip': match.group(1),
-                        'timestamp': match.group(2),
-                        'protocol': match.group(3),
-                        'status': match.group(4),
-                        'whitelist_status': match.group(8)
-                    })
-                else:
-                    parsed_lines.append({
-                        'raw_line': line,
-                        'parsed': False,
-                        'reason': 'Regex pattern did not match'
-                    })
-                    
-            except Exception as parse_error:
+            
+            # 使用与采集线程相同的解析器
+            connection = parser.parse_line(line)
+            if connection:
+                parsed_lines.append(dict(connection, raw_line=line, parsed=True))
+            else:
                 parsed_lines.append({
                     'raw_line': line,
                     'parsed': False,
-                    'reason': str(parse_error)
+                    'reason': 'Unrecognized log format'
                 })
         
         return jsonify({
@@ -1262,7 +4953,7 @@ def test_log_parsing():
             'log_path': str(connection_monitor.log_path),
             'file_exists': True,
             'file_size': connection_monitor.log_path.stat().st_size,
-            'last_position': connection_monitor.last_position,
+            'cursors': connection_monitor.cursors,
             'total_lines_tested': len(lines),
             'parsed_successfully': len([l for l in parsed_lines if l.get('parsed')]),
             'sample_lines': parsed_lines
@@ -1283,6 +4974,16 @@ def not_found(error):
         'message': 'API endpoint not found'
     }), 404
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 指标（nginx 不转发；API 端口对外可达，只允许 METRICS_ALLOW 中的地址或 METRICS_TOKEN）"""
+    if not metrics_access_allowed():
+        return jsonify({
+            'success': False,
+            'message': 'Metrics access denied'
+        }), 403
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
@@ -1300,6 +5001,7 @@ def internal_error(error):
     }), 500
 
 if __name__ == '__main__':
+    create_app()
     logger.info("Starting MTProxy Whitelist API server")
     port = int(os.environ.get('API_PORT', 8080))
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=False)
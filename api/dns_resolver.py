@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+主机名白名单条目的 DNS 解析
+DNSResolver 直接向 DNS 服务器发送 A/AAAA 查询并读取记录的 TTL（标准库的 getaddrinfo 不提供 TTL）；
+SystemResolver 使用系统解析（getaddrinfo），TTL 为固定值。两者接口相同：resolve(hostname) -> (地址列表, TTL)，
+可以替换为任何提供该方法的对象（例如指向本地替身 DNS 服务器的 DNSResolver）。
+"""
+
+import re
+import random
+import socket
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_CNAME = 5
+TYPE_AAAA = 28
+CLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+LABEL_RE = re.compile(r'^(?!-)[a-z0-9-]{1,63}(?<!-)$')
+
+
+class DNSError(Exception):
+    """解析失败（超时、服务器错误等），与"域名不存在"不同，调用方应保留上一次的结果"""
+
+
+def normalize_hostname(value):
+    """校验并规范化主机名（小写、去掉末尾的点、国际化域名转换为 punycode），格式错误时抛出 ValueError"""
+    name = str(value or '').strip().rstrip('.').lower()
+    try:
+        name = name.encode('idna').decode('ascii')
+    except UnicodeError:
+        raise ValueError(f"Invalid hostname: {value!r}")
+    labels = name.split('.')
+    if len(name) > 253 or len(labels) < 2 or not all(LABEL_RE.match(label) for label in labels):
+        raise ValueError(f"Invalid hostname: {value!r}")
+    # 顶级域不能全为数字，避免把写错的IP地址当作主机名
+    if labels[-1].isdigit():
+        raise ValueError(f"Invalid hostname: {value!r}")
+    return name
+
+
+def build_query(hostname, qtype, query_id):
+    """构造查询报文（递归查询，一个问题）"""
+    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    question = b''.join(bytes([len(label)]) + label.encode('ascii') for label in hostname.split('.'))
+    return header + question + b'\x00' + struct.pack('!HH', qtype, CLASS_IN)
+
+
+def _skip_name(data, offset):
+    """跳过报文中的域名（支持压缩指针），返回之后的偏移"""
+    while True:
+        if offset >= len(data):
+            raise DNSError('truncated name in DNS response')
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def parse_response(data, query_id):
+    """解析响应报文，返回 (rcode, 是否被截断, 回答记录 [(类型, TTL, 数据)], 否定应答 TTL)"""
+    if len(data) < 12:
+        raise DNSError('short DNS response')
+    response_id, flags, qdcount, ancount, nscount, _ = struct.unpack('!HHHHHH', data[:12])
+    if response_id != query_id or not flags & 0x8000:
+        raise DNSError('unexpected DNS response')
+    rcode = flags & 0x000F
+    truncated = bool(flags & 0x0200)
+    
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+    
+    answers = []
+    negative_ttl = None
+    for index in range(ancount + nscount):
+        offset = _skip_name(data, offset)
+        if offset + 10 > len(data):
+            raise DNSError('truncated DNS record')
+        rtype, rclass, ttl, length = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        rdata = data[offset:offset + length]
+        offset += length
+        if index < ancount:
+            if rclass == CLASS_IN and rtype in (TYPE_A, TYPE_AAAA, TYPE_CNAME):
+                answers.append((rtype, ttl, rdata))
+        elif rtype == TYPE_SOA and length >= 20:
+            # 否定应答的缓存时间为 SOA 记录 TTL 和 MINIMUM 字段中较小的一个
+            negative_ttl = min(ttl, struct.unpack('!I', rdata[-4:])[0])
+    return rcode, truncated, answers, negative_ttl
+
+
+class DNSResolver:
+    """向指定的 DNS 服务器查询 A/AAAA 记录（UDP，响应被截断时改用 TCP）"""
+    
+    def __init__(self, nameservers, timeout=2.0, attempts=2):
+        if not nameservers:
+            raise ValueError('at least one nameserver is required')
+        self.nameservers = [parse_nameserver(ns) if isinstance(ns, str) else ns for ns in nameservers]
+        self.timeout = timeout
+        self.attempts = attempts
+    
+    def __repr__(self):
+        return f"DNSResolver({', '.join(f'{host}:{port}' for host, port in self.nameservers)})"
+    
+    def _exchange_udp(self, server, query):
+        family = socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(server)
+            sock.send(query)
+            return sock.recv(65535)
+    
+    def _exchange_tcp(self, server, query):
+        with socket.create_connection(server, timeout=self.timeout) as sock:
+            sock.sendall(struct.pack('!H', len(query)) + query)
+            data = b''
+            while len(data) < 2 or len(data) < 2 + struct.unpack('!H', data[:2])[0]:
+                chunk = sock.recv(65535)
+                if not chunk:
+                    raise DNSError('connection closed by DNS server')
+                data += chunk
+            return data[2:2 + struct.unpack('!H', data[:2])[0]]
+    
+    def query(self, hostname, qtype):
+        """查询一种记录，返回 (地址列表, TTL)；域名不存在或没有该类记录时地址列表为空"""
+        errors = []
+        for _ in range(self.attempts):
+            for server in self.nameservers:
+                query_id = random.getrandbits(16)
+                query = build_query(hostname, qtype, query_id)
+                try:
+                    rcode, truncated, answers, negative_ttl = parse_response(
+                        self._exchange_udp(server, query), query_id)
+                    if truncated:
+                        rcode, _, answers, negative_ttl = parse_response(
+                            self._exchange_tcp(server, query), query_id)
+                except (OSError, DNSError) as e:
+                    errors.append(f'{server[0]}:{server[1]}: {e}')
+                    continue
+                
+                if rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                    # SERVFAIL、REFUSED 等：换下一个服务器
+                    errors.append(f'{server[0]}:{server[1]}: rcode {rcode}')
+                    continue
+                
+                family = socket.AF_INET if qtype == TYPE_A else socket.AF_INET6
+                size = 4 if qtype == TYPE_A else 16
+                addresses = [socket.inet_ntop(family, rdata) for rtype, _, rdata in answers
+                             if rtype == qtype and len(rdata) == size]
+                # CNAME 链上各记录的 TTL 也会限制结果的有效期
+                ttls = [ttl for _, ttl, _ in answers]
+                ttl = min(ttls) if addresses else negative_ttl
+                return addresses, ttl
+        raise DNSError(f"{hostname}: {'; '.join(errors[-3:])}")
+    
+    def resolve(self, hostname):
+        """查询 A 和 AAAA 记录，返回 (排序后的地址列表, TTL)，TTL 未知时为 None"""
+        addresses = []
+        ttls = []
+        for qtype in (TYPE_A, TYPE_AAAA):
+            found, ttl = self.query(hostname, qtype)
+            addresses.extend(found)
+            if ttl is not None:
+                ttls.append(ttl)
+        return sorted(set(addresses)), min(ttls) if ttls else None
+
+
+class SystemResolver:
+    """系统解析（getaddrinfo），无法得到 TTL，使用固定的 ttl"""
+    
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+    
+    def __repr__(self):
+        return 'SystemResolver()'
+    
+    def resolve(self, hostname):
+        try:
+            infos = socket.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if e.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)):
+                return [], self.ttl
+            raise DNSError(f"{hostname}: {e}")
+        # IPv6 地址可能带有作用域（fe80::1%eth0），白名单中只保留地址部分
+        return sorted({info[4][0].split('%')[0] for info in infos}), self.ttl
+
+
+def parse_nameserver(value):
+    """解析 host、host:port、[IPv6]:port 格式的 DNS 服务器地址"""
+    value = value.strip()
+    if value.startswith('['):
+        host, _, port = value[1:].partition(']')
+        return host, int(port.lstrip(':') or 53)
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, 53
+
+
+def load_nameservers(path='/etc/resolv.conf'):
+    """读取系统配置的 DNS 服务器列表"""
+    nameservers = []
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    nameservers.append((parts[1].split('%')[0], 53))
+    except OSError:
+        pass
+    return nameservers
+
+
+def create_resolver(spec='', timeout=2.0):
+    """按配置创建解析器：'system' 使用 getaddrinfo，逗号分隔的地址使用指定的 DNS 服务器，
+    为空时使用 /etc/resolv.conf 中的服务器（没有时退回系统解析）"""
+    spec = (spec or '').strip()
+    if spec == 'system':
+        return SystemResolver()
+    if spec:
+        return DNSResolver([parse_nameserver(ns) for ns in spec.split(',') if ns.strip()], timeout=timeout)
+    nameservers = load_nameservers()
+    if nameservers:
+        return DNSResolver(nameservers, timeout=timeout)
+    logger.warning("No nameserver found in /etc/resolv.conf, using system resolver without TTLs")
+    return SystemResolver()
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内置白名单网关（asyncio TCP 转发）
+
+可替代 nginx stream 承担 NGINX_STREAM_PORT / PROXY_PROTOCOL_PORT 的角色：
+解析 PROXY protocol v1/v2 头，用 PrefixIndex 检查客户端地址，放行的连接转发到 MTProxy 上游。
+白名单直接从数据库加载，白名单版本号变化时重建索引，修改即时生效，不需要重载。
+每个 CPU 核心一个进程、每个进程一个事件循环，通过 SO_REUSEPORT 共享监听端口。
+连接日志使用 proxy_enhanced 格式（与 docker/nginx.conf.template 相同），由 ConnectionMonitor 采集。
+
+用法:
+    python3 gate.py --listen 0.0.0.0:14202 --proxy-listen 0.0.0.0:445 --upstream 127.0.0.1:444
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import logging
+import os
+import re
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import time
+from pathlib import Path
+
+from ip_index import PrefixIndex
+
+logger = logging.getLogger(__name__)
+
+# 始终放行的默认条目（与 WhitelistManager.DEFAULT_ENTRIES 相同）
+DEFAULT_ENTRIES = ('127.0.0.1', '::1')
+
+PROXY_V2_SIGNATURE = b'\r\n\r\n\x00\r\nQUIT\n'
+PROXY_V1_MAX_LENGTH = 107
+
+# 与 nginx 配置中 $is_valid_public_ip 的判断一致
+PRIVATE_IP_RE = re.compile(r'^(127\.|10\.|172\.(1[6-9]|2[0-9]|3[01])\.|192\.168\.|169\.254\.|224\.)')
+
+
+class ProxyProtocolError(ValueError):
+    """PROXY protocol 头格式错误"""
+
+
+def parse_proxy_header(data):
+    """解析 PROXY protocol v1/v2 头
+    
+    返回 (头长度, 客户端地址)，客户端地址为 None 表示 LOCAL/UNKNOWN 连接（使用 TCP 对端地址）；
+    数据不完整时返回 None，格式错误时抛出 ProxyProtocolError。
+    """
+    if data[:1] == b'\r':
+        if len(data) < 16:
+            if not PROXY_V2_SIGNATURE.startswith(bytes(data[:12])):
+                raise ProxyProtocolError('invalid PROXY protocol v2 signature')
+            return None
+        if data[:12] != PROXY_V2_SIGNATURE:
+            raise ProxyProtocolError('invalid PROXY protocol v2 signature')
+        version_command, family, length = struct.unpack('!BBH', data[12:16])
+        if version_command >> 4 != 2:
+            raise ProxyProtocolError(f'unsupported PROXY protocol version {version_command >> 4}')
+        total = 16 + length
+        if len(data) < total:
+            return None
+        if version_command & 0x0F == 0:
+            return total, None  # LOCAL：健康检查等由代理自身发起的连接
+        if family == 0x11 and length >= 12:
+            return total, socket.inet_ntop(socket.AF_INET, bytes(data[16:20]))
+        if family == 0x21 and length >= 36:
+            return total, socket.inet_ntop(socket.AF_INET6, bytes(data[16:32]))
+        return total, None
+    
+    if data[:6] == b'PROXY '[:len(data[:6])]:
+        end = bytes(data[:PROXY_V1_MAX_LENGTH]).find(b'\r\n')
+        if end < 0:
+            if len(data) >= PROXY_V1_MAX_LENGTH:
+                raise ProxyProtocolError('PROXY protocol v1 header too long')
+            return None
+        parts = bytes(data[:end]).decode('ascii', 'replace').split(' ')
+        if len(parts) >= 2 and parts[1] == 'UNKNOWN':
+            return end + 2, None
+        if len(parts) != 6 or parts[1] not in ('TCP4', 'TCP6'):
+            raise ProxyProtocolError('invalid PROXY protocol v1 header')
+        try:
+            ipaddress.ip_address(parts[2])
+        except ValueError:
+            raise ProxyProtocolError(f'invalid PROXY protocol v1 source address {parts[2]!r}')
+        return end + 2, parts[2]
+    
+    raise ProxyProtocolError('missing PROXY protocol header')
+
+
+class WhitelistSource:
+    """从数据库加载白名单索引，白名单版本号变化时重建"""
+    
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.index = PrefixIndex.build((ip, None) for ip in DEFAULT_ENTRIES)
+        self.version = None
+        self.loaded_at = None
+    
+    def _connect(self):
+        conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=5)
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+    
+    def refresh(self):
+        """版本号变化时重建索引，返回是否重建"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'whitelist_version'").fetchone()
+            version = int(row[0]) if row else 0
+            if version == self.version:
+                return False
+            # 主机名条目使用管理服务后台解析保存的地址；管理服务尚未完成数据库迁移时没有该表
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'hostname_resolutions'").fetchone():
+                rows = conn.execute('''
+                    SELECT w.ip, w.id, w.ip_type, r.addresses FROM whitelist w
+                    LEFT JOIN hostname_resolutions r ON r.entry_id = w.id
+                    WHERE w.is_active = 1
+                ''').fetchall()
+            else:
+                rows = conn.execute('SELECT ip, id, NULL, NULL FROM whitelist WHERE is_active = 1').fetchall()
+        finally:
+            conn.close()
+        
+        index = PrefixIndex.build((ip, None) for ip in DEFAULT_ENTRIES)
+        for ip, entry_id, ip_type, addresses in rows:
+            keys = (addresses.split(',') if addresses else []) if ip_type == 'hostname' else [ip]
+            for key in keys:
+                try:
+                    index.add(key, entry_id)
+                except ValueError:
+                    logger.warning(f"Gate skipped invalid whitelist entry: {key!r}")
+        # 整体替换索引，正在处理的连接继续使用旧索引
+        self.index = index
+        self.version = version
+        self.loaded_at = time.time()
+        logger.info(f"Gate whitelist loaded: {len(self.index)} entries (version {version})")
+        return True
+    
+    def is_allowed(self, ip):
+        try:
+            return self.index.lookup(ip) is not None
+        except ValueError:
+            return False
+
+
+class AccessLog:
+    """proxy_enhanced 格式的连接日志
+    
+    各进程以 O_APPEND 方式写同一个文件，日志行先缓冲，按 flush_interval 或缓冲大小批量写入
+    （每次写入都是完整的行，采集时不会读到半行）。文件被轮转后重新打开。
+    """
+    
+    MAX_BUFFER = 64 * 1024
+    
+    def __init__(self, path, flush_interval=0.5):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self._lines = []
+        self._size = 0
+        self._fd = None
+        self._inode = None
+        self._time_key = None
+        self._time_str = None
+    
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+    
+    def time_local(self, now):
+        """$time_local（同一秒内复用）"""
+        key = int(now)
+        if key != self._time_key:
+            self._time_key = key
+            self._time_str = time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(key))
+        return self._time_str
+    
+    def write(self, remote, proxy_addr, client, allowed, status, sent, received, session_time, upstream):
+        public = PRIVATE_IP_RE.match(client) is None
+        line = (f"{remote}|proxy:{proxy_addr or '-'}|final:{client}|public:{int(public)}"
+                f"|warn:{'' if public else 'WARNING_PRIVATE_IP'} [{self.time_local(time.time())}] "
+                f"TCP {status} {sent} {received} {session_time:.3f} "
+                f"whitelist:{int(allowed)} upstream:{upstream or '-'}\n")
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= self.MAX_BUFFER:
+            self.flush()
+    
+    def flush(self):
+        if not self._lines:
+            return
+        data = ''.join(self._lines).encode('utf-8')
+        self._lines = []
+        self._size = 0
+        try:
+            if self._fd is None:
+                self._open()
+            else:
+                try:
+                    if os.stat(self.path).st_ino != self._inode:
+                        os.close(self._fd)
+                        self._open()
+                except FileNotFoundError:
+                    os.close(self._fd)
+                    self._open()
+            os.write(self._fd, data)
+        except OSError as e:
+            logger.error(f"Gate access log write failed: {e}")
+    
+    def close(self):
+        self.flush()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Session:
+    """一个客户端连接：客户端和上游两个方向的 BufferedProtocol 共用的状态"""
+    
+    __slots__ = ('gate', 'proxy_protocol', 'client', 'upstream', 'remote', 'proxy_addr', 'client_ip',
+                 'allowed', 'status', 'started', 'last_active', 'sent', 'received', 'pending', 'closed',
+                 'upstream_addr')
+    
+    def __init__(self, gate, proxy_protocol):
+        self.gate = gate
+        self.proxy_protocol = proxy_protocol
+        self.client = None
+        self.upstream = None
+        self.remote = '-'
+        self.proxy_addr = None
+        self.client_ip = '-'
+        self.allowed = False
+        self.status = 200
+        self.started = self.last_active = time.monotonic()
+        self.sent = 0       # 发送给客户端的字节数（$bytes_sent）
+        self.received = 0   # 从客户端收到的字节数（$bytes_received）
+        self.pending = bytearray()  # 判定前或上游连接建立前收到的数据
+        self.closed = False
+        self.upstream_addr = None
+    
+    def decide(self):
+        """取得客户端地址后判定白名单，放行时连接上游"""
+        self.allowed = self.gate.whitelist.is_allowed(self.client_ip)
+        if not self.allowed:
+            self.close(403)
+            return
+        self.client.pause_reading()
+        asyncio.get_running_loop().create_task(self.connect_upstream())
+    
+    async def connect_upstream(self):
+        loop = asyncio.get_running_loop()
+        host, port = self.gate.upstream
+        try:
+            transport, _ = await asyncio.wait_for(
+                loop.create_connection(lambda: UpstreamProtocol(self), host, port),
+                self.gate.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"Gate upstream connect failed: {e}")
+            self.close(502)
+            return
+        if self.closed:
+            transport.close()
+            return
+        self.upstream_addr = f'{host}:{port}'
+        if self.pending:
+            self.upstream.write(self.pending)
+            self.pending = bytearray()
+        self.client.resume_reading()
+    
+    def close(self, status=None):
+        if self.closed:
+            return
+        self.closed = True
+        if status is not None:
+            self.status = status
+        # close() 会先发送完缓冲区中的数据
+        if self.client is not None:
+            self.client.close()
+        if self.upstream is not None:
+            self.upstream.close()
+        self.gate.finish(self)
+
+
+class ClientProtocol(asyncio.BufferedProtocol):
+    """客户端一侧：解析 PROXY protocol 头、判定白名单，然后把数据写给上游"""
+    
+    def __init__(self, gate, proxy_protocol):
+        self.session = Session(gate, proxy_protocol)
+        self.buffer = bytearray(gate.buffer_size)
+        self.view = memoryview(self.buffer)
+    
+    def connection_made(self, transport):
+        session = self.session
+        session.client = transport
+        peer = transport.get_extra_info('peername')
+        session.remote = peer[0] if peer else '-'
+        session.gate.start(session)
+        if not session.proxy_protocol:
+            session.client_ip = session.remote
+            session.decide()
+    
+    def get_buffer(self, sizehint):
+        return self.view
+    
+    def buffer_updated(self, nbytes):
+        session = self.session
+        session.received += nbytes
+        session.last_active = time.monotonic()
+        upstream = session.upstream
+        if upstream is not None:
+            upstream.write(self.view[:nbytes])
+            if upstream.get_write_buffer_size():
+                # 未能立即发送的数据可能仍引用当前缓冲区，改用新的缓冲区接收
+                self.buffer = bytearray(len(self.buffer))
+                self.view = memoryview(self.buffer)
+            return
+        
+        session.pending += self.view[:nbytes]
+        if session.proxy_protocol and session.client_ip == '-':
+            try:
+                result = parse_proxy_header(session.pending)
+            except ProxyProtocolError as e:
+                logger.debug(f"Gate rejected {session.remote}: {e}")
+                session.client_ip = session.remote
+                session.close(400)
+                return
+            if result is None:
+                return
+            length, address = result
+            del session.pending[:length]
+            session.received -= length
+            session.proxy_addr = address
+            session.client_ip = address or session.remote
+            session.decide()
+    
+    def pause_writing(self):
+        if self.session.upstream is not None:
+            self.session.upstream.pause_reading()
+    
+    def resume_writing(self):
+        if self.session.upstream is not None:
+            self.session.upstream.resume_reading()
+    
+    def eof_received(self):
+        self.session.close()
+    
+    def connection_lost(self, exc):
+        self.session.close()
+
+
+class UpstreamProtocol(asyncio.BufferedProtocol):
+    """上游一侧：把数据写回客户端"""
+    
+    def __init__(self, session):
+        self.session = session
+        self.buffer = bytearray(session.gate.buffer_size)
+        self.view = memoryview(self.buffer)
+    
+    def connection_made(self, transport):
+        self.session.upstream = transport
+    
+    def get_buffer(self, sizehint):
+        return self.view
+    
+    def buffer_updated(self, nbytes):
+        session = self.session
+        session.sent += nbytes
+        session.last_active = time.monotonic()
+        client = session.client
+        client.write(self.view[:nbytes])
+        if client.get_write_buffer_size():
+            self.buffer = bytearray(len(self.buffer))
+            self.view = memoryview(self.buffer)
+    
+    def pause_writing(self):
+        self.session.client.pause_reading()
+    
+    def resume_writing(self):
+        self.session.client.resume_reading()
+    
+    def eof_received(self):
+        self.session.close()
+    
+    def connection_lost(self, exc):
+        self.session.close()
+
+
+class Gate:
+    """单个事件循环中的网关：监听、会话超时检查、白名单刷新和日志写入"""
+    
+    def __init__(self, whitelist, access_log, upstream, timeout=10.0, connect_timeout=3.0,
+                 refresh_interval=1.0, buffer_size=65536):
+        self.whitelist = whitelist
+        self.access_log = access_log
+        self.upstream = upstream
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.refresh_interval = refresh_interval
+        self.buffer_size = buffer_size
+        self.sessions = set()
+        self.accepted = 0
+        self.servers = []
+    
+    def start(self, session):
+        self.accepted += 1
+        self.sessions.add(session)
+    
+    def finish(self, session):
+        self.sessions.discard(session)
+        self.access_log.write(
+            session.remote, session.proxy_addr, session.client_ip, session.allowed, session.status,
+            session.sent, session.received, time.monotonic() - session.started, session.upstream_addr
+        )
+    
+    async def listen(self, host, port, proxy_protocol=False, reuse_port=True):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(
+            lambda: ClientProtocol(self, proxy_protocol), host, port,
+            reuse_port=reuse_port, backlog=1024
+        )
+        self.servers.append(server)
+        return server
+    
+    async def maintain(self):
+        """定期检查空闲超时、刷新白名单和写入日志"""
+        loop = asyncio.get_running_loop()
+        last_refresh = 0.0
+        while True:
+            await asyncio.sleep(min(self.refresh_interval, self.access_log.flush_interval, 1.0))
+            now = time.monotonic()
+            if now - last_refresh >= self.refresh_interval:
+                last_refresh = now
+                try:
+                    # 重建大索引需要时间，放到线程中执行，不阻塞转发
+                    await loop.run_in_executor(None, self.whitelist.refresh)
+                except sqlite3.Error as e:
+                    logger.warning(f"Gate whitelist refresh failed: {e}")
+            # 与 nginx 的 proxy_timeout 相同：两次读写之间的最长间隔
+            for session in [s for s in self.sessions if now - s.last_active > self.timeout]:
+                session.close()
+            self.access_log.flush()
+
+
+def parse_listen(value):
+    host, _, port = value.rpartition(':')
+    return host.strip('[]') or '0.0.0.0', int(port)
+
+
+async def serve(args):
+    whitelist = WhitelistSource(args.db)
+    try:
+        whitelist.refresh()
+    except sqlite3.Error as e:
+        # 数据库尚未初始化时只放行默认条目，之后由 maintain() 继续重试
+        logger.warning(f"Gate whitelist load failed: {e}")
+    access_log = AccessLog(args.access_log)
+    gate = Gate(whitelist, access_log, parse_listen(args.upstream), timeout=args.timeout,
+                connect_timeout=args.connect_timeout, refresh_interval=args.refresh_interval,
+                buffer_size=args.buffer_size)
+    for address in args.listen:
+        await gate.listen(*parse_listen(address))
+    for address in args.proxy_listen:
+        await gate.listen(*parse_listen(address), proxy_protocol=True)
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    maintenance = loop.create_task(gate.maintain())
+    await stop.wait()
+    
+    maintenance.cancel()
+    for server in gate.servers:
+        server.close()
+    for session in list(gate.sessions):
+        session.close()
+    access_log.close()
+
+
+def run_worker(args):
+    try:
+        asyncio.run(serve(args))
+    except Exception as e:
+        logger.error(f"Gate worker {os.getpid()} failed: {e}")
+        os._exit(1)
+    os._exit(0)
+
+
+def main():
+    data_dir = Path(os.environ.get('DATA_DIR', '/data'))
+    parser = argparse.ArgumentParser(description='asyncio whitelist gate for the MTProxy stream port')
+    parser.add_argument('--listen', action='append', default=[], help='直接接收客户端连接的地址，可重复指定')
+    parser.add_argument('--proxy-listen', action='append', default=[],
+                        help='接收带 PROXY protocol 头的连接的地址，可重复指定')
+    parser.add_argument('--upstream', default=os.environ.get('GATE_UPSTREAM', '127.0.0.1:444'))
+    parser.add_argument('--db', default=str(data_dir / 'webapp' / 'users.db'))
+    parser.add_argument('--access-log', default=os.environ.get('GATE_ACCESS_LOG', '/var/log/nginx/gate_access.log'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('GATE_WORKERS', '0')),
+                        help='进程数，0 表示 CPU 核心数')
+    parser.add_argument('--timeout', type=float, default=float(os.environ.get('GATE_TIMEOUT', '10')))
+    parser.add_argument('--connect-timeout', type=float, default=3.0)
+    parser.add_argument('--refresh-interval', type=float,
+                        default=float(os.environ.get('GATE_REFRESH_INTERVAL', '1.0')))
+    parser.add_argument('--buffer-size', type=int, default=65536)
+    args = parser.parse_args()
+    if not args.listen and not args.proxy_listen:
+        parser.error('at least one --listen or --proxy-listen address is required')
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    workers = args.workers or os.cpu_count() or 1
+    children = set()
+    
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            run_worker(args)
+        children.add(pid)
+    
+    stopping = False
+    
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for _ in range(workers):
+        spawn()
+    logger.info(f"Gate started {workers} workers, listen={args.listen} proxy_listen={args.proxy_listen} "
+                f"upstream={args.upstream}")
+    
+    # 工作进程异常退出时重新启动
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Gate worker {pid} exited with status {status}, restarting")
+            time.sleep(1)
+            spawn()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线 IP 归属查询（国家 / ASN / 地址类别）
+支持 MaxMind DB（.mmdb，GeoLite2-Country/City/ASN 等）和 CSV 网段库，不发起任何网络请求。
+"""
+
+import csv
+import mmap
+import struct
+import threading
+import ipaddress
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+
+
+def classify(ip_obj):
+    """按 ipaddress 的地址属性分类：loopback / private / link_local / multicast / reserved / public"""
+    mapped = getattr(ip_obj, 'ipv4_mapped', None)
+    if mapped is not None:
+        ip_obj = mapped
+    if ip_obj.is_loopback:
+        return 'loopback'
+    if ip_obj.is_link_local:
+        return 'link_local'
+    if ip_obj.is_multicast:
+        return 'multicast'
+    if ip_obj.is_private:
+        return 'private'
+    if ip_obj.is_unspecified or ip_obj.is_reserved or not ip_obj.is_global:
+        # 100.64.0.0/10（运营商级NAT）等既非私有也非公网的地址
+        return 'reserved'
+    return 'public'
+
+
+class MMDBReader:
+    """MaxMind DB 格式读取器
+    
+    文件通过 mmap 映射，查询时沿二叉搜索树逐位查找（IPv4 最多 32 步，IPv6 最多 128 步），
+    只解码命中的数据记录，不把整个库加载到内存。
+    """
+    
+    METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+    DATA_SECTION_SEPARATOR = 16
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        marker = self._buffer.rfind(self.METADATA_MARKER, max(0, len(self._buffer) - 128 * 1024))
+        if marker < 0:
+            raise ValueError(f"{self.path} is not a MaxMind DB file")
+        self.metadata, _ = self._decode(marker + len(self.METADATA_MARKER), 0)
+        
+        self.node_count = self.metadata['node_count']
+        self.record_size = self.metadata['record_size']
+        if self.record_size not in (24, 28, 32):
+            raise ValueError(f"Unsupported MMDB record size {self.record_size}")
+        self.ip_version = self.metadata['ip_version']
+        self.database_type = self.metadata.get('database_type', '')
+        self._node_bytes = self.record_size // 4
+        self._search_tree_size = self.node_count * self._node_bytes
+        self._data_start = self._search_tree_size + self.DATA_SECTION_SEPARATOR
+        self._ipv4_start = None
+    
+    def close(self):
+        self._buffer.close()
+    
+    def _read_node(self, node, bit):
+        offset = node * self._node_bytes
+        buf = self._buffer
+        if self.record_size == 24:
+            offset += bit * 3
+            return int.from_bytes(buf[offset:offset + 3], 'big')
+        if self.record_size == 28:
+            if bit == 0:
+                return ((buf[offset + 3] & 0xF0) << 20) | int.from_bytes(buf[offset:offset + 3], 'big')
+            return ((buf[offset + 3] & 0x0F) << 24) | int.from_bytes(buf[offset + 4:offset + 7], 'big')
+        offset += bit * 4
+        return int.from_bytes(buf[offset:offset + 4], 'big')
+    
+    def _ipv4_start_node(self):
+        """IPv6 库中 IPv4 地址（::/96）的起始节点"""
+        if self._ipv4_start is None:
+            node = 0
+            if self.ip_version == 6:
+                for _ in range(96):
+                    if node >= self.node_count:
+                        break
+                    node = self._read_node(node, 0)
+            self._ipv4_start = node
+        return self._ipv4_start
+    
+    def lookup(self, ip_obj):
+        """返回地址对应的数据记录（通常为字典），未收录时返回 None"""
+        if ip_obj.version == 6 and self.ip_version == 4:
+            return None
+        
+        if ip_obj.version == 4:
+            node = self._ipv4_start_node()
+            bit_count = 32
+        else:
+            node = 0
+            bit_count = 128
+        
+        value = int(ip_obj)
+        for i in range(bit_count - 1, -1, -1):
+            if node >= self.node_count:
+                break
+            node = self._read_node(node, (value >> i) & 1)
+        
+        if node <= self.node_count:
+            # node == node_count 表示未收录
+            return None
+        
+        offset = node - self.node_count - self.DATA_SECTION_SEPARATOR
+        record, _ = self._decode(self._data_start + offset, self._data_start)
+        return record
+    
+    def _decode(self, offset, base):
+        """解码 offset 处的一个数据字段，返回 (值, 下一个字段偏移)；base 为指针的基准偏移"""
+        buf = self._buffer
+        ctrl = buf[offset]
+        offset += 1
+        type_num = ctrl >> 5
+        
+        if type_num == 1:
+            # 指针：解码目标处的值，但继续从指针之后读取
+            pointer_size = (ctrl >> 3) & 0x3
+            value = ctrl & 0x7
+            if pointer_size == 0:
+                pointer = (value << 8) | buf[offset]
+            elif pointer_size == 1:
+                pointer = ((value << 16) | int.from_bytes(buf[offset:offset + 2], 'big')) + 2048
+            elif pointer_size == 2:
+                pointer = ((value << 24) | int.from_bytes(buf[offset:offset + 3], 'big')) + 526336
+            else:
+                pointer = int.from_bytes(buf[offset:offset + 4], 'big')
+            target, _ = self._decode(base + pointer, base)
+            return target, offset + pointer_size + 1
+        
+        if type_num == 0:
+            type_num = 7 + buf[offset]
+            offset += 1
+        
+        size = ctrl & 0x1F
+        if size >= 29:
+            extra = size - 28
+            size_bytes = int.from_bytes(buf[offset:offset + extra], 'big')
+            offset += extra
+            size = (29, 285, 65821)[extra - 1] + size_bytes
+        
+        if type_num == 2:
+            return buf[offset:offset + size].decode('utf-8'), offset + size
+        if type_num == 3:
+            return struct.unpack('>d', buf[offset:offset + 8])[0], offset + 8
+        if type_num == 4:
+            return bytes(buf[offset:offset + size]), offset + size
+        if type_num in (5, 6, 9, 10):
+            return int.from_bytes(buf[offset:offset + size], 'big'), offset + size
+        if type_num == 7:
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset, base)
+                result[key], offset = self._decode(offset, base)
+            return result, offset
+        if type_num == 8:
+            return int.from_bytes(buf[offset:offset + size], 'big', signed=size == 4), offset + size
+        if type_num == 11:
+            result = []
+            for _ in range(size):
+                item, offset = self._decode(offset, base)
+                result.append(item)
+            return result, offset
+        if type_num == 14:
+            return bool(size), offset
+        if type_num == 15:
+            return struct.unpack('>f', buf[offset:offset + 4])[0], offset + 4
+        raise ValueError(f"Unsupported MMDB data type {type_num} at offset {offset}")
+    
+    def enrich(self, ip_obj):
+        """转换为统一字段：country / asn / as_org"""
+        record = self.lookup(ip_obj)
+        if not isinstance(record, dict):
+            return None
+        country = record.get('country') or record.get('registered_country') or {}
+        return {
+            'country': country.get('iso_code'),
+            'asn': record.get('autonomous_system_number'),
+            'as_org': record.get('autonomous_system_organization')
+        }
+
+
+class CSVRangeDatabase:
+    """CSV 网段库
+    
+    每行 "网段,国家,ASN,组织" 或 "起始IP,结束IP,国家,ASN,组织"（可有表头，缺失的列留空）。
+    加载时按起始地址排序存入数组，查询时二分查找。
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        ranges = {4: [], 6: []}
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    if '/' in row[0]:
+                        network = ipaddress.ip_network(row[0].strip(), strict=False)
+                        start, end = network.network_address, network.broadcast_address
+                        fields = row[1:]
+                    else:
+                        start = ipaddress.ip_address(row[0].strip())
+                        end = ipaddress.ip_address(row[1].strip())
+                        fields = row[2:]
+                except (ValueError, IndexError):
+                    continue  # 表头或格式错误的行
+                
+                fields = [field.strip() or None for field in fields] + [None] * 3
+                asn = fields[1]
+                if asn and asn.upper().startswith('AS'):
+                    asn = asn[2:]
+                ranges[start.version].append((int(start), int(end), {
+                    'country': fields[0],
+                    'asn': int(asn) if asn and asn.isdigit() else None,
+                    'as_org': fields[2]
+                }))
+        
+        self._starts = {}
+        self._ranges = {}
+        for version, items in ranges.items():
+            items.sort(key=lambda item: item[0])
+            self._starts[version] = [item[0] for item in items]
+            self._ranges[version] = items
+    
+    def __len__(self):
+        return sum(len(items) for items in self._ranges.values())
+    
+    def enrich(self, ip_obj):
+        starts = self._starts[ip_obj.version]
+        value = int(ip_obj)
+        index = bisect_right(starts, value) - 1
+        if index < 0:
+            return None
+        start, end, info = self._ranges[ip_obj.version][index]
+        return dict(info) if value <= end else None
+
+
+def open_database(path):
+    """按扩展名打开数据库：.mmdb 为 MaxMind DB，其他按 CSV 处理"""
+    path = Path(path)
+    if path.suffix.lower() == '.mmdb':
+        return MMDBReader(path)
+    return CSVRangeDatabase(path)
+
+
+class GeoIPResolver:
+    """IP 归属查询（带 LRU 缓存）
+    
+    databases 按顺序查询，每个字段取第一个有值的结果（例如 Country 库 + ASN 库组合使用）。
+    扫描器洪水通常集中在有限的来源IP上，缓存命中后只需一次字典查找。
+    """
+    
+    # 地址类别 -> 连接记录中显示的位置
+    CATEGORY_LABELS = {
+        'loopback': '本地',
+        'private': '内网',
+        'link_local': '内网',
+        'multicast': '保留地址',
+        'reserved': '保留地址'
+    }
+    
+    def __init__(self, databases=(), cache_size=65536):
+        self.databases = list(databases)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def lookup(self, ip_str):
+        """查询IP归属，返回 {'category', 'country', 'asn', 'as_org', 'location'}"""
+        with self._lock:
+            info = self._cache.get(ip_str)
+            if info is not None:
+                self._cache.move_to_end(ip_str)
+                self.hits += 1
+                return info
+            self.misses += 1
+        
+        info = self._resolve(ip_str)
+        with self._lock:
+            self._cache[ip_str] = info
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return info
+    
+    def _resolve(self, ip_str):
+        info = {'category': None, 'country': None, 'asn': None, 'as_org': None}
+        try:
+            ip_obj = ipaddress.ip_address(ip_str)
+        except ValueError:
+            info['location'] = '未知'
+            return info
+        
+        info['category'] = classify(ip_obj)
+        if info['category'] == 'public':
+            mapped = getattr(ip_obj, 'ipv4_mapped', None)
+            for database in self.databases:
+                result = database.enrich(mapped or ip_obj)
+                if result:
+                    for key, value in result.items():
+                        if info.get(key) is None and value is not None:
+                            info[key] = value
+                if info['country'] and info['asn']:
+                    break
+        
+        info['location'] = self.format_location(info)
+        return info
+    
+    def format_location(self, info):
+        label = self.CATEGORY_LABELS.get(info['category'])
+        if label:
+            return label
+        parts = []
+        if info['country']:
+            parts.append(info['country'])
+        if info['asn']:
+            parts.append(f"AS{info['asn']}" + (f" {info['as_org']}" if info['as_org'] else ''))
+        return ' '.join(parts) if parts else '外网'
+    
+    def status(self):
+        with self._lock:
+            return {
+                'databases': [str(getattr(db, 'path', db)) for db in self.databases],
+                'cache_size': self.cache_size,
+                'cached': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+"""
+gunicorn 配置（多 worker 部署）
+启动: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('API_PORT', '8080')}"
+workers = int(os.environ.get('API_WORKERS', '2'))
+# SSE 长连接会一直占用一个线程，线程数需大于 SSE_MAX_CLIENTS 与普通请求并发之和
+worker_class = 'gthread'
+threads = int(os.environ.get('API_THREADS', '8'))
+timeout = int(os.environ.get('API_TIMEOUT', '60'))
+graceful_timeout = 10
+keepalive = 5
+# 主进程预先导入应用模块（导入没有副作用），各 worker 共享导入结果；
+# 后台线程和数据库连接不能跨 fork 共享，由 worker 在 fork 之后调用 create_app() 创建
+preload_app = True
+
+
+def post_fork(server, worker):
+    import app
+    app.create_app()
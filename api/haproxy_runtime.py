@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HAProxy 运行时 API（stats socket）客户端和白名单映射同步
+白名单变更以 add map / del map 增量推送到 HAProxy 的 map_ip 映射，后台定期全量对账纠正偏差，
+整个过程不需要重载 HAProxy 或 nginx。
+"""
+
+import socket
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeAPIError(RuntimeError):
+    """运行时 API 返回了错误信息"""
+
+
+def parse_address(address):
+    """解析运行时 API 地址：unix:/path、/path 为 UNIX 套接字，host:port、ipv4@host:port 为 TCP"""
+    address = address.strip()
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith('/'):
+        return socket.AF_UNIX, address
+    if address.startswith(('ipv4@', 'ipv6@')):
+        address = address[5:]
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError(f"Invalid HAProxy runtime API address: {address}")
+    host = host.strip('[]') or '127.0.0.1'
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return family, (host, int(port))
+
+
+class RuntimeAPIClient:
+    """HAProxy 运行时 API 客户端
+    
+    使用非交互模式：每次连接发送一行命令（可用 ; 分隔多条），HAProxy 输出结果后关闭连接。
+    一次发送的内容（包括载荷）必须放入 HAProxy 的一个缓冲区（tune.bufsize，默认 16384 字节），
+    因此批量操作按 MAX_COMMAND_BYTES 拆分为多次连接。
+    """
+    
+    MAX_COMMAND_BYTES = 12000
+    # del map 的键不存在时的返回，对账和重复删除时属于正常情况
+    IGNORED_REPLIES = ('Key not found.',)
+    
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.family, self.target = parse_address(address)
+        self.timeout = timeout
+    
+    def execute(self, command):
+        """执行命令，返回响应文本"""
+        with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.target)
+            sock.sendall(command.encode('utf-8') + b'\n')
+            chunks = []
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        return b''.join(chunks).decode('utf-8', 'replace')
+    
+    def _check(self, reply):
+        errors = [line for line in reply.splitlines()
+                  if line.strip() and line.strip() not in self.IGNORED_REPLIES]
+        if errors:
+            raise RuntimeAPIError('; '.join(errors[:3]))
+    
+    def _batches(self, items, overhead):
+        """按 MAX_COMMAND_BYTES 分组"""
+        batch = []
+        size = overhead
+        for item in items:
+            if batch and size + len(item) + 1 > self.MAX_COMMAND_BYTES:
+                yield batch
+                batch = []
+                size = overhead
+            batch.append(item)
+            size += len(item) + 1
+        if batch:
+            yield batch
+    
+    def show_map(self, map_name):
+        """返回映射中的 (键, 值) 列表"""
+        reply = self.execute(f'show map {map_name}')
+        entries = []
+        for line in reply.splitlines():
+            if not line.strip():
+                continue
+            # 每行格式为 "<条目地址> <键> <值>"
+            parts = line.split()
+            if len(parts) < 2 or not parts[0].startswith('0x'):
+                raise RuntimeAPIError(line.strip())
+            entries.append((parts[1], parts[2] if len(parts) > 2 else ''))
+        return entries
+    
+    def add_map_entries(self, map_name, keys, value='1'):
+        """批量添加映射条目（add map 载荷，每行一个 "键 值"）"""
+        command = f'add map {map_name} <<\n'
+        count = 0
+        for batch in self._batches([f'{key} {value}' for key in keys], len(command) + 2):
+            self._check(self.execute(command + '\n'.join(batch) + '\n'))
+            count += len(batch)
+        return count
+    
+    def del_map_entries(self, map_name, keys):
+        """批量删除映射条目（多条 del map 以 ; 分隔），键不存在时忽略"""
+        count = 0
+        for batch in self._batches([f'del map {map_name} {key}' for key in keys], 1):
+            self._check(self.execute(';'.join(batch)))
+            count += len(batch)
+        return count
+
+
+class HAProxyMapSync:
+    """把白名单同步到 HAProxy 映射
+    
+    push() 在白名单变更提交后推送增量；后台线程每 interval 秒执行一次 reconcile()，
+    对比 HAProxy 中的实际条目和数据库中的白名单，补齐缺失、删除多余的条目，
+    用于纠正推送失败、其他进程并发修改或 HAProxy 重启造成的偏差。
+    对账先读取 HAProxy 映射、再读取数据库：期间提交的变更要么被对账看到，
+    要么由随后的增量推送应用，不会被对账回退。
+    load_entries 返回应有的映射键列表；save_entries 不为空时每次对账后用它保存映射文件，
+    HAProxy 重启时从该文件加载。
+    """
+    
+    def __init__(self, client, map_name, load_entries, interval=30.0, save_entries=None):
+        self.client = client
+        self.map_name = map_name
+        self.load_entries = load_entries
+        self.save_entries = save_entries
+        self.interval = interval
+        self.running = False
+        self.pushed = 0
+        self.push_failures = 0
+        self.reconcile_count = 0
+        self.reconcile_failures = 0
+        self.last_push_at = None
+        self.last_push_ms = None
+        self.last_reconcile_at = None
+        self.last_reconcile_ms = None
+        self.last_drift = {}
+        self.map_entries = None
+        self.last_error = None
+        self._push_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+    
+    def push(self, added=(), removed=()):
+        """推送增量（键列表），失败时记录错误并提前触发对账，返回是否成功"""
+        if not added and not removed:
+            return True
+        started = time.monotonic()
+        with self._push_lock:
+            try:
+                if removed:
+                    self.client.del_map_entries(self.map_name, removed)
+                if added:
+                    self.client.add_map_entries(self.map_name, added)
+            except (OSError, RuntimeAPIError) as e:
+                self.push_failures += 1
+                self.last_error = f"push: {e}"
+                logger.warning(f"HAProxy map push failed, scheduling reconcile: {e}")
+                self._wake_event.set()
+                return False
+            
+            self.pushed += len(added) + len(removed)
+            self.last_push_at = datetime.now()
+            self.last_push_ms = round((time.monotonic() - started) * 1000, 2)
+        return True
+    
+    def reconcile(self):
+        """全量对账，返回修正的条目数 {'added': n, 'removed': n}"""
+        started = time.monotonic()
+        with self._push_lock:
+            try:
+                try:
+                    current = Counter(key for key, _ in self.client.show_map(self.map_name))
+                except OSError:
+                    # HAProxy 未运行时仍保存映射文件，HAProxy 启动时直接加载
+                    if self.save_entries is not None:
+                        self.save_entries(self.load_entries())
+                    raise
+                desired = self.load_entries()
+                desired_keys = set(desired)
+                
+                missing = [key for key in desired if key not in current]
+                # 多余的条目和重复添加的条目一并删除，重复的键删除后重新添加
+                extra = [key for key, count in current.items() if key not in desired_keys or count > 1]
+                missing.extend(key for key in extra if key in desired_keys)
+                if extra:
+                    self.client.del_map_entries(self.map_name, extra)
+                if missing:
+                    self.client.add_map_entries(self.map_name, missing)
+                if self.save_entries is not None:
+                    self.save_entries(desired)
+            except Exception as e:
+                self.reconcile_failures += 1
+                self.last_error = f"reconcile: {e}"
+                raise
+            
+            drift = {'added': len(missing), 'removed': len(extra)}
+            self.reconcile_count += 1
+            self.map_entries = len(desired_keys)
+            self.last_drift = drift
+            self.last_reconcile_at = datetime.now()
+            self.last_reconcile_ms = round((time.monotonic() - started) * 1000, 2)
+            self.last_error = None
+        
+        if missing or extra:
+            logger.info(f"HAProxy map reconciled: {drift} ({self.map_entries} entries)")
+        return drift
+    
+    def start(self):
+        """启动后台对账线程（启动后立即对账一次）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='haproxy-map-sync', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _run(self):
+        self.running = True
+        try:
+            while not self._stop_event.is_set():
+                self._wake_event.clear()
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"HAProxy map reconcile failed: {e}")
+                self._wake_event.wait(self.interval)
+        finally:
+            self.running = False
+    
+    def status(self):
+        return {
+            'address': self.client.address,
+            'map': self.map_name,
+            'running': self.running,
+            'interval': self.interval,
+            'map_entries': self.map_entries,
+            'pushed': self.pushed,
+            'push_failures': self.push_failures,
+            'last_push_at': self.last_push_at.isoformat() if self.last_push_at else None,
+            'last_push_ms': self.last_push_ms,
+            'reconcile_count': self.reconcile_count,
+            'reconcile_failures': self.reconcile_failures,
+            'last_reconcile_at': self.last_reconcile_at.isoformat() if self.last_reconcile_at else None,
+            'last_reconcile_ms': self.last_reconcile_ms,
+            'last_drift': self.last_drift,
+            'last_error': self.last_error
+        }
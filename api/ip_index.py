@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+IP 白名单前缀索引
+提供 IPv4/IPv6 最长前缀匹配查询，供 API、日志处理等模块复用
+"""
+
+import socket
+import threading
+import ipaddress
+
+
+class PrefixIndex:
+    """IPv4/IPv6 最长前缀匹配索引
+    
+    按前缀长度分层存储：每个前缀长度一张哈希表，键为网络地址右移后的整数。
+    查询时从最长前缀开始逐层查表，层数等于白名单中出现过的前缀长度种类数
+    （通常只有几种），单次查询只需几次字典查找。
+    写操作加锁；读操作无锁，条目值使用不可变元组整体替换。
+    """
+    
+    BITS = {4: 32, 6: 128}
+    
+    def __init__(self):
+        # version -> {prefixlen: {network_key: ((entry_id, cidr), ...)}}
+        self._tables = {4: {}, 6: {}}
+        # version -> 降序排列的前缀长度元组
+        self._lengths = {4: (), 6: ()}
+        self._lock = threading.Lock()
+        self._size = 0
+    
+    @classmethod
+    def build(cls, entries):
+        """从 (cidr, entry_id) 列表构建索引"""
+        index = cls()
+        for cidr, entry_id in entries:
+            index.add(cidr, entry_id)
+        return index
+    
+    def __len__(self):
+        return self._size
+    
+    @staticmethod
+    def _parse_network(cidr):
+        net = ipaddress.ip_network(cidr, strict=False)
+        bits = PrefixIndex.BITS[net.version]
+        key = int(net.network_address) >> (bits - net.prefixlen)
+        return net, key
+    
+    def add(self, cidr, entry_id=None):
+        """添加一个网段（或单个地址）"""
+        net, key = self._parse_network(cidr)
+        value = (entry_id, str(net))
+        
+        with self._lock:
+            tables = self._tables[net.version]
+            table = tables.get(net.prefixlen)
+            if table is None:
+                table = {}
+                tables[net.prefixlen] = table
+                self._lengths[net.version] = tuple(sorted(tables, reverse=True))
+            
+            current = table.get(key, ())
+            if value in current:
+                return
+            table[key] = current + (value,)
+            self._size += 1
+    
+    def remove(self, cidr, entry_id=None):
+        """移除一个网段，返回是否存在"""
+        net, key = self._parse_network(cidr)
+        value = (entry_id, str(net))
+        
+        with self._lock:
+            tables = self._tables[net.version]
+            table = tables.get(net.prefixlen)
+            if table is None or value not in table.get(key, ()):
+                return False
+            
+            remaining = tuple(v for v in table[key] if v != value)
+            if remaining:
+                table[key] = remaining
+            else:
+                del table[key]
+                if not table:
+                    del tables[net.prefixlen]
+                    self._lengths[net.version] = tuple(sorted(tables, reverse=True))
+            self._size -= 1
+            return True
+    
+    @staticmethod
+    def _parse_address(ip):
+        """将地址字符串转换为 (version, 整数)，格式错误时抛出 ValueError"""
+        try:
+            if ':' in ip:
+                return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except (OSError, TypeError):
+            raise ValueError(f"Invalid IP address: {ip!r}")
+    
+    def _match(self, version, value):
+        tables = self._tables[version]
+        bits = self.BITS[version]
+        for prefixlen in self._lengths[version]:
+            table = tables.get(prefixlen)
+            if table is None:
+                continue
+            found = table.get(value >> (bits - prefixlen))
+            if found:
+                return found[0]
+        return None
+    
+    def lookup(self, ip):
+        """查询地址匹配的最长前缀条目，返回 (entry_id, cidr)，未匹配返回 None"""
+        version, value = self._parse_address(ip)
+        found = self._match(version, value)
+        
+        # IPv4映射的IPv6地址 (::ffff:a.b.c.d) 同时按IPv4匹配
+        if found is None and version == 6 and value >> 32 == 0xffff:
+            found = self._match(4, value & 0xffffffff)
+        return found
+    
+    def lookup_many(self, ips):
+        """批量查询，返回与输入顺序一致的结果列表"""
+        lookup = self.lookup
+        return [lookup(ip) for ip in ips]
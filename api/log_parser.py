@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+nginx stream 连接日志解析
+与 docker/nginx.conf.template、docker/nginx-haproxy.conf.template 中的 log_format 保持一致
+"""
+
+import re
+from datetime import datetime, timezone
+
+
+class StreamLogParser:
+    """nginx stream 连接日志解析器
+    
+    支持的格式（前缀标签按 "|key:value" 追加在 $remote_addr 之后）：
+      proxy_enhanced  $remote_addr|proxy:..|final:..|public:..|warn:.. [time] proto status sent recv session whitelist:0/1 upstream:..
+      proxy_simple    $remote_addr|final:..|warn:.. [time] proto status sent recv session whitelist:0/1 upstream:..
+      proxy_debug     $remote_addr|proxy:..|final:..|public:.. [time] proto status whitelist:0/1 connection:..
+      proxy_protocol  （HAProxy 模式）同 proxy_enhanced，但没有 warn 标签
+    以及旧版不带标签的 "IP [time] ..." 格式。
+    尝试过多个上游时 $upstream_addr 为 "127.0.0.1:444, 127.0.0.1:445"（含空格），取 upstream: 之后的整行。
+    
+    快速路径按空格切分字段（各格式字段数固定，标签内不含空格），
+    不符合预期结构的行再交给预编译正则处理；
+    $time_local 的解析结果按秒缓存，同一秒内的日志只解析一次。
+    """
+    
+    LINE_RE = re.compile(
+        r'^([^\s|\[]+)'                          # $remote_addr
+        r'(?:\|proxy:[^\s|]*)?'                  # $proxy_protocol_addr
+        r'(?:\|final:([^\s|]*))?'                # $client_ip（真实客户端IP）
+        r'(?:\|[a-z]+:[^\s|]*)*'                 # public: / warn: 等其他标签
+        r' \[([^\]]+)\] (\w+) (\d+)'             # [$time_local] $protocol $status
+        r'(?: (\d+) (\d+) ([\d.]+))?'            # $bytes_sent $bytes_received $session_time
+        r' whitelist:([01])'                     # $allowed
+        r'(?: upstream:(.*))?'                   # $upstream_addr（多个上游时以 ", " 分隔）
+    )
+    
+    TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+    TIME_CACHE_SIZE = 4096
+    
+    def __init__(self):
+        # "[dd/Mon/yyyy:HH:MM:SS" -> (时区字符串, UTC时间字符串)
+        self._time_cache = {}
+        self.parsed_lines = 0
+        self.failed_lines = 0
+    
+    def parse_time(self, time_str):
+        """将 $time_local 转换为 UTC 时间字符串 (YYYY-MM-DD HH:MM:SS)，格式错误返回 None"""
+        local, _, zone = time_str.partition(' ')
+        return self._cached_time('[' + local, zone + ']')
+    
+    def _cached_time(self, local_field, zone_field):
+        """按切分后的两个时间字段查缓存，字段形如 "[17/Oct/2026:10:00:00" 和 "+0800]" """
+        cached = self._time_cache.get(local_field)
+        if cached is not None and cached[0] == zone_field:
+            return cached[1]
+        
+        try:
+            dt = datetime.strptime(f"{local_field[1:]} {zone_field[:-1]}", self.TIME_FORMAT)
+        except ValueError:
+            return None
+        
+        value = dt.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if len(self._time_cache) >= self.TIME_CACHE_SIZE:
+            self._time_cache.clear()
+        self._time_cache[local_field] = (zone_field, value)
+        return value
+    
+    @staticmethod
+    def _upstream(value):
+        """规范化 $upstream_addr：去掉首尾空白和多余的逗号，未连接上游（"-"）时返回 None"""
+        value = value.strip().strip(',').strip() if value else ''
+        return value if value and value != '-' else None
+    
+    @staticmethod
+    def _client_ip(head):
+        """从 "$remote_addr|key:value|..." 中取 final 标签，缺失时退回 $remote_addr"""
+        pos = head.find('|final:')
+        if pos >= 0:
+            end = head.find('|', pos + 7)
+            ip = head[pos + 7:end] if end >= 0 else head[pos + 7:]
+            if ip and ip != '-':
+                return ip
+        end = head.find('|')
+        return head[:end] if end >= 0 else head
+    
+    def _parse_regex(self, line):
+        """正则解析（快速路径无法识别的行），失败返回 None"""
+        match = self.LINE_RE.match(line)
+        if not match:
+            return None
+        
+        remote, final, time_str, protocol, status_code, sent, received, session, allowed, upstream = match.groups()
+        timestamp = self.parse_time(time_str)
+        if timestamp is None:
+            return None
+        
+        return {
+            'ip': final if final and final != '-' else remote,
+            'status': 'allowed' if allowed == '1' else 'denied',
+            'timestamp': timestamp,
+            'protocol': protocol,
+            'status_code': int(status_code),
+            'bytes_sent': int(sent) if sent else None,
+            'bytes_received': int(received) if received else None,
+            'session_time': float(session) if session else None,
+            'upstream': self._upstream(upstream)
+        }
+    
+    def parse(self, text):
+        """解析一段日志文本（可以包含多行），返回连接记录列表"""
+        return self.parse_lines(text.splitlines())
+    
+    def parse_lines(self, lines):
+        """解析日志行列表，返回连接记录列表"""
+        cached_time = self._cached_time
+        client_ip = self._client_ip
+        normalize_upstream = self._upstream
+        connections = []
+        append = connections.append
+        failed = 0
+        
+        for line in lines:
+            parts = line.split(' ')
+            count = len(parts)
+            try:
+                if count >= 10 and parts[8][:10] == 'whitelist:' and (count == 10 or parts[9][:9] == 'upstream:'):
+                    # proxy_enhanced / proxy_simple / proxy_protocol / 旧版格式
+                    timestamp = cached_time(parts[1], parts[2])
+                    if timestamp is not None:
+                        if count == 10:
+                            upstream = parts[9][9:]
+                            if not upstream or upstream == '-':
+                                upstream = None
+                        else:
+                            # 多个上游地址以 ", " 分隔，被切分到了后面的字段中
+                            upstream = normalize_upstream(' '.join(parts[9:])[9:])
+                        append({
+                            'ip': client_ip(parts[0]),
+                            'status': 'allowed' if parts[8] == 'whitelist:1' else 'denied',
+                            'timestamp': timestamp,
+                            'protocol': parts[3],
+                            'status_code': int(parts[4]),
+                            'bytes_sent': int(parts[5]),
+                            'bytes_received': int(parts[6]),
+                            'session_time': float(parts[7]),
+                            'upstream': upstream
+                        })
+                        continue
+                
+                elif count == 7 and parts[5][:10] == 'whitelist:':
+                    # proxy_debug
+                    timestamp = cached_time(parts[1], parts[2])
+                    if timestamp is not None:
+                        append({
+                            'ip': client_ip(parts[0]),
+                            'status': 'allowed' if parts[5] == 'whitelist:1' else 'denied',
+                            'timestamp': timestamp,
+                            'protocol': parts[3],
+                            'status_code': int(parts[4]),
+                            'bytes_sent': None,
+                            'bytes_received': None,
+                            'session_time': None,
+                            'upstream': None
+                        })
+                        continue
+            
+            except (ValueError, IndexError):
+                pass
+            
+            if not line:
+                continue
+            connection = self._parse_regex(line)
+            if connection is None:
+                failed += 1
+            else:
+                append(connection)
+        
+        self.parsed_lines += len(connections)
+        self.failed_lines += failed
+        return connections
+    
+    def parse_line(self, line):
+        """解析单行日志，无法识别时返回 None"""
+        connections = self.parse(line.strip())
+        return connections[0] if connections else None
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Prometheus 文本格式指标
+计数器、直方图在热路径上只做一次加锁累加；回调型指标在导出时才计算。
+多 worker 部署时各进程定期把自己的指标快照写入共享目录，导出时合并所有存活进程的数据。
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """指标基类，样本按标签值元组保存"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._samples = {}
+        self._lock = threading.Lock()
+    
+    def snapshot(self):
+        """导出样本（可 JSON 序列化），用于进程间合并"""
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._samples.items()]
+    
+    @staticmethod
+    def _copy(value):
+        return value
+    
+    def render(self, samples):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """只增计数器"""
+    
+    kind = 'counter'
+    
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._samples[labelvalues] = self._samples.get(labelvalues, 0) + amount
+    
+    @staticmethod
+    def merge(a, b):
+        return a + b
+    
+    def render(self, samples):
+        for labels, value in sorted(samples.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    """直方图，每个样本保存 [各桶计数..., 总和, 次数]，导出时再累加为累计桶"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._samples.get(labelvalues)
+            if sample is None:
+                sample = self._samples[labelvalues] = [0] * (len(self.buckets) + 3)
+            sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+    
+    @contextmanager
+    def time(self, *labelvalues):
+        """统计代码块的执行时间（异常时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+    
+    @staticmethod
+    def _copy(value):
+        return list(value)
+    
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+    
+    def render(self, samples):
+        for labels, sample in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), sample):
+                cumulative += count
+                label_str = _format_labels(self.labelnames, labels, ('le', _format_value(float(bound))))
+                yield f'{self.name}_bucket{label_str} {cumulative}'
+            label_str = _format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{label_str} {_format_value(sample[-2])}'
+            yield f'{self.name}_count{label_str} {sample[-1]}'
+
+
+class Gauge(Metric):
+    """回调型仪表，导出时调用 func 取值（func 返回数值，或 {标签值元组: 数值}）
+    
+    只在处理 /metrics 请求的进程中计算，不参与进程间合并。
+    """
+    
+    kind = 'gauge'
+    
+    def __init__(self, name, documentation, func, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+    
+    def snapshot(self):
+        return []
+    
+    def collect(self):
+        value = self.func()
+        if value is None:
+            return {}
+        if isinstance(value, dict):
+            return value
+        return {(): value}
+    
+    def render(self, samples):
+        for labels, value in sorted(samples.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+
+class MetricsRegistry:
+    """指标注册表
+    
+    share_dir 不为空时，start_sharing() 启动的线程每 interval 秒把本进程的计数器和直方图
+    写入 share_dir/metrics-<pid>.json；render() 合并本进程的实时数据和其他存活进程的快照。
+    """
+    
+    def __init__(self):
+        self._metrics = {}
+        self.share_dir = None
+        self.share_interval = None
+        self._share_thread = None
+    
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def gauge(self, name, documentation, func, labelnames=()):
+        return self.register(Gauge(name, documentation, func, labelnames))
+    
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items() if metric.kind != 'gauge'}
+    
+    def start_sharing(self, share_dir, interval=5.0):
+        """启动快照线程（多进程部署时调用）"""
+        self.share_dir = Path(share_dir)
+        self.share_interval = interval
+        self.share_dir.mkdir(parents=True, exist_ok=True)
+        if self._share_thread is None or not self._share_thread.is_alive():
+            self._share_thread = threading.Thread(target=self._share_loop, name='metrics-share', daemon=True)
+            self._share_thread.start()
+    
+    def _share_loop(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+            time.sleep(self.share_interval)
+    
+    def write_snapshot(self):
+        """原子写入本进程的指标快照"""
+        path = self.share_dir / f'metrics-{os.getpid()}.json'
+        fd, tmp_path = tempfile.mkstemp(prefix='.metrics-', dir=self.share_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _peer_snapshots(self):
+        """读取其他存活进程的快照，已退出进程的快照文件会被删除"""
+        if self.share_dir is None:
+            return []
+        snapshots = []
+        own = f'metrics-{os.getpid()}.json'
+        for path in self.share_dir.glob('metrics-*.json'):
+            if path.name == own:
+                continue
+            try:
+                pid = int(path.stem.split('-', 1)[1])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+                continue
+            except (ValueError, PermissionError):
+                continue
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+    
+    def render(self):
+        """生成 Prometheus 文本格式（0.0.4）"""
+        merged = {name: {tuple(labels): value for labels, value in samples}
+                  for name, samples in self.snapshot().items()}
+        for snapshot in self._peer_snapshots():
+            for name, samples in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or name not in merged:
+                    continue
+                target = merged[name]
+                for labels, value in samples:
+                    labels = tuple(labels)
+                    target[labels] = metric.merge(target[labels], value) if labels in target else value
+        
+        lines = []
+        for name, metric in self._metrics.items():
+            if metric.kind == 'gauge':
+                try:
+                    samples = metric.collect()
+                except Exception:
+                    continue
+            else:
+                samples = merged.get(name, {})
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.render(samples))
+        return '\n'.join(lines) + '\n'
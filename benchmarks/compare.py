@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+对比两次基准测试结果（offline_bench.py / startup_bench.py / http_bench.py 输出的 JSON）
+
+逐项列出两个文件中都存在的数值指标及变化比例；耗时类指标（*_ms、seconds）变大、
+吞吐类指标（*_per_sec、rps）变小超过阈值时标记为回退，存在回退时退出码为 1。
+
+用法:
+    python3 benchmarks/compare.py baseline.json result.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+# 这些字段描述测试参数或环境，不参与对比
+SKIP_PREFIXES = ('environment.', 'args.')
+
+
+def flatten(data, prefix=''):
+    """把嵌套字典展开为 {'a.b.c': 数值}"""
+    items = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            items.update(flatten(value, f'{prefix}{key}.'))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        items[prefix[:-1]] = data
+    return items
+
+
+def direction(key):
+    """1 表示越大越好，-1 表示越小越好，0 表示不判断"""
+    name = key.rsplit('.', 1)[-1]
+    if name.endswith('_per_sec') or name == 'rps':
+        return 1
+    if name.endswith('_ms') or name == 'seconds':
+        return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('result')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定为回退的相对变化')
+    parser.add_argument('--all', action='store_true', help='同时列出不判断方向的指标')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = flatten(json.load(f))
+    with open(args.result) as f:
+        result = flatten(json.load(f))
+
+    regressions = 0
+    width = max((len(key) for key in result), default=10)
+    for key in sorted(baseline.keys() & result.keys()):
+        if key.startswith(SKIP_PREFIXES):
+            continue
+        sign = direction(key)
+        if not sign and not args.all:
+            continue
+        old, new = baseline[key], result[key]
+        change = (new - old) / old if old else 0.0
+        regressed = sign and sign * change < -args.threshold
+        regressions += bool(regressed)
+        marker = 'REGRESSION' if regressed else ''
+        print(f'{key:<{width}}  {old:>14.3f}  {new:>14.3f}  {change:>+8.1%}  {marker}')
+
+    print(f'\n{regressions} regression(s) over {args.threshold:.0%}', file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+DNS 替身服务器（开发和基准测试用）
+
+应答主机名白名单条目解析用到的 A/AAAA 查询（UDP 和 TCP），记录在运行中可以修改，用于验证：
+- 解析结果不变时不更新映射、不重载
+- 记录变化后在 TTL 到期时更新一次映射
+- 服务器无响应（store.drop = True）时保留上一次的地址
+不存在的名称返回 NXDOMAIN（附带 SOA，否定应答 TTL 为 --negative-ttl）。
+
+用法:
+    python3 benchmarks/dns_standin.py --listen 127.0.0.1:5353 --record home.example.org=198.51.100.7,60
+    DNS_RESOLVER=127.0.0.1:5353 python3 api/app.py
+"""
+
+import argparse
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'api'))
+
+from dns_resolver import (  # noqa: E402
+    CLASS_IN, RCODE_NOERROR, RCODE_NXDOMAIN, TYPE_A, TYPE_AAAA, TYPE_SOA, parse_nameserver
+)
+
+
+class RecordStore:
+    """记录内容：名称 -> [(地址, TTL)]"""
+    
+    def __init__(self, negative_ttl=30):
+        self.records = {}
+        self.negative_ttl = negative_ttl
+        self.queries = 0
+        self.drop = False  # 为 True 时不应答（模拟服务器故障）
+        self._lock = threading.Lock()
+    
+    def set(self, name, addresses):
+        """设置一个名称的全部记录，addresses 为 [(地址, TTL)] 或地址列表（TTL 为 60）"""
+        with self._lock:
+            self.records[name.lower().rstrip('.')] = [
+                item if isinstance(item, tuple) else (item, 60) for item in addresses
+            ]
+    
+    def delete(self, name):
+        with self._lock:
+            self.records.pop(name.lower().rstrip('.'), None)
+    
+    def answer(self, query):
+        """生成应答报文，无法解析的查询或 drop 时返回 None"""
+        with self._lock:
+            self.queries += 1
+            if self.drop or len(query) < 12:
+                return None
+            query_id, _, qdcount = struct.unpack('!HHH', query[:6])
+            if qdcount != 1:
+                return None
+            labels, offset = [], 12
+            while offset < len(query) and query[offset]:
+                length = query[offset]
+                labels.append(query[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+                offset += 1 + length
+            question = query[12:offset + 5]
+            if len(question) < offset - 12 + 5:
+                return None
+            qtype = struct.unpack('!H', question[-4:-2])[0]
+            records = self.records.get('.'.join(labels).lower())
+        
+        answers = []
+        if records is not None:
+            family, rtype = (socket.AF_INET, TYPE_A) if qtype == TYPE_A else (socket.AF_INET6, TYPE_AAAA)
+            for address, ttl in records:
+                try:
+                    rdata = socket.inet_pton(family, address)
+                except OSError:
+                    continue  # 另一种地址族的记录
+                # 0xC00C：指向问题中的名称
+                answers.append(struct.pack('!HHHIH', 0xC00C, rtype, CLASS_IN, ttl, len(rdata)) + rdata)
+        
+        authority = []
+        if not answers:
+            # 否定应答附带 SOA，MINIMUM 字段为否定应答 TTL
+            rdata = b'\x00\x00' + struct.pack('!IIIII', 1, 3600, 600, 86400, self.negative_ttl)
+            authority.append(struct.pack('!HHHIH', 0xC00C, TYPE_SOA, CLASS_IN, self.negative_ttl, len(rdata)) + rdata)
+        
+        rcode = RCODE_NOERROR if records is not None else RCODE_NXDOMAIN
+        header = struct.pack('!HHHHHH', query_id, 0x8180 | rcode, 1, len(answers), len(authority), 0)
+        return header + question + b''.join(answers) + b''.join(authority)
+
+
+class UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        response = self.server.store.answer(data)
+        if response is not None:
+            sock.sendto(response, self.client_address)
+
+
+class TCPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return
+        response = self.server.store.answer(self.rfile.read(struct.unpack('!H', header)[0]))
+        if response is not None:
+            self.wfile.write(struct.pack('!H', len(response)) + response)
+
+
+class ThreadingUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(address, records=None, negative_ttl=30):
+    """在后台线程中启动替身服务器（UDP 和 TCP 使用同一端口），返回 UDP server（server.store 为记录内容）
+    
+    records 为 {名称: [(地址, TTL)]}；address 的端口为 0 时自动选择，实际地址见 server.server_address。
+    """
+    host, port = parse_nameserver(address)
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    ThreadingUDPServer.address_family = family
+    ThreadingTCPServer.address_family = family
+    udp = ThreadingUDPServer((host, port), UDPHandler)
+    tcp = ThreadingTCPServer((host, udp.server_address[1]), TCPHandler)
+    
+    store = RecordStore(negative_ttl)
+    for name, addresses in (records or {}).items():
+        store.set(name, addresses)
+    udp.store = tcp.store = store
+    udp.tcp_server = tcp
+    for server in (udp, tcp):
+        threading.Thread(target=server.serve_forever, name='dns-standin', daemon=True).start()
+    return udp
+
+
+def parse_record(value):
+    """解析 host=地址[,TTL] 格式的记录"""
+    name, _, rest = value.partition('=')
+    address, _, ttl = rest.partition(',')
+    if not name or not address:
+        raise argparse.ArgumentTypeError(f'invalid record: {value!r}')
+    return name, address, int(ttl or 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DNS stand-in server')
+    parser.add_argument('--listen', default='127.0.0.1:5353', help='监听地址（host:port，UDP 和 TCP）')
+    parser.add_argument('--record', action='append', default=[], type=parse_record,
+                        help='记录 host=地址[,TTL]，同一名称可重复指定')
+    parser.add_argument('--negative-ttl', type=int, default=30, help='NXDOMAIN 应答的 TTL')
+    args = parser.parse_args()
+    
+    records = {}
+    for name, address, ttl in args.record:
+        records.setdefault(name, []).append((address, ttl))
+    server = start_server(args.listen, records, args.negative_ttl)
+    print(f'DNS stand-in listening on {args.listen}, records: {len(records)}', file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.tcp_server.shutdown()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
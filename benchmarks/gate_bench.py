@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+stream 数据通路基准测试：内置白名单网关（api/gate.py）与 nginx stream 对比
+
+在本机启动回显上游（代替 MTProxy）、gate.py 和（存在 nginx 可执行文件时）一份最小的 nginx stream 配置，
+两者使用相同的白名单判定方式（PROXY protocol 头中的客户端地址），分别测量：
+- accept：并发建立连接并发送 PROXY 头和一个小数据包，到收到回显为止的延迟分位数和每秒连接数
+- throughput：并发连接持续收发大块数据的总吞吐量（MB/s）
+- denied：未在白名单中的客户端被拒绝（连接关闭）的延迟
+结果以 JSON 输出，可用 benchmarks/compare.py 对比两次运行。
+
+用法:
+    python3 benchmarks/gate_bench.py --connections 5000 --concurrency 64 --stream-mb 64 -o result.json
+    python3 benchmarks/gate_bench.py --targets gate --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+NGINX_CONF = """
+worker_processes {workers};
+daemon off;
+pid {workdir}/nginx.pid;
+error_log {workdir}/nginx_error.log warn;
+events {{ worker_connections 16384; }}
+stream {{
+    log_format proxy_enhanced '$remote_addr|proxy:$proxy_protocol_addr [$time_local] TCP $status '
+                              '$bytes_sent $bytes_received $session_time upstream:$upstream_addr';
+    geo $proxy_protocol_addr $allowed {{
+        default 0;
+        127.0.0.1 1;
+        10.0.0.0/8 1;
+    }}
+    map $allowed $backend {{
+        1 upstream_backend;
+        0 reject_backend;
+    }}
+    upstream upstream_backend {{ server 127.0.0.1:{upstream_port}; }}
+    upstream reject_backend {{ server 127.0.0.1:9; }}
+    server {{
+        listen 127.0.0.1:{port} proxy_protocol reuseport;
+        proxy_pass $backend;
+        proxy_timeout 10s;
+        proxy_connect_timeout 3s;
+        access_log {workdir}/nginx_access.log proxy_enhanced buffer=64k flush=1s;
+    }}
+}}
+"""
+
+
+def timings(values):
+    """耗时列表（秒）的统计，单位毫秒"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(values[len(values) // 2] * 1000, 3),
+        'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3)
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def run_echo(port):
+    """回显上游（单独进程，避免与测试客户端争用事件循环）"""
+    class Echo(asyncio.Protocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def data_received(self, data):
+            self.transport.write(data)
+
+        def pause_writing(self):
+            self.transport.pause_reading()
+
+        def resume_writing(self):
+            self.transport.resume_reading()
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(Echo, '127.0.0.1', port, backlog=4096)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def create_database(path):
+    """gate.py 读取的最小白名单数据库（表结构与 app.py 中的相同字段）"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT, updated_at TIMESTAMP);
+        CREATE TABLE whitelist (id INTEGER PRIMARY KEY, ip TEXT NOT NULL, ip_type TEXT, is_active BOOLEAN DEFAULT 1);
+        CREATE TABLE hostname_resolutions (entry_id INTEGER PRIMARY KEY, addresses TEXT NOT NULL DEFAULT '');
+        INSERT INTO meta (key, value) VALUES ('whitelist_version', '1');
+        INSERT INTO whitelist (ip) VALUES ('10.0.0.0/8');
+    """)
+    conn.commit()
+    conn.close()
+
+
+def start_gate(workdir, port, upstream_port, workers):
+    db_path = workdir / 'users.db'
+    create_database(db_path)
+    process = subprocess.Popen([
+        sys.executable, str(ROOT / 'api' / 'gate.py'), '--proxy-listen', f'127.0.0.1:{port}',
+        '--upstream', f'127.0.0.1:{upstream_port}', '--db', str(db_path),
+        '--access-log', str(workdir / 'gate_access.log'), '--workers', str(workers)
+    ], stderr=open(workdir / 'gate.log', 'w'))
+    return process
+
+
+def start_nginx(workdir, port, upstream_port, workers, nginx):
+    conf = workdir / 'nginx.conf'
+    conf.write_text(NGINX_CONF.format(workers=workers, workdir=workdir, port=port, upstream_port=upstream_port))
+    return subprocess.Popen([nginx, '-c', str(conf), '-p', str(workdir)],
+                            stderr=open(workdir / 'nginx.log', 'w'))
+
+
+def proxy_header(client_ip):
+    return f'PROXY TCP4 {client_ip} 127.0.0.1 40000 443\r\n'.encode('ascii')
+
+
+async def accept_round(port, client_ip, payload):
+    """一次完整的连接：建立连接、发送 PROXY 头和数据、收到回显（或被关闭），返回耗时"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(proxy_header(client_ip) + payload)
+    try:
+        await reader.readexactly(len(payload))
+        ok = True
+    except asyncio.IncompleteReadError:
+        ok = False
+    elapsed = time.perf_counter() - started
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return elapsed, ok
+
+
+async def bench_accept(port, connections, concurrency, client_ip, payload, allowed=True):
+    """allowed 为 False 时，连接被关闭且没有收到回显才计为成功"""
+    durations = []
+    failures = 0
+    queue = iter(range(connections))
+
+    async def worker():
+        nonlocal failures
+        for _ in queue:
+            try:
+                elapsed, ok = await accept_round(port, client_ip, payload)
+            except OSError:
+                failures += 1
+                continue
+            if ok == allowed:
+                durations.append(elapsed)
+            else:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    result = timings(durations)
+    result['failures'] = failures
+    result['seconds'] = round(seconds, 3)
+    result['connections_per_sec'] = round(len(durations) / seconds, 1)
+    return result
+
+
+async def bench_throughput(port, concurrency, total_mb, chunk_size):
+    """每个连接发送 total_mb / concurrency MB，同时读取回显，返回总吞吐量"""
+    per_connection = total_mb * 1024 * 1024 // concurrency
+    chunk = os.urandom(chunk_size)
+
+    async def stream():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(proxy_header('10.1.2.3'))
+
+        async def send():
+            sent = 0
+            while sent < per_connection:
+                writer.write(chunk)
+                await writer.drain()
+                sent += len(chunk)
+
+        async def receive():
+            received = 0
+            while received < per_connection:
+                data = await reader.read(262144)
+                if not data:
+                    raise ConnectionError('connection closed before all data was echoed')
+                received += len(data)
+            return received
+
+        _, received = await asyncio.gather(send(), receive())
+        writer.close()
+        return received
+
+    started = time.perf_counter()
+    received = sum(await asyncio.gather(*(stream() for _ in range(concurrency))))
+    seconds = time.perf_counter() - started
+    return {
+        'bytes': received,
+        'seconds': round(seconds, 3),
+        'mb_per_sec': round(received / seconds / 1024 / 1024, 1)
+    }
+
+
+async def bench_target(port, args):
+    payload = b'\xef' * 64  # 与 MTProxy 客户端握手包大小相近的小数据包
+    result = {}
+    # 预热，建立连接池、加载白名单
+    await bench_accept(port, 200, 8, '10.1.2.3', payload)
+    result['accept'] = await bench_accept(port, args.connections, args.concurrency, '10.1.2.3', payload)
+    result['denied'] = await bench_accept(port, min(args.connections, 1000), args.concurrency, '203.0.113.7', payload,
+                                         allowed=False)
+    result['denied'].pop('connections_per_sec', None)
+    result['throughput'] = await bench_throughput(port, args.stream_concurrency, args.stream_mb, args.chunk_size)
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream data path benchmark: built-in gate vs nginx stream')
+    parser.add_argument('--targets', default='gate,nginx', help='测试对象，逗号分隔（gate、nginx）')
+    parser.add_argument('--workers', type=int, default=0, help='gate/nginx 进程数，0 表示 CPU 核心数')
+    parser.add_argument('--connections', type=int, default=5000, help='accept 测试的连接数')
+    parser.add_argument('--concurrency', type=int, default=64, help='accept 测试的并发连接数')
+    parser.add_argument('--stream-mb', type=int, default=256, help='throughput 测试的总数据量（MB）')
+    parser.add_argument('--stream-concurrency', type=int, default=16, help='throughput 测试的并发连接数')
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--nginx', default=shutil.which('nginx') or shutil.which('nginx', path='/usr/sbin'),
+                        help='nginx 可执行文件')
+    parser.add_argument('-o', '--output', help='结果文件，默认标准输出')
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    workdir = Path(tempfile.mkdtemp(prefix='mtproxy-gate-bench-'))
+    upstream_port = free_port()
+    echo = multiprocessing.Process(target=run_echo, args=(upstream_port,), daemon=True)
+    echo.start()
+    wait_port(upstream_port)
+
+    results = {'environment': environment(), 'args': {
+        key: value for key, value in vars(args).items() if key not in ('output', 'nginx')
+    }}
+    try:
+        for target in [t.strip() for t in args.targets.split(',') if t.strip()]:
+            port = free_port()
+            if target == 'gate':
+                process = start_gate(workdir, port, upstream_port, workers)
+            elif target == 'nginx':
+                if not args.nginx:
+                    print('nginx not found, skipping nginx target', file=sys.stderr)
+                    results[target] = {'skipped': 'nginx executable not found'}
+                    continue
+                process = start_nginx(workdir, port, upstream_port, workers, args.nginx)
+            else:
+                parser.error(f'unknown target: {target}')
+
+            try:
+                if not wait_port(port):
+                    raise RuntimeError(f'{target} did not start listening on {port}, see {workdir}')
+                print(f'{target}: {workers} workers on port {port}...', file=sys.stderr)
+                results[target] = asyncio.run(bench_target(port, args))
+            finally:
+                process.terminate()
+                process.wait(10)
+    finally:
+        echo.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(results, out, indent=2, ensure_ascii=False)
+        out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HAProxy 运行时 API 替身服务器（开发和基准测试用）
+
+实现 API 同步白名单时用到的命令子集，行为与 HAProxy 2.8 的非交互模式一致：
+每个连接读取一行命令（; 分隔多条，以 << 结尾时读取到空行为止的载荷），输出结果后关闭连接。
+- show map <map>
+- add map [@<版本>] <map> <键> <值> / add map <map> << 载荷
+- del map <map> <键>
+- clear map <map>
+未知的映射返回与 HAProxy 相同的错误信息；可用 --map 在启动时从文件加载映射。
+
+用法:
+    python3 benchmarks/haproxy_standin.py --listen 127.0.0.1:9999 --map /tmp/whitelist.map
+    HAPROXY_WHITELIST=true HAPROXY_RUNTIME_API=127.0.0.1:9999 HAPROXY_WHITELIST_MAP=/tmp/whitelist.map python3 api/app.py
+"""
+
+import argparse
+import os
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'api'))
+
+from haproxy_runtime import parse_address  # noqa: E402
+
+UNKNOWN_MAP = 'Unknown map identifier. Please use #<id> or <file>.\n'
+
+
+class MapStore:
+    """映射内容：名称 -> [(条目ID, 键, 值)]，允许重复的键（与 HAProxy 相同）"""
+    
+    def __init__(self):
+        self.maps = {}
+        self.commands = 0
+        self.connections = 0
+        self._next_id = 0x55d0c0de0000
+        self._lock = threading.Lock()
+    
+    def load(self, name, path=None):
+        entries = self.maps.setdefault(name, [])
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and not parts[0].startswith('#'):
+                        entries.append(self._entry(parts[0], parts[1] if len(parts) > 1 else ''))
+    
+    def keys(self, name):
+        with self._lock:
+            return [key for _, key, _ in self.maps.get(name, [])]
+    
+    def _entry(self, key, value):
+        self._next_id += 0x40
+        return (self._next_id, key, value)
+    
+    def execute(self, command, payload=None):
+        """执行一条命令，返回输出文本"""
+        words = command.split()
+        with self._lock:
+            self.commands += 1
+            if len(words) >= 3 and words[1] == 'map':
+                action, args = words[0], words[2:]
+                if action == 'add' and args and args[0].startswith('@'):
+                    args = args[1:]  # 版本号：替身只维护当前版本
+                if not args:
+                    return f"'{action} map' expects a map identifier.\n"
+                entries = self.maps.get(args[0])
+                if entries is None:
+                    return UNKNOWN_MAP
+                if action == 'show':
+                    return ''.join(f'0x{entry_id:x} {key} {value}\n' for entry_id, key, value in entries)
+                if action == 'clear':
+                    entries.clear()
+                    return ''
+                if action == 'del' and len(args) == 2:
+                    kept = [entry for entry in entries if entry[1] != args[1]]
+                    if len(kept) == len(entries):
+                        return 'Key not found.\n'
+                    entries[:] = kept
+                    return ''
+                if action == 'add' and payload is not None:
+                    for line in payload.splitlines():
+                        parts = line.split()
+                        if len(parts) != 2:
+                            return "'add map' expects two parameters: key and value.\n"
+                        entries.append(self._entry(*parts))
+                    return ''
+                if action == 'add' and len(args) == 3:
+                    entries.append(self._entry(args[1], args[2]))
+                    return ''
+            return 'Unknown command. Please enter one of the following commands only :\n'
+
+
+class RuntimeHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        store.connections += 1
+        line = self.rfile.readline().decode('utf-8').rstrip('\n')
+        payload = None
+        if line.endswith('<<'):
+            line = line[:-2]
+            payload_lines = []
+            for raw in self.rfile:
+                raw = raw.decode('utf-8').rstrip('\n')
+                if not raw:
+                    break
+                payload_lines.append(raw)
+            payload = '\n'.join(payload_lines)
+        
+        commands = [command.strip() for command in line.split(';') if command.strip()]
+        output = []
+        for index, command in enumerate(commands):
+            # 载荷属于最后一条命令
+            output.append(store.execute(command, payload if index == len(commands) - 1 else None))
+        self.wfile.write(''.join(output).encode('utf-8'))
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(address, maps=()):
+    """在后台线程中启动替身服务器，返回 server（server.store 为映射内容）
+    
+    maps 为映射名称（或 (名称, 初始文件) 元组）列表。
+    """
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.unlink(target)
+        server = ThreadingUnixServer(target, RuntimeHandler)
+    else:
+        ThreadingTCPServer.address_family = family
+        server = ThreadingTCPServer(target, RuntimeHandler)
+    
+    server.store = MapStore()
+    for item in maps:
+        name, path = item if isinstance(item, tuple) else (item, None)
+        server.store.load(name, path)
+    threading.Thread(target=server.serve_forever, name='haproxy-standin', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HAProxy runtime API stand-in server')
+    parser.add_argument('--listen', default='127.0.0.1:9999', help='监听地址（host:port 或 unix:/path）')
+    parser.add_argument('--map', action='append', default=[], help='映射名称（文件存在时加载其内容），可重复指定')
+    args = parser.parse_args()
+    
+    server = start_server(args.listen, [(name, name) for name in args.map])
+    print(f'HAProxy runtime API stand-in listening on {args.listen}, maps: {", ".join(args.map) or "-"}',
+          file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+API 吞吐量和延迟基准测试
+
+对运行中的 API 服务并发发起请求，输出每个接口的请求数/秒和延迟分位数（JSON）。
+可选同时运行写入线程不断添加/删除白名单条目，观察重载对读请求延迟的影响。
+
+用法:
+    python3 benchmarks/http_bench.py --url http://127.0.0.1:8080 --password admin123 \\
+        --concurrency 16 --duration 20 --writers 1
+"""
+
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    '/api/whitelist',
+    '/api/status',
+    '/api/connections/stats',
+    '/api/connections/recent?limit=100',
+    '/api/whitelist/check?ip=10.1.2.3',
+]
+
+
+def percentile(sorted_values, pct):
+    """已排序列表的分位数（最近秩）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Client:
+    """单个线程使用的保持连接的 HTTP 客户端"""
+
+    def __init__(self, url, token=None, timeout=30):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        """发送请求，返回 (状态码, 响应体)，连接断开时重连一次"""
+        headers = dict(self.headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=data, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+def login(url, username, password):
+    status, body = Client(url).request('POST', '/api/auth/login', {'username': username, 'password': password})
+    if status != 200:
+        raise SystemExit(f"Login failed ({status}): {body[:200]!r}")
+    return json.loads(body)['token']
+
+
+def run_readers(url, token, paths, concurrency, duration):
+    """concurrency 个线程轮流请求 paths，返回每个路径的延迟列表和错误数"""
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(offset):
+        client = Client(url, token)
+        local = {path: [] for path in paths}
+        local_errors = {path: 0 for path in paths}
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status, _ = client.request('GET', path)
+            except (http.client.HTTPException, OSError):
+                status = None
+            elapsed = time.perf_counter() - started
+            if status == 200:
+                local[path].append(elapsed)
+            else:
+                local_errors[path] += 1
+        with lock:
+            for path in paths:
+                latencies[path].extend(local[path])
+                errors[path] += local_errors[path]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def run_writer(url, token, stop_event, index, counters):
+    """不断添加并删除白名单条目，触发白名单版本变化和配置重载"""
+    client = Client(url, token)
+    n = 0
+    while not stop_event.is_set():
+        ip = f'198.18.{index}.{n % 250 + 1}'
+        n += 1
+        try:
+            status, body = client.request('POST', '/api/whitelist', {'ip': ip, 'description': 'benchmark'})
+            if status == 200:
+                item_id = json.loads(body)['id']
+                client.request('DELETE', f'/api/whitelist/{item_id}')
+                counters['writes'] += 2
+            else:
+                counters['write_errors'] += 1
+        except (http.client.HTTPException, OSError, ValueError, KeyError):
+            counters['write_errors'] += 1
+
+
+def summarize(latencies, errors, duration):
+    results = {}
+    all_latencies = []
+    for path, values in latencies.items():
+        values.sort()
+        all_latencies.extend(values)
+        results[path] = {
+            'requests': len(values),
+            'errors': errors[path],
+            'rps': round(len(values) / duration, 1),
+            'p50_ms': round(percentile(values, 50) * 1000, 2) if values else None,
+            'p99_ms': round(percentile(values, 99) * 1000, 2) if values else None,
+            'max_ms': round(values[-1] * 1000, 2) if values else None
+        }
+    all_latencies.sort()
+    total = {
+        'requests': len(all_latencies),
+        'errors': sum(errors.values()),
+        'rps': round(len(all_latencies) / duration, 1),
+        'p50_ms': round(percentile(all_latencies, 50) * 1000, 2) if all_latencies else None,
+        'p99_ms': round(percentile(all_latencies, 99) * 1000, 2) if all_latencies else None
+    }
+    return results, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API throughput/latency benchmark')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--path', action='append', dest='paths', help='要测试的路径，可重复指定')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--writers', type=int, default=0, help='同时运行的白名单写入线程数')
+    parser.add_argument('--label', default='', help='写入结果中的标签（如 flask / gunicorn-4）')
+    args = parser.parse_args()
+
+    token = login(args.url, args.username, args.password)
+    paths = args.paths or DEFAULT_PATHS
+
+    stop_event = threading.Event()
+    counters = {'writes': 0, 'write_errors': 0}
+    writers = [threading.Thread(target=run_writer, args=(args.url, token, stop_event, n, counters), daemon=True)
+               for n in range(args.writers)]
+    for writer in writers:
+        writer.start()
+
+    started = time.monotonic()
+    latencies, errors = run_readers(args.url, token, paths, args.concurrency, args.duration)
+    elapsed = time.monotonic() - started
+    stop_event.set()
+    for writer in writers:
+        writer.join(5)
+
+    results, total = summarize(latencies, errors, elapsed)
+    json.dump({
+        'label': args.label,
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration': round(elapsed, 2),
+        'writers': args.writers,
+        'writes': counters['writes'],
+        'write_errors': counters['write_errors'],
+        'total': total,
+        'paths': results
+    }, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
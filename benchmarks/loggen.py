@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合成 nginx stream 连接日志（proxy_enhanced 格式，见 docker/nginx.conf.template）
+
+内容由随机种子决定，可重复生成。日志包含：
+- 白名单客户端的正常会话（允许，带发送/接收字节数和会话时长），部分为 IPv6
+- 互联网背景噪声（大量不同的公网IP，拒绝）
+- 扫描器突发（同一IP在一两秒内连续数百次连接，拒绝）
+- 少量内网来源（public:0 warn:WARNING_PRIVATE_IP）
+- 部分连接经 PROXY protocol 转发（$remote_addr 为 Docker 网关）
+
+用法:
+    python3 benchmarks/loggen.py --lines 1000000 --seed 1 -o /tmp/stream_access.log
+"""
+
+import argparse
+import ipaddress
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+DOCKER_GATEWAY = '172.18.0.1'
+UPSTREAM = '127.0.0.1:8443'
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def random_public_ipv4(rng):
+    """随机公网 IPv4（跳过私有、保留等地址）"""
+    while True:
+        ip = ipaddress.IPv4Address(rng.getrandbits(32))
+        if ip.is_global:
+            return str(ip)
+
+
+def random_public_ipv6(rng):
+    """2000::/3 中的随机 IPv6"""
+    return str(ipaddress.IPv6Address((0x2 << 124) | rng.getrandbits(125) >> 1))
+
+
+def random_private_ipv4(rng):
+    return rng.choice([
+        f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+        f'192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+        f'172.{rng.randrange(16, 32)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+    ])
+
+
+class LogGenerator:
+    """proxy_enhanced 日志生成器
+
+    rate 为平均每秒连接数，时间从 start（UTC）开始递增；各比例为占全部日志行的比例。
+    """
+
+    def __init__(self, seed=1, start=None, rate=200.0, clients=5000, ipv6_ratio=0.15,
+                 allowed_ratio=0.35, scanner_ratio=0.35, private_ratio=0.02, proxy_protocol_ratio=0.3,
+                 tz_offset='+0800'):
+        self.rng = random.Random(seed)
+        self.time = start or datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.rate = rate
+        self.allowed_ratio = allowed_ratio
+        self.scanner_ratio = scanner_ratio
+        self.private_ratio = private_ratio
+        self.proxy_protocol_ratio = proxy_protocol_ratio
+        self.tz_offset = tz_offset
+        sign = 1 if tz_offset[0] == '+' else -1
+        self._tz = timezone(sign * timedelta(hours=int(tz_offset[1:3]), minutes=int(tz_offset[3:5])))
+        rng = self.rng
+        self.clients = [random_public_ipv6(rng) if rng.random() < ipv6_ratio else random_public_ipv4(rng)
+                        for _ in range(clients)]
+        self.scanners = [random_public_ipv4(rng) for _ in range(max(clients // 50, 10))]
+        self._burst = []  # 当前扫描突发剩余的 (IP, 行数)
+        self._time_key = None
+        self._time_str = None
+
+    def _time_local(self):
+        """当前时间的 $time_local 字符串（同一秒内复用）"""
+        key = int(self.time.timestamp())
+        if key != self._time_key:
+            local = self.time.astimezone(self._tz)
+            self._time_key = key
+            self._time_str = (f'{local.day:02d}/{MONTHS[local.month - 1]}/{local.year}:'
+                              f'{local.hour:02d}:{local.minute:02d}:{local.second:02d} {self.tz_offset}')
+        return self._time_str
+
+    def _line(self, client, allowed, public=True, sent=0, received=0, session=0.0):
+        rng = self.rng
+        if rng.random() < self.proxy_protocol_ratio:
+            remote, proxy = DOCKER_GATEWAY, client
+        else:
+            remote, proxy = client, '-'
+        warn = '' if public else 'WARNING_PRIVATE_IP'
+        return (f'{remote}|proxy:{proxy}|final:{client}|public:{int(public)}|warn:{warn} '
+                f'[{self._time_local()}] TCP 200 {sent} {received} {session:.3f} '
+                f'whitelist:{int(allowed)} upstream:{UPSTREAM if allowed else "-"}')
+
+    def next_line(self):
+        rng = self.rng
+        if self._burst:
+            # 扫描器突发：间隔约为平时的 1/100，一两秒内的大量短连接
+            self.time += timedelta(seconds=rng.expovariate(self.rate * 100))
+            ip, remaining = self._burst[-1]
+            if remaining <= 1:
+                self._burst.pop()
+            else:
+                self._burst[-1] = (ip, remaining - 1)
+            return self._line(ip, False, received=rng.randrange(0, 65), session=rng.random() * 0.01)
+
+        self.time += timedelta(seconds=rng.expovariate(self.rate))
+        roll = rng.random()
+        if roll < self.allowed_ratio:
+            return self._line(rng.choice(self.clients), True, sent=rng.randrange(1000, 5000000),
+                              received=rng.randrange(500, 500000), session=rng.expovariate(1 / 60))
+        roll -= self.allowed_ratio
+        if roll < self.private_ratio:
+            return self._line(random_private_ipv4(rng), False, public=False, session=rng.random() * 0.01)
+        roll -= self.private_ratio
+        if roll < self.scanner_ratio / 200:
+            # 平均突发长度约 200 行，按比例触发
+            self._burst.append((rng.choice(self.scanners), rng.randrange(50, 350)))
+            return self.next_line()
+        return self._line(random_public_ipv4(rng), False, received=rng.randrange(0, 512),
+                          session=rng.random() * 0.5)
+
+    def lines(self, count):
+        """逐行生成 count 行日志"""
+        for _ in range(count):
+            yield self.next_line()
+
+    def chunks(self, count, size=100000):
+        """按 size 行一组生成 count 行日志（列表）"""
+        while count > 0:
+            n = min(size, count)
+            yield [self.next_line() for _ in range(n)]
+            count -= n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic proxy_enhanced stream log generator')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=200.0, help='平均每秒连接数')
+    parser.add_argument('--clients', type=int, default=5000, help='白名单客户端数量')
+    parser.add_argument('-o', '--output', help='输出文件，默认标准输出')
+    args = parser.parse_args()
+
+    # 默认让最后一行落在当前时间附近
+    start = datetime.now(timezone.utc) - timedelta(seconds=args.lines / args.rate)
+    generator = LogGenerator(seed=args.seed, start=start, rate=args.rate, clients=args.clients)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for chunk in generator.chunks(args.lines):
+            out.write('\n'.join(chunk))
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
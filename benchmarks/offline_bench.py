@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线基准测试：日志解析/写入、大数据库查询、白名单映射生成
+
+不需要运行中的服务，直接在临时目录中创建 DatabaseManager / ConnectionMonitor / WhitelistManager：
+- ingest：loggen 生成的 proxy_enhanced 日志经 parse_nginx_logs 解析后按批 record_connections 写入，
+  随后在该数据库上测量 get_connection_stats、get_blocked_ips、get_recent_connections
+- whitelist：写入 1k/10k/100k 条白名单后测量 generate_whitelist_map 和 update_nginx_config
+  （nginx 重载替换为空操作，只测量配置生成和写入）；--haproxy 时另外测量通过
+  HAProxy 运行时 API 替身服务器（haproxy_standin.py）的全量对账和单条增量推送
+结果以 JSON 输出，可用 benchmarks/compare.py 对比两次运行。
+
+用法:
+    python3 benchmarks/offline_bench.py --lines 1000000,10000000 --whitelist 1000,10000,100000 -o result.json
+"""
+
+import argparse
+import ipaddress
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'api'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+import app  # noqa: E402  导入没有副作用，不会读写 /data
+from geoip import GeoIPResolver, open_database  # noqa: E402
+from haproxy_runtime import HAProxyMapSync, RuntimeAPIClient  # noqa: E402
+from haproxy_standin import start_server  # noqa: E402
+from loggen import LogGenerator  # noqa: E402
+
+
+def timings(values):
+    """耗时列表（秒）的统计，单位毫秒"""
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.fmean(values) * 1000, 3),
+        'p50_ms': round(values[len(values) // 2] * 1000, 3),
+        'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3)
+    }
+
+
+def repeat(func, count):
+    """调用 func count 次，返回各次耗时（秒）"""
+    durations = []
+    for _ in range(count):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def open_db(path):
+    db_manager = app.DatabaseManager(path)
+    db_manager.init_database(admin_password='bench')
+    return db_manager
+
+
+def bench_ingest(workdir, lines, args):
+    """生成并写入 lines 行日志，返回解析、写入和查询的耗时"""
+    db_path = workdir / f'ingest-{lines}.db'
+    db_manager = open_db(db_path)
+    geoip = GeoIPResolver([open_database(path) for path in args.geoip])
+    monitor = app.ConnectionMonitor(db_manager, log_paths=[workdir / 'unused.log'],
+                                    batch_bytes=args.batch_bytes, geoip=geoip)
+
+    # 让最后一条日志落在当前时间附近，统计查询的“今天/最近24小时”范围内有数据
+    start = datetime.now(timezone.utc) - timedelta(seconds=lines / args.rate)
+    generator = LogGenerator(seed=args.seed, start=start, rate=args.rate)
+    parse_seconds = 0.0
+    record_durations = []
+    parsed = 0
+
+    for chunk in generator.chunks(lines, args.chunk_lines):
+        started = time.perf_counter()
+        connections = monitor.parse_nginx_logs(chunk)
+        parse_seconds += time.perf_counter() - started
+        parsed += len(connections)
+
+        # 与采集线程相同，按 batch_bytes 对应的行数分批写入
+        for offset in range(0, len(connections), args.batch_rows):
+            batch = connections[offset:offset + args.batch_rows]
+            started = time.perf_counter()
+            if not monitor.record_connections(batch):
+                raise RuntimeError('record_connections failed')
+            record_durations.append(time.perf_counter() - started)
+
+    record_seconds = sum(record_durations)
+    with db_manager.connection() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        blocked = conn.execute('SELECT COUNT(*) FROM blocked_ip_stats').fetchone()[0]
+        sample_ip = conn.execute(
+            'SELECT ip_address FROM blocked_ip_stats ORDER BY attempt_count DESC LIMIT 1'
+        ).fetchone()[0]
+
+    queries = {
+        'get_connection_stats': timings(repeat(monitor.get_connection_stats, args.query_repeat)),
+        'get_blocked_ips': timings(repeat(lambda: monitor.get_blocked_ips(limit=50), args.query_repeat)),
+        'get_blocked_ips_by_ip': timings(repeat(lambda: monitor.get_blocked_ips(limit=50, ip=sample_ip),
+                                                args.query_repeat)),
+        'get_blocked_ips_page_10': timings(repeat(lambda: page_through(monitor.get_blocked_ips, 10),
+                                                  args.query_repeat)),
+        'get_recent_connections': timings(repeat(lambda: monitor.get_recent_connections(limit=100),
+                                                 args.query_repeat)),
+        'get_recent_connections_denied': timings(repeat(
+            lambda: monitor.get_recent_connections(limit=100, status='denied'), args.query_repeat)),
+    }
+
+    result = {
+        'lines': lines,
+        'parsed': parsed,
+        'failed': monitor.parser.failed_lines,
+        'parse': {
+            'seconds': round(parse_seconds, 3),
+            'lines_per_sec': round(lines / parse_seconds) if parse_seconds else None
+        },
+        'record': dict(timings(record_durations), **{
+            'seconds': round(record_seconds, 3),
+            'rows_per_sec': round(parsed / record_seconds) if record_seconds else None,
+            'batch_rows': args.batch_rows
+        }),
+        'db_bytes': file_size(db_path),
+        'blocked_ips': blocked,
+        'queries': queries,
+        'geoip': geoip.status()
+    }
+    db_manager.close_all()
+    if not args.keep:
+        for suffix in ('', '-wal', '-shm', '.init.lock'):
+            Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+    return result
+
+
+def page_through(query, pages):
+    """按 next 令牌连续翻 pages 页"""
+    after = None
+    for _ in range(pages):
+        _, after = query(limit=50, after=after)
+        if after is None:
+            break
+
+
+def whitelist_entries(count, seed):
+    """生成 count 条不重复的白名单条目：单个 IPv4 为主，混合 IPv4 网段和 IPv6"""
+    rng = random.Random(seed)
+    entries = set()
+    while len(entries) < count:
+        roll = rng.random()
+        if roll < 0.7:
+            entries.add(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+        elif roll < 0.9:
+            prefix = rng.choice((16, 20, 24, 24, 24, 28))
+            entries.add(str(ipaddress.ip_network((rng.getrandbits(32), prefix), strict=False)))
+        elif roll < 0.97:
+            entries.add(str(ipaddress.IPv6Address((0x2 << 124) | rng.getrandbits(124))))
+        else:
+            entries.add(str(ipaddress.ip_network(((0x2 << 124) | rng.getrandbits(124), 48), strict=False)))
+    return sorted(entries)
+
+
+def bench_whitelist(workdir, count, args):
+    """写入 count 条白名单并测量映射生成和配置更新"""
+    size_dir = workdir / f'whitelist-{count}'
+    size_dir.mkdir()
+    db_manager = open_db(size_dir / 'users.db')
+    # 合并窗口足够长，写入过程中不会自动触发配置更新
+    manager = app.WhitelistManager(size_dir / 'whitelist.txt', db_manager, reload_window=3600,
+                                   reload_max_latency=3600, aggregate_cidr=args.aggregate_cidr)
+    manager._run_reload = lambda: None  # 不调用 reload-whitelist.sh / nginx
+
+    entries = whitelist_entries(count, args.seed)
+    insert_durations = []
+    for offset in range(0, count, 10000):
+        items = [{'ip': ip, 'description': f'bench {n}'} for n, ip in enumerate(entries[offset:offset + 10000])]
+        started = time.perf_counter()
+        result = manager.bulk_add_ips(items, user='bench')
+        insert_durations.append(time.perf_counter() - started)
+        if result['failed']:
+            raise RuntimeError(f"bulk_add_ips failed for {result['failed']} entries")
+
+    map_entries = manager.build_map_entries()
+    result = {
+        'entries': count,
+        'map_entries': len(map_entries),
+        'bulk_add_ips': dict(timings(insert_durations), seconds=round(sum(insert_durations), 3)),
+        'get_whitelist': timings(repeat(manager.get_whitelist, args.map_repeat)),
+        'build_map_entries': timings(repeat(manager.build_map_entries, args.map_repeat)),
+        'generate_whitelist_map': timings(repeat(manager.generate_whitelist_map, args.map_repeat)),
+        'update_nginx_config_applied': timings(repeat(lambda: manager.update_nginx_config(force=True),
+                                                      args.map_repeat)),
+        'update_nginx_config_unchanged': timings(repeat(manager.update_nginx_config, args.map_repeat)),
+        'map_bytes': file_size(manager.map_path),
+        'whitelist_bytes': file_size(manager.nginx_path)
+    }
+    if args.haproxy:
+        result['haproxy'] = bench_haproxy(size_dir, manager, entries, args)
+    db_manager.close_all()
+    return result
+
+
+def bench_haproxy(size_dir, manager, entries, args):
+    """HAProxy 运行时 API 同步（替身服务器）：全量对账和单条增量推送"""
+    map_name = str(size_dir / 'haproxy_whitelist.map')
+    server = start_server(f'unix:{size_dir}/haproxy.sock', [map_name])
+    sync = HAProxyMapSync(RuntimeAPIClient(f'unix:{size_dir}/haproxy.sock'), map_name,
+                          manager.build_haproxy_entries, save_entries=manager.save_haproxy_map)
+    manager.haproxy_sync = sync
+    try:
+        initial = repeat(sync.reconcile, 1)
+        connections = server.store.connections
+        unchanged = repeat(sync.reconcile, args.map_repeat)
+        sample = entries[len(entries) // 2]
+        pushes = []
+        for _ in range(args.query_repeat):
+            pushes.extend(repeat(lambda: sync.push(removed=[sample]), 1))
+            pushes.extend(repeat(lambda: sync.push(added=[sample]), 1))
+        return {
+            'reconcile_initial': dict(timings(initial), connections=connections),
+            'reconcile_unchanged': timings(unchanged),
+            'push_single': timings(pushes),
+            'map_bytes': file_size(map_name)
+        }
+    finally:
+        manager.haproxy_sync = None
+        server.shutdown()
+        server.server_close()
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()] if value else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline ingestion / query / whitelist map benchmark')
+    parser.add_argument('--lines', type=int_list, default=[1000000, 10000000], help='日志行数，逗号分隔')
+    parser.add_argument('--whitelist', type=int_list, default=[1000, 10000, 100000], help='白名单条目数，逗号分隔')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=200.0, help='合成日志的平均每秒连接数')
+    parser.add_argument('--chunk-lines', type=int, default=100000, help='每次生成和解析的行数')
+    parser.add_argument('--batch-rows', type=int, default=8000, help='每次 record_connections 写入的行数（约 1MB 日志）')
+    parser.add_argument('--batch-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--query-repeat', type=int, default=50)
+    parser.add_argument('--map-repeat', type=int, default=5)
+    parser.add_argument('--aggregate-cidr', action='store_true', help='生成映射时合并重叠/相邻网段')
+    parser.add_argument('--haproxy', action='store_true', help='同时测量通过 HAProxy 运行时 API（替身服务器）同步白名单')
+    parser.add_argument('--geoip', action='append', default=[], help='IP 归属库路径（.mmdb/.csv），可重复指定')
+    parser.add_argument('--workdir', help='数据库和配置文件目录，默认临时目录')
+    parser.add_argument('--keep', action='store_true', help='保留生成的数据库')
+    parser.add_argument('-o', '--output', help='结果文件，默认标准输出')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='mtproxy-bench-'))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    results = {'environment': environment(), 'args': {
+        key: value for key, value in vars(args).items() if key not in ('output', 'workdir', 'keep')
+    }, 'ingest': {}, 'whitelist': {}}
+    try:
+        for lines in args.lines:
+            print(f'ingest {lines} lines...', file=sys.stderr)
+            results['ingest'][str(lines)] = bench_ingest(workdir, lines, args)
+        for count in args.whitelist:
+            print(f'whitelist {count} entries...', file=sys.stderr)
+            results['whitelist'][str(count)] = bench_whitelist(workdir, count, args)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(results, out, indent=2, ensure_ascii=False)
+        out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
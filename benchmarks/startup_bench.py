@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+API 冷启动耗时基准测试
+
+每次在新的 Python 进程中依次测量：导入 app 模块、create_app()、首个需要数据库的请求（登录）、
+首次读取白名单，输出各阶段耗时的中位数（JSON）。分别测试全新数据目录（执行全部迁移）
+和已有数据库的重启（可用 --connections 预先写入大量连接日志）。
+
+用法:
+    python3 benchmarks/startup_bench.py --runs 5 --connections 1000000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+API_DIR = Path(__file__).resolve().parent.parent / 'api'
+
+# 在子进程中执行，输出各阶段耗时（秒）
+CHILD_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app({'DATA_DIR': sys.argv[1]}, start_services=False)
+created = time.perf_counter()
+client = app.app.test_client()
+token = client.post('/api/auth/login', json={'username': 'admin', 'password': 'bench'}).get_json()['token']
+logged_in = time.perf_counter()
+assert client.get('/api/whitelist', headers={'Authorization': 'Bearer ' + token}).status_code == 200
+listed = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_login': logged_in - created,
+    'first_whitelist': listed - logged_in,
+    'total': listed - started,
+    'services': app.services.build_seconds
+}))
+'''
+
+
+def run_child(data_dir):
+    env = dict(os.environ, ADMIN_PASSWORD='bench', PYTHONDONTWRITEBYTECODE='1')
+    env.pop('DATA_DIR', None)
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, str(data_dir)],
+        cwd=API_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def seed_connections(db_path, count, batch=100000):
+    """直接写入 count 条连接日志及对应的汇总数据"""
+    conn = sqlite3.connect(db_path)
+    for start in range(0, count, batch):
+        rows = [(f'10.{i % 250}.{i // 250 % 250}.{i % 97}', 'denied' if i % 3 else 'allowed',
+                 f'2026-01-{i % 28 + 1:02d} {i % 24:02d}:{i % 60:02d}:00', '外网', 'TCP')
+                for i in range(start, min(start + batch, count))]
+        conn.executemany(
+            'INSERT INTO connection_logs (ip_address, status, timestamp, location, protocol) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        conn.commit()
+    conn.execute('''
+        INSERT OR IGNORE INTO connection_stats_hour (bucket, status, count)
+        SELECT substr(timestamp, 1, 13), status, COUNT(*) FROM connection_logs GROUP BY 1, 2
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def median_phases(samples):
+    phases = ['import', 'create_app', 'first_login', 'first_whitelist', 'total']
+    return {phase: round(statistics.median(s[phase] for s in samples) * 1000, 2) for phase in phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API cold start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--connections', type=int, default=0, help='重启测试前写入的连接日志条数')
+    parser.add_argument('--keep', action='store_true', help='保留临时数据目录')
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp(prefix='mtproxy-startup-'))
+    try:
+        fresh = []
+        for n in range(args.runs):
+            fresh.append(run_child(base / f'fresh-{n}'))
+
+        data_dir = base / 'restart'
+        run_child(data_dir)
+        if args.connections:
+            seed_connections(data_dir / 'webapp' / 'users.db', args.connections)
+        restart = [run_child(data_dir) for _ in range(args.runs)]
+
+        json.dump({
+            'runs': args.runs,
+            'connections': args.connections,
+            'unit': 'ms',
+            'fresh': median_phases(fresh),
+            'restart': median_phases(restart),
+            'restart_services_ms': {name: round(seconds * 1000, 2)
+                                    for name, seconds in restart[-1]['services'].items()}
+        }, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write('\n')
+    finally:
+        if not args.keep:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
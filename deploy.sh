@@ -791,7 +791,7 @@ check_service_status() {
             print_warning "Nginx 进程未运行"
         fi
         print_info "2. 检查Flask API状态："
-        if docker-compose exec -T mtproxy-whitelist pgrep -f "python3.*app.py" >/dev/null 2>&1; then
+        if docker-compose exec -T mtproxy-whitelist pgrep -f "python3.*app.py|gunicorn" >/dev/null 2>&1; then
             print_success "Flask API 进程运行正常"
         else
             print_warning "Flask API 进程未运行"
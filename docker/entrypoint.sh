@@ -70,15 +70,34 @@ else
     export NGINX_WEB_PORT=8888
 fi
 
-# 设置PROXY Protocol端口
+# 设置PROXY Protocol端口（放行/拒绝端口接收HAProxy已判定白名单的连接）
 export PROXY_PROTOCOL_PORT=${PROXY_PROTOCOL_PORT:-445}
+export PROXY_PROTOCOL_DENY_PORT=${PROXY_PROTOCOL_DENY_PORT:-446}
+export PROXY_PROTOCOL_ALLOW_PORT=${PROXY_PROTOCOL_ALLOW_PORT:-447}
+
+# 内置白名单网关：STREAM_GATE=true 时由 gate.py 接管 stream 端口和 PROXY Protocol 端口，
+# nginx 的 stream 监听改为内部备用端口（仅标准模式，HAProxy 模式下由 HAProxy 判定白名单）
+export STREAM_GATE=${STREAM_GATE:-false}
+if [ "$STREAM_GATE" = "true" ]; then
+    if [ "${HAPROXY_ENABLED:-false}" = "true" ]; then
+        echo "⚠️  HAProxy 模式不支持 STREAM_GATE，继续使用 nginx stream"
+        STREAM_GATE=false
+    else
+        export GATE_LISTEN_PORT=${NGINX_STREAM_PORT}
+        export GATE_PROXY_PORT=${PROXY_PROTOCOL_PORT}
+        export NGINX_STREAM_PORT=${GATE_NGINX_STREAM_PORT:-14204}
+        export PROXY_PROTOCOL_PORT=${GATE_NGINX_PROXY_PORT:-14205}
+        echo "🔧 内置网关模式：gate 监听 ${GATE_LISTEN_PORT}(stream) + ${GATE_PROXY_PORT}(PROXY Protocol)"
+        echo "   nginx stream 改为内部备用端口 ${NGINX_STREAM_PORT} + ${PROXY_PROTOCOL_PORT}"
+    fi
+fi
 
 # 根据HAProxy模式选择nginx配置模板
 if [ "${HAPROXY_ENABLED:-false}" = "true" ]; then
     echo "🔧 使用HAProxy专用nginx配置模板"
     echo "   PROXY Protocol端口: ${PROXY_PROTOCOL_PORT}"
     # HAProxy模式：使用专用配置，只监听PROXY Protocol端口
-    envsubst '$WEB_PORT $MTPROXY_PORT $NGINX_STREAM_PORT $NGINX_WEB_PORT $PROXY_PROTOCOL_PORT' < /etc/nginx/nginx-haproxy.conf.template > /etc/nginx/nginx.conf
+    envsubst '$WEB_PORT $MTPROXY_PORT $NGINX_STREAM_PORT $NGINX_WEB_PORT $PROXY_PROTOCOL_PORT $PROXY_PROTOCOL_DENY_PORT $PROXY_PROTOCOL_ALLOW_PORT' < /etc/nginx/nginx-haproxy.conf.template > /etc/nginx/nginx.conf
 else
     echo "🔧 使用标准nginx配置模板"
     # 标准模式：使用通用配置
@@ -156,10 +175,16 @@ EOF
 fi
 
 # 启动API服务
-echo "启动Flask API..."
+# API_SERVER=gunicorn（默认）使用多 worker 模式，API_SERVER=flask 使用单进程开发服务器
 mkdir -p /var/log/api /var/log/mtproxy
 cd /opt/mtproxy-api
-python3 app.py > /var/log/api/stdout.log 2> /var/log/api/stderr.log &
+if [ "${API_SERVER:-gunicorn}" = "gunicorn" ] && command -v gunicorn >/dev/null 2>&1; then
+    echo "启动API (gunicorn, ${API_WORKERS:-2} workers)..."
+    gunicorn -c gunicorn.conf.py app:app > /var/log/api/stdout.log 2> /var/log/api/stderr.log &
+else
+    echo "启动Flask API..."
+    python3 app.py > /var/log/api/stdout.log 2> /var/log/api/stderr.log &
+fi
 API_PID=$!
 echo $API_PID > /run/api.pid
 sleep 3
@@ -189,6 +214,15 @@ MTPROXY_PID=$!
 echo $MTPROXY_PID > /run/mtproxy.pid
 sleep 5
 
+# 启动内置白名单网关（每个CPU核心一个进程，SO_REUSEPORT 共享端口）
+if [ "$STREAM_GATE" = "true" ]; then
+    echo "启动白名单网关 (${GATE_WORKERS:-CPU核心数} workers)..."
+    python3 /opt/mtproxy-api/gate.py --listen 0.0.0.0:${GATE_LISTEN_PORT} --proxy-listen 0.0.0.0:${GATE_PROXY_PORT} \
+        --upstream 127.0.0.1:444 > /var/log/api/gate.log 2>&1 &
+    GATE_PID=$!
+    echo $GATE_PID > /run/gate.pid
+fi
+
 # 启动Nginx
 echo "启动Nginx..."
 nginx -t && nginx
@@ -257,4 +291,8 @@ while true; do
         echo "❌ Nginx进程已停止，重新启动容器..."
         exit 1
     fi
+    if [ -n "$GATE_PID" ] && ! kill -0 $GATE_PID 2>/dev/null; then
+        echo "❌ 白名单网关已停止，重新启动容器..."
+        exit 1
+    fi
 done
\ No newline at end of file
@@ -69,30 +69,23 @@ EOF
         while IFS= read -r line || [[ -n "$line" ]]; do
             # 跳过空行和注释行
             if [[ -n "$line" && ! "$line" =~ ^[[:space:]]*# ]]; then
-                # 清理IP地址前后空格
-                local ip
-                ip=$(echo "$line" | xargs)
+                # 清理IP地址前后空格（使用参数展开，避免每行启动子进程）
+                local ip="$line"
+                ip="${ip#"${ip%%[![:space:]]*}"}"
+                ip="${ip%"${ip##*[![:space:]]}"}"
                 
                 if [[ -n "$ip" ]]; then
                     # 检查是否已经处理过这个IP（去重）
                     if [[ -z "${seen_ips[$ip]}" ]]; then
                         seen_ips[$ip]=1
                         
-                        # 调试：输出读取到的原始IP
-                        log "调试：从文件读取到IP: '$ip'"
-                        
                         # 处理IP并添加到映射文件
-                        echo "${ip} 1;" >> "$tmp_map"
+                        printf '%s 1;\n' "$ip"
                         ip_count=$((ip_count + 1))
-                        
-                        # 调试：确认写入的内容
-                        log "调试：写入映射文件: '${ip} 1;'"
-                    else
-                        log "调试：跳过重复IP: '$ip'"
                     fi
                 fi
             fi
-        done < "$WHITELIST_FILE"
+        done < "$WHITELIST_FILE" >> "$tmp_map"
     else
         log "警告: 白名单文件不存在: $WHITELIST_FILE"
     fi
@@ -7,11 +7,30 @@ export MTPROXY_PORT=${MTPROXY_PORT:-14202}
 export WEB_PORT=${WEB_PORT:-8787}
 export NGINX_WEB_PORT=${NGINX_WEB_PORT:-8787}
 export PROXY_PROTOCOL_PORT=${PROXY_PROTOCOL_PORT:-445}
+export PROXY_PROTOCOL_DENY_PORT=${PROXY_PROTOCOL_DENY_PORT:-446}
+export PROXY_PROTOCOL_ALLOW_PORT=${PROXY_PROTOCOL_ALLOW_PORT:-447}
+export HAPROXY_RUNTIME_SOCKET=${HAPROXY_RUNTIME_SOCKET:-/var/run/haproxy/admin.sock}
+export HAPROXY_WHITELIST_MAP=${HAPROXY_WHITELIST_MAP:-/var/run/haproxy/whitelist.map}
+
+# 白名单判定位置：默认由nginx根据映射文件判定；HAPROXY_WHITELIST=true 时由HAProxy判定，
+# 白名单变更通过运行时API生效，不需要重载nginx或HAProxy
+if [ "${HAPROXY_WHITELIST:-false}" = "true" ]; then
+    export HAPROXY_ALLOWED_BACKEND=mtproxy_allowed
+    export HAPROXY_DEFAULT_BACKEND=mtproxy_denied
+else
+    export HAPROXY_ALLOWED_BACKEND=mtproxy_backend
+    export HAPROXY_DEFAULT_BACKEND=mtproxy_backend
+fi
+
+# 映射文件与API容器共享，API每次对账后保存；首次启动时为空，由API启动后同步
+mkdir -p "$(dirname "${HAPROXY_RUNTIME_SOCKET}")" "$(dirname "${HAPROXY_WHITELIST_MAP}")"
+[ -f "${HAPROXY_WHITELIST_MAP}" ] || touch "${HAPROXY_WHITELIST_MAP}"
 
 echo "HAProxy启动配置："
 echo "  MTProxy端口: ${MTPROXY_PORT}"
 echo "  Web端口: ${WEB_PORT}"
 echo "  PROXY Protocol端口: ${PROXY_PROTOCOL_PORT}"
+echo "  HAProxy白名单判定: ${HAPROXY_WHITELIST:-false}"
 
 # 如果存在模板文件，则进行变量替换（使用 sed，避免依赖 envsubst）
 if [ -f "/usr/local/etc/haproxy/haproxy.cfg.template" ]; then
@@ -20,6 +39,12 @@ if [ -f "/usr/local/etc/haproxy/haproxy.cfg.template" ]; then
         -e "s|\${WEB_PORT}|${WEB_PORT}|g" \
         -e "s|\${NGINX_WEB_PORT}|${NGINX_WEB_PORT}|g" \
         -e "s|\${PROXY_PROTOCOL_PORT}|${PROXY_PROTOCOL_PORT}|g" \
+        -e "s|\${PROXY_PROTOCOL_DENY_PORT}|${PROXY_PROTOCOL_DENY_PORT}|g" \
+        -e "s|\${PROXY_PROTOCOL_ALLOW_PORT}|${PROXY_PROTOCOL_ALLOW_PORT}|g" \
+        -e "s|\${HAPROXY_RUNTIME_SOCKET}|${HAPROXY_RUNTIME_SOCKET}|g" \
+        -e "s|\${HAPROXY_WHITELIST_MAP}|${HAPROXY_WHITELIST_MAP}|g" \
+        -e "s|\${HAPROXY_ALLOWED_BACKEND}|${HAPROXY_ALLOWED_BACKEND}|g" \
+        -e "s|\${HAPROXY_DEFAULT_BACKEND}|${HAPROXY_DEFAULT_BACKEND}|g" \
         /usr/local/etc/haproxy/haproxy.cfg.template > /tmp/haproxy.cfg
     echo "HAProxy配置文件已生成: /tmp/haproxy.cfg"
 fi
@@ -56,6 +56,10 @@ case "${1:-reload}" in
         reload_nginx
         log "白名单重载完成"
         ;;
+    "nginx")
+        # 映射文件已由API生成，仅测试并重载nginx
+        reload_nginx
+        ;;
     "generate")
         log "仅生成映射文件..."
         generate_whitelist_map
@@ -66,8 +70,9 @@ case "${1:-reload}" in
         nginx -t
         ;;
     *)
-        echo "用法: $0 {reload|generate|test}"
+        echo "用法: $0 {reload|nginx|generate|test}"
         echo "  reload   - 生成映射文件并重载nginx (默认)"
+        echo "  nginx    - 仅测试并重载nginx (映射文件已生成时使用)"
         echo "  generate - 仅生成映射文件"
         echo "  test     - 测试nginx配置"
         exit 1
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+测试公共夹具：临时数据目录中的数据库和白名单管理器，以及 benchmarks/ 下的替身服务器
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'api'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+import app as appmod  # noqa: E402
+import haproxy_standin  # noqa: E402
+from haproxy_runtime import HAProxyMapSync, RuntimeAPIClient  # noqa: E402
+
+HAPROXY_MAP = '/etc/haproxy/whitelist.map'
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    manager = appmod.DatabaseManager(str(tmp_path / 'users.db'), pool_size=2)
+    manager.init_database(admin_password='test-password')
+    yield manager
+    manager.close_all()
+
+
+@pytest.fixture
+def make_whitelist_manager(tmp_path):
+    """创建独立数据库上的白名单管理器，nginx 重载只记录次数（manager.reloads）"""
+    managers = []
+    
+    def make(name='node', **kwargs):
+        root = tmp_path / name
+        (root / 'nginx').mkdir(parents=True, exist_ok=True)
+        db = appmod.DatabaseManager(str(root / 'users.db'), pool_size=2)
+        db.init_database(admin_password='test-password')
+        manager = appmod.WhitelistManager(root / 'nginx' / 'whitelist.txt', db, **kwargs)
+        manager.reloads = []
+        manager._run_reload = lambda: manager.reloads.append(manager.get_version()[0])
+        managers.append(manager)
+        return manager
+    
+    yield make
+    for manager in managers:
+        manager.db_manager.close_all()
+
+
+@pytest.fixture
+def whitelist_manager(make_whitelist_manager):
+    return make_whitelist_manager()
+
+
+@pytest.fixture
+def haproxy_server():
+    """HAProxy 运行时 API 替身服务器（本地 TCP 端口），server.store 为映射内容"""
+    server = haproxy_standin.start_server('127.0.0.1:0', [HAPROXY_MAP])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def haproxy_manager(make_whitelist_manager, haproxy_server):
+    """由 HAProxy 判定白名单的管理器（变更通过替身服务器的运行时 API 推送，不重载 nginx）"""
+    manager = make_whitelist_manager('haproxy', nginx_reload=False)
+    host, port = haproxy_server.server_address[:2]
+    manager.haproxy_sync = HAProxyMapSync(
+        RuntimeAPIClient(f'{host}:{port}', timeout=2.0), HAPROXY_MAP, manager.build_haproxy_entries
+    )
+    return manager
+
+
+@pytest.fixture
+def api_app(tmp_path, monkeypatch):
+    """临时数据目录上的 Flask 应用（不启动后台服务），nginx 重载只记录次数"""
+    monkeypatch.setattr(appmod, 'services', None)
+    saved_config = dict(appmod.app.config)
+    app = appmod.create_app(config={
+        'DATA_DIR': str(tmp_path / 'api'),
+        'ADMIN_PASSWORD': 'test-password',
+        'RELOAD_COALESCE_WINDOW': 0,
+        'TESTING': True
+    }, start_services=False)
+    manager = appmod.services.whitelist_manager
+    manager.reloads = []
+    manager._run_reload = lambda: manager.reloads.append(manager.get_version()[0])
+    yield app
+    appmod.services.db_manager.close_all()
+    appmod.app.config.clear()
+    appmod.app.config.update(saved_config)
+
+
+@pytest.fixture
+def client(api_app):
+    return api_app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    response = client.post('/api/auth/login', json={'username': 'admin', 'password': 'test-password'})
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
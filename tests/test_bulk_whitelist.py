@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""批量添加/移除白名单：逐项结果、批内重复和每批只更新一次版本"""
+
+import pytest
+
+from conftest import appmod
+
+
+@pytest.fixture
+def manager(api_app):
+    return appmod.services.whitelist_manager
+
+
+def bulk(client, auth_headers, action, items):
+    return client.post('/api/whitelist/bulk', json={'action': action, 'items': items}, headers=auth_headers)
+
+
+def changes(manager, version):
+    with manager.db_manager.connection() as conn:
+        rows = conn.execute('SELECT action, ip FROM whitelist_changes WHERE version = ? ORDER BY seq',
+                            (version,)).fetchall()
+    return [(row['action'], row['ip']) for row in rows]
+
+
+def test_bulk_add_reports_each_item(client, auth_headers, manager):
+    manager.add_ip('192.0.2.1')
+    version, _ = manager.get_version()
+    reloads = len(manager.reloads)
+    
+    response = bulk(client, auth_headers, 'add', [
+        '198.51.100.1',
+        {'ip': '198.51.100.7/24', 'description': 'office'},
+        '300.1.2.3',
+        '',
+        '192.0.2.1',
+        ' 198.51.100.1 ',
+        '2001:DB8:0::1',
+        {'ip': '2001:db8::1'},
+        'vpn.example.com',
+        {'ip': '203.0.113.5', 'expires_in': 'soon'},
+    ])
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert [(r['index'], r['ip'], r['success']) for r in data['results']] == [
+        (0, '198.51.100.1', True),
+        (1, '198.51.100.0/24', True),
+        (2, '300.1.2.3', False),
+        (3, '', False),
+        (4, '192.0.2.1', False),
+        (5, '198.51.100.1', False),
+        (6, '2001:db8::1', True),
+        (7, '2001:db8::1', False),
+        (8, 'vpn.example.com', True),
+        (9, '203.0.113.5', False),
+    ]
+    messages = {r['index']: r.get('message', '') for r in data['results']}
+    assert 'Invalid IP address' in messages[2]
+    assert messages[3] == 'IP address is required'
+    assert messages[4] == 'IP address already exists in whitelist'
+    assert messages[5] == messages[7] == 'Duplicate IP address in batch'
+    assert messages[9]
+    assert data['added'] == 4 and data['failed'] == 6
+    
+    # 整个批次一个版本、一次重载，变更日志只记录成功的条目
+    assert manager.get_version()[0] == version + 1
+    assert len(manager.reloads) == reloads + 1
+    assert changes(manager, version + 1) == [
+        ('add', '198.51.100.1'), ('add', '198.51.100.0/24'), ('add', '2001:db8::1'), ('add', 'vpn.example.com')
+    ]
+    assert manager.check_ip('198.51.100.200')['allowed']
+    assert not manager.check_ip('203.0.113.5')['allowed']
+    whitelist = {item['ip']: item for item in manager.get_whitelist()}
+    assert whitelist['198.51.100.0/24']['description'] == 'office'
+
+
+def test_bulk_remove_reports_each_item(client, auth_headers, manager):
+    data = bulk(client, auth_headers, 'add', ['192.0.2.1', '192.0.2.2', '198.51.100.0/24']).get_json()['data']
+    first_id = data['results'][0]['id']
+    version, _ = manager.get_version()
+    reloads = len(manager.reloads)
+    
+    response = bulk(client, auth_headers, 'remove', [
+        first_id,
+        '198.51.100.7/24',   # 按规范化后的网段匹配
+        first_id,            # 批内重复
+        '192.0.2.1',         # 与第一项是同一条目
+        '203.0.113.9',
+        999999,
+        '300.1.2.3',
+        True,
+        None,
+    ])
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert [r['success'] for r in data['results']] == [True, True, False, False, False, False, False, False, False]
+    assert data['results'][0]['ip'] == '192.0.2.1'
+    assert data['results'][1]['ip'] == '198.51.100.0/24'
+    messages = [r.get('message') for r in data['results']]
+    assert messages[2:6] == ['IP not found in whitelist'] * 4
+    assert 'Invalid IP address' in messages[6]
+    assert messages[7] == messages[8] == 'Item must be a whitelist id or an IP address'
+    assert data['removed'] == 2 and data['failed'] == 7
+    
+    assert manager.get_version()[0] == version + 1
+    assert len(manager.reloads) == reloads + 1
+    assert changes(manager, version + 1) == [('remove', '192.0.2.1'), ('remove', '198.51.100.0/24')]
+    assert [item['ip'] for item in manager.get_whitelist()] == ['192.0.2.2']
+    assert not manager.check_ip('192.0.2.1')['allowed']
+    assert manager.check_ip('192.0.2.2')['allowed']
+
+
+@pytest.mark.parametrize('action, items', [
+    ('add', ['300.1.2.3', '']),
+    ('remove', ['192.0.2.77', 12345]),
+])
+def test_failed_batch_keeps_version(client, auth_headers, manager, action, items):
+    version, _ = manager.get_version()
+    reloads = len(manager.reloads)
+    
+    data = bulk(client, auth_headers, action, items).get_json()['data']
+    assert data['failed'] == 2
+    assert data['reload_version'] is None
+    assert manager.get_version()[0] == version
+    assert len(manager.reloads) == reloads
+    assert changes(manager, version + 1) == []
+
+
+def test_bulk_request_validation(client, auth_headers, api_app, monkeypatch):
+    assert bulk(client, auth_headers, 'replace', ['192.0.2.1']).status_code == 400
+    assert bulk(client, auth_headers, 'add', []).status_code == 400
+    assert bulk(client, auth_headers, 'add', '192.0.2.1').status_code == 400
+    monkeypatch.setitem(api_app.config, 'WHITELIST_BULK_MAX_ITEMS', 2)
+    response = bulk(client, auth_headers, 'add', ['192.0.2.1', '192.0.2.2', '192.0.2.3'])
+    assert response.status_code == 400
+    assert 'max 2' in response.get_json()['message']
+    assert bulk(client, {}, 'add', ['192.0.2.1']).status_code == 401
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""白名单列表和导出的条件请求（ETag / If-Modified-Since）"""
+
+from datetime import timedelta
+
+from werkzeug.http import http_date
+
+from conftest import appmod
+
+
+def export_count():
+    with appmod.services.db_manager.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM operation_logs WHERE action = 'EXPORT_WHITELIST'").fetchone()[0]
+
+
+def test_etag_revalidation(client, auth_headers):
+    response = client.get('/api/whitelist/export', headers=auth_headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    
+    response = client.get('/api/whitelist/export', headers=dict(auth_headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    
+    client.post('/api/whitelist', json={'ip': '198.51.100.7'}, headers=auth_headers)
+    response = client.get('/api/whitelist/export', headers=dict(auth_headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_stale_etag_wins_over_if_modified_since(client, auth_headers):
+    etag = client.get('/api/whitelist', headers=auth_headers).headers['ETag']
+    client.post('/api/whitelist', json={'ip': '198.51.100.7'}, headers=auth_headers)
+    
+    # If-Modified-Since 晚于修改时间，但 ETag 已过期：以 ETag 为准
+    _, updated_at = appmod.services.whitelist_manager.get_version()
+    headers = dict(auth_headers, **{
+        'If-None-Match': etag,
+        'If-Modified-Since': http_date(updated_at + timedelta(seconds=10))
+    })
+    assert client.get('/api/whitelist', headers=headers).status_code == 200
+
+
+def test_if_modified_since_requires_strictly_later_second(client, auth_headers):
+    client.post('/api/whitelist', json={'ip': '198.51.100.7'}, headers=auth_headers)
+    _, updated_at = appmod.services.whitelist_manager.get_version()
+    
+    # 与最后修改时间同一秒：同一秒内可能还有修改，不能返回 304
+    same_second = dict(auth_headers, **{'If-Modified-Since': http_date(updated_at)})
+    assert client.get('/api/whitelist', headers=same_second).status_code == 200
+    
+    later = dict(auth_headers, **{'If-Modified-Since': http_date(updated_at + timedelta(seconds=1))})
+    assert client.get('/api/whitelist', headers=later).status_code == 304
+
+
+def test_export_logged_only_when_body_is_sent(client, auth_headers):
+    etag = client.get('/api/whitelist/export', headers=auth_headers).headers['ETag']
+    assert export_count() == 1
+    
+    for _ in range(3):
+        response = client.get('/api/whitelist/export', headers=dict(auth_headers, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+    assert export_count() == 1
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""SQLite 连接池"""
+
+import threading
+
+from conftest import appmod
+
+
+def make_db(tmp_path, pool_size):
+    db_manager = appmod.DatabaseManager(str(tmp_path / 'users.db'), pool_size=pool_size)
+    db_manager.init_database(admin_password='test-password')
+    return db_manager
+
+
+def test_idle_connections_are_reused(tmp_path):
+    db_manager = make_db(tmp_path, pool_size=2)
+    with db_manager.connection() as conn:
+        first = conn
+    with db_manager.connection() as conn:
+        assert conn is first
+    db_manager.close_all()
+
+
+def test_pool_keeps_at_most_pool_size_idle_connections(tmp_path):
+    db_manager = make_db(tmp_path, pool_size=2)
+    with db_manager.connection() as a, db_manager.connection() as b, db_manager.connection() as c:
+        borrowed = [a, b, c]
+    assert db_manager._pool.qsize() == 2
+    # 超出的连接归还时被关闭
+    closed = [conn for conn in borrowed if conn not in db_manager._pool.queue]
+    assert len(closed) == 1
+    db_manager.close_all()
+
+
+def test_pool_size_zero_closes_connections_on_return(tmp_path):
+    db_manager = make_db(tmp_path, pool_size=0)
+    borrowed = []
+    barrier = threading.Barrier(4)
+    
+    def worker():
+        with db_manager.connection() as conn:
+            conn.execute('SELECT 1')
+            borrowed.append(conn)
+            barrier.wait(5)
+    
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    
+    assert len(set(map(id, borrowed))) == 4
+    for conn in borrowed:
+        try:
+            conn.execute('SELECT 1')
+        except appmod.sqlite3.ProgrammingError:
+            continue
+        raise AssertionError('connection was kept open after return')
+    
+    with db_manager.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 1
+    db_manager.close_all()
+
+
+def test_open_transaction_is_rolled_back_on_return(tmp_path):
+    db_manager = make_db(tmp_path, pool_size=1)
+    with db_manager.connection() as conn:
+        conn.execute("INSERT INTO meta (key, value) VALUES ('uncommitted', '1')")
+    assert db_manager.get_meta('uncommitted') is None
+    db_manager.close_all()
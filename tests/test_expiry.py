@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""临时条目过期时间的解析和范围检查"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.mark.parametrize('expires_in', ['inf', '-inf', 'nan', '1e30', 1e400, 3650 * 86400 + 1])
+def test_out_of_range_expires_in_is_rejected(whitelist_manager, expires_in):
+    with pytest.raises(ValueError, match='expires_in'):
+        whitelist_manager.parse_expires_at(expires_in=expires_in)
+
+
+@pytest.mark.parametrize('expires_at', [
+    '9999-12-31T23:59:59',
+    '9999-12-31T23:59:59-01:00',  # 换算为UTC后超出 datetime.max
+    '2999-01-01T00:00:00Z',
+])
+def test_out_of_range_expires_at_is_rejected(whitelist_manager, expires_at):
+    with pytest.raises(ValueError):
+        whitelist_manager.parse_expires_at(expires_at=expires_at)
+
+
+def test_expiry_within_limit_is_rounded_up(whitelist_manager):
+    value = whitelist_manager.parse_expires_at(expires_in='90.5')
+    expires = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    assert timedelta(seconds=90) < expires - datetime.utcnow() <= timedelta(seconds=92)
+    
+    assert whitelist_manager.parse_expires_at(expires_in=3650 * 86400) is not None
+
+
+def test_add_ip_with_invalid_expiry_adds_nothing(whitelist_manager):
+    with pytest.raises(ValueError):
+        whitelist_manager.add_ip('198.51.100.7', expires_in='inf')
+    
+    result = whitelist_manager.bulk_add_ips([{'ip': '198.51.100.8', 'expires_in': 'nan'}, '198.51.100.9'])
+    assert [item['success'] for item in result['results']] == [False, True]
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""内置白名单网关：PROXY protocol 头解析和连接转发"""
+
+import asyncio
+import socket
+import struct
+
+import pytest
+
+import gate
+from gate import PROXY_V2_SIGNATURE, ProxyProtocolError, parse_proxy_header
+
+
+def proxy_v2(command=1, family=0x11, src='198.51.100.7', dst='192.0.2.1', extra=b''):
+    if family == 0x11:
+        addresses = socket.inet_pton(socket.AF_INET, src) + socket.inet_pton(socket.AF_INET, dst) + struct.pack('!HH', 50000, 443)
+    elif family == 0x21:
+        addresses = socket.inet_pton(socket.AF_INET6, src) + socket.inet_pton(socket.AF_INET6, dst) + struct.pack('!HH', 50000, 443)
+    else:
+        addresses = b''
+    body = addresses + extra
+    return PROXY_V2_SIGNATURE + struct.pack('!BBH', 0x20 | command, family, len(body)) + body
+
+
+@pytest.mark.parametrize('header, address', [
+    (b'PROXY TCP4 198.51.100.7 192.0.2.1 50000 443\r\n', '198.51.100.7'),
+    (b'PROXY TCP6 2001:db8::7 2001:db8::1 50000 443\r\n', '2001:db8::7'),
+    (b'PROXY UNKNOWN\r\n', None),
+    (b'PROXY UNKNOWN ffff:f::1 ffff:f::2 50000 443\r\n', None),
+])
+def test_v1_header(header, address):
+    assert parse_proxy_header(header + b'payload') == (len(header), address)
+
+
+@pytest.mark.parametrize('header, address', [
+    (proxy_v2(), '198.51.100.7'),
+    (proxy_v2(family=0x21, src='2001:db8::7', dst='2001:db8::1'), '2001:db8::7'),
+    (proxy_v2(extra=b'\x03\x00\x04abcd'), '198.51.100.7'),  # 附带 TLV
+    (proxy_v2(command=0, family=0x00), None),                # LOCAL
+    (proxy_v2(family=0x31), None),                           # AF_UNIX：使用 TCP 对端地址
+])
+def test_v2_header(header, address):
+    assert parse_proxy_header(bytearray(header + b'payload')) == (len(header), address)
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'PRO',
+    b'PROXY TCP4 198.51.100.7 192.0.2.1',
+    PROXY_V2_SIGNATURE[:5],
+    proxy_v2()[:20],
+])
+def test_partial_header_needs_more_data(data):
+    assert parse_proxy_header(data) is None
+
+
+@pytest.mark.parametrize('data', [
+    b'GET / HTTP/1.1\r\n',
+    b'\x16\x03\x01\x02\x00',                                    # 没有 PROXY 头的 TLS 握手
+    b'\r\n\r\n\x00\r\nQUIX\n' + b'\x00' * 8,                    # v2 签名错误
+    b'\r\nX',
+    b'PROXY TCP4 not-an-ip 192.0.2.1 50000 443\r\n',
+    b'PROXY TCP5 198.51.100.7 192.0.2.1 50000 443\r\n',
+    b'PROXY TCP4 198.51.100.7\r\n',
+    b'PROXY TCP4 ' + b'1' * 120,                                 # 超过 v1 最大长度仍没有 CRLF
+    PROXY_V2_SIGNATURE + b'\x11\x11\x00\x0c' + b'\x00' * 12,    # 版本号不是 2
+])
+def test_invalid_header_raises(data):
+    with pytest.raises(ProxyProtocolError):
+        parse_proxy_header(data)
+
+
+class Echo(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(data)
+    
+    def eof_received(self):
+        self.transport.close()
+
+
+async def exchange(port, payload, header=b''):
+    """连接网关，发送 header + payload，返回收到的全部数据（网关关闭连接时结束）"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(header)
+    await writer.drain()
+    received = bytearray()
+    
+    async def read():
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            received.extend(chunk)
+            if len(received) >= len(payload):
+                return
+    
+    reading = asyncio.ensure_future(read())
+    writer.write(payload)
+    await writer.drain()
+    await asyncio.wait_for(reading, 10)
+    writer.close()
+    return bytes(received)
+
+
+@pytest.fixture
+def gate_setup(whitelist_manager, tmp_path):
+    whitelist_manager.add_ip('198.51.100.7')
+    whitelist = gate.WhitelistSource(whitelist_manager.db_manager.db_path)
+    whitelist.refresh()
+    access_log = gate.AccessLog(tmp_path / 'gate_access.log')
+    return whitelist, access_log
+
+
+def test_relay_round_trip(gate_setup):
+    whitelist, access_log = gate_setup
+    payload = bytes(range(256)) * 8192  # 2 MiB，超过缓冲区大小，覆盖写缓冲未清空时更换接收缓冲区
+    
+    async def run():
+        loop = asyncio.get_running_loop()
+        upstream = await loop.create_server(Echo, '127.0.0.1', 0)
+        upstream_port = upstream.sockets[0].getsockname()[1]
+        relay = gate.Gate(whitelist, access_log, ('127.0.0.1', upstream_port), buffer_size=4096)
+        direct = await relay.listen('127.0.0.1', 0, reuse_port=False)
+        proxied = await relay.listen('127.0.0.1', 0, proxy_protocol=True, reuse_port=False)
+        direct_port = direct.sockets[0].getsockname()[1]
+        proxied_port = proxied.sockets[0].getsockname()[1]
+        try:
+            # 直接连接：对端 127.0.0.1 是默认放行条目
+            assert await exchange(direct_port, payload) == payload
+            # PROXY 头中的客户端地址在白名单中，头之后的数据原样转发
+            header = b'PROXY TCP4 198.51.100.7 192.0.2.1 50000 443\r\n'
+            assert await exchange(proxied_port, payload, header) == payload
+            assert await exchange(proxied_port, b'hello', proxy_v2()) == b'hello'
+            # 不在白名单中的地址被拒绝，不转发任何数据
+            assert await exchange(proxied_port, b'hello', proxy_v2(src='203.0.113.9')) == b''
+            # 没有 PROXY 头
+            assert await exchange(proxied_port, b'GET / HTTP/1.1\r\n\r\n') == b''
+            for _ in range(100):
+                if not relay.sessions:
+                    break
+                await asyncio.sleep(0.01)
+            assert not relay.sessions
+            assert relay.accepted == 5
+        finally:
+            for server in relay.servers + [upstream]:
+                server.close()
+    
+    asyncio.run(run())
+    access_log.close()
+    
+    lines = access_log.path.read_text().splitlines()
+    assert len(lines) == 5
+    # 按状态码和字节数区分各连接（会话结束的先后顺序不固定）
+    def find(*parts):
+        matched = [line for line in lines if all(part in line for part in parts)]
+        assert len(matched) == 1, (parts, lines)
+        return matched[0]
+    
+    find('|final:127.0.0.1|', f' 200 {len(payload)} {len(payload)} ')
+    find('|final:198.51.100.7|', f' 200 {len(payload)} {len(payload)} ', 'whitelist:1', 'upstream:127.0.0.1')
+    find('|final:198.51.100.7|', ' 200 5 5 ', 'whitelist:1')
+    find('|final:203.0.113.9|', ' 403 0 ', 'whitelist:0', 'upstream:-')
+    find(' 400 0 ', 'upstream:-')
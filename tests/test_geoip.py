@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+"""离线 IP 归属库：在临时目录中生成小型 MMDB 和 CSV 网段库"""
+
+import ipaddress
+import struct
+
+import pytest
+
+from geoip import CSVRangeDatabase, GeoIPResolver, MMDBReader, classify, open_database
+
+
+# ---- MaxMind DB 编码（只实现测试需要的部分）----
+
+def field(type_num, size, payload=b''):
+    """控制字节 + 扩展类型字节 + 长度扩展字节 + 数据"""
+    extended = b''
+    if type_num > 7:
+        extended = bytes([type_num - 7])
+        type_num = 0
+    if size < 29:
+        head, extra = size, b''
+    elif size < 285:
+        head, extra = 29, bytes([size - 29])
+    elif size < 65821:
+        head, extra = 30, (size - 285).to_bytes(2, 'big')
+    else:
+        head, extra = 31, (size - 65821).to_bytes(3, 'big')
+    return bytes([(type_num << 5) | head]) + extended + extra + payload
+
+
+def uint(type_num, value):
+    payload = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return field(type_num, len(payload), payload)
+
+
+def encode(value):
+    if isinstance(value, Raw):
+        return value.data
+    if isinstance(value, bool):
+        return field(14, int(value))
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        return field(2, len(data), data)
+    if isinstance(value, float):
+        return field(3, 8, struct.pack('>d', value))
+    if isinstance(value, bytes):
+        return field(4, len(value), value)
+    if isinstance(value, int):
+        return uint(6 if value < 2 ** 32 else 9, value)
+    if isinstance(value, dict):
+        return field(7, len(value), b''.join(encode(k) + encode(v) for k, v in value.items()))
+    if isinstance(value, list):
+        return field(11, len(value), b''.join(encode(item) for item in value))
+    raise TypeError(value)
+
+
+class Raw:
+    """已编码的字段（指针、指定宽度的整数等）"""
+    
+    def __init__(self, data):
+        self.data = data
+
+
+def pointer(target, size):
+    if size == 0:
+        return Raw(bytes([0x20 | (target >> 8), target & 0xFF]))
+    if size == 1:
+        value = target - 2048
+        return Raw(bytes([0x28 | (value >> 16)]) + (value & 0xFFFF).to_bytes(2, 'big'))
+    if size == 2:
+        value = target - 526336
+        return Raw(bytes([0x30 | (value >> 24)]) + (value & 0xFFFFFF).to_bytes(3, 'big'))
+    return Raw(bytes([0x38]) + target.to_bytes(4, 'big'))
+
+
+def build_tree(networks, ip_version):
+    """networks: [(网段, 数据偏移)]，返回节点列表 [左, 右]；记录为 ('node', n) / ('data', 偏移) / None（未收录）"""
+    nodes = [[None, None]]
+    bit_count = 32 if ip_version == 4 else 128
+    for network, data_offset in networks:
+        network = ipaddress.ip_network(network)
+        value = int(network.network_address)
+        depth = network.prefixlen
+        if network.version == 4 and ip_version == 6:
+            depth += 96  # IPv4 地址位于 ::/96 之下
+        node = 0
+        for i in range(depth):
+            bit = (value >> (bit_count - 1 - i)) & 1
+            if i == depth - 1:
+                nodes[node][bit] = ('data', data_offset)
+            else:
+                record = nodes[node][bit]
+                if record is None:
+                    nodes.append([None, None])
+                    record = nodes[node][bit] = ('node', len(nodes) - 1)
+                node = record[1]
+    return nodes
+
+
+def write_mmdb(path, networks, data, ip_version=6, record_size=24):
+    nodes = build_tree(networks, ip_version)
+    node_count = len(nodes)
+    
+    def record_value(record):
+        if record is None:
+            return node_count
+        if record[0] == 'node':
+            return record[1]
+        return node_count + 16 + record[1]
+    
+    tree = bytearray()
+    for left, right in nodes:
+        left, right = record_value(left), record_value(right)
+        if record_size == 24:
+            tree += left.to_bytes(3, 'big') + right.to_bytes(3, 'big')
+        elif record_size == 28:
+            tree += (left & 0xFFFFFF).to_bytes(3, 'big')
+            tree.append(((left >> 24) << 4) | (right >> 24))
+            tree += (right & 0xFFFFFF).to_bytes(3, 'big')
+        else:
+            tree += left.to_bytes(4, 'big') + right.to_bytes(4, 'big')
+    
+    metadata = encode({
+        'node_count': node_count,
+        'record_size': Raw(uint(5, record_size)),
+        'ip_version': Raw(uint(5, ip_version)),
+        'database_type': 'Test-DB',
+        'languages': ['en'],
+    })
+    path.write_bytes(bytes(tree) + b'\x00' * 16 + bytes(data) + MMDBReader.METADATA_MARKER + metadata)
+    return path
+
+
+LONG_TEXTS = {'short': 'x' * 28, 'size29': 'y' * 100, 'size30': 'z' * 1000, 'size31': 'w' * 70000}
+
+
+def build_data():
+    """数据区：三条记录在前，之后是指针目标（分别需要 1 / 2 / 3 / 4 字节的指针）"""
+    data = bytearray()
+    
+    # 记录中的指针指向固定偏移，记录写完后再把目标值放到这些偏移处
+    targets = [(1000, 'JP'), (4096, 'Example ISP'), (600000, 'DE'), (600100, dict(LONG_TEXTS))]
+    offsets = {value if isinstance(value, str) else 'texts': offset for offset, value in targets}
+    asn_record = encode({
+        'country': {'iso_code': pointer(offsets['JP'], 0)},
+        'autonomous_system_number': 64500,
+        'autonomous_system_organization': pointer(offsets['Example ISP'], 1),
+    })
+    data += asn_record
+    
+    second_offset = len(data)
+    extended_record = encode({
+        'registered_country': {'iso_code': pointer(offsets['DE'], 2), 'names': {'en': pointer(offsets['JP'], 3)}},
+        'uint16': Raw(uint(5, 443)),
+        'uint64': Raw(uint(9, 2 ** 40 + 1)),
+        'uint128': Raw(uint(10, 2 ** 100 + 7)),
+        'int32': Raw(field(8, 4, struct.pack('>i', -5))),
+        'double': 1.5,
+        'float': Raw(field(15, 4, struct.pack('>f', 0.25))),
+        'bytes': b'\x00\x01\x02',
+        'flags': [True, False],
+        'texts': pointer(offsets['texts'], 3),
+    })
+    data += extended_record
+    
+    third_offset = len(data)
+    data += encode({'country': {'iso_code': 'US'}, 'autonomous_system_number': 64501})
+    
+    for offset, value in targets:
+        assert len(data) <= offset
+        data += b'\x00' * (offset - len(data))
+        data += encode(value)
+    return data, (0, second_offset, third_offset)
+
+
+NETWORKS_V4 = ['81.2.69.0/24', '89.160.20.112/28']
+NETWORK_V6 = '2a02:cf40::/29'
+
+
+@pytest.fixture(params=[(6, 24), (6, 28), (6, 32), (4, 24)], ids=['v6-24', 'v6-28', 'v6-32', 'v4-24'])
+def mmdb(request, tmp_path):
+    ip_version, record_size = request.param
+    data, offsets = build_data()
+    networks = list(zip(NETWORKS_V4, offsets))
+    if ip_version == 6:
+        networks.append((NETWORK_V6, offsets[2]))
+    reader = MMDBReader(write_mmdb(tmp_path / 'test.mmdb', networks, data, ip_version, record_size))
+    yield reader
+    reader.close()
+
+
+def lookup(reader, ip):
+    return reader.lookup(ipaddress.ip_address(ip))
+
+
+def test_mmdb_metadata(mmdb):
+    assert mmdb.database_type == 'Test-DB'
+    assert mmdb.metadata['languages'] == ['en']
+
+
+def test_mmdb_lookup_follows_pointers(mmdb):
+    assert mmdb.enrich(ipaddress.ip_address('81.2.69.160')) == {
+        'country': 'JP', 'asn': 64500, 'as_org': 'Example ISP'
+    }
+    # 网段边界
+    assert lookup(mmdb, '81.2.69.0') == lookup(mmdb, '81.2.69.255')
+    assert lookup(mmdb, '81.2.68.255') is None
+    assert lookup(mmdb, '81.2.70.0') is None
+
+
+def test_mmdb_extended_types(mmdb):
+    record = lookup(mmdb, '89.160.20.120')
+    assert record['registered_country'] == {'iso_code': 'DE', 'names': {'en': 'JP'}}
+    assert record['uint16'] == 443
+    assert record['uint64'] == 2 ** 40 + 1
+    assert record['uint128'] == 2 ** 100 + 7
+    assert record['int32'] == -5
+    assert record['double'] == 1.5
+    assert record['float'] == 0.25
+    assert record['bytes'] == b'\x00\x01\x02'
+    assert record['flags'] == [True, False]
+    assert record['texts'] == LONG_TEXTS
+    assert mmdb.enrich(ipaddress.ip_address('89.160.20.127')) == {'country': 'DE', 'asn': None, 'as_org': None}
+    assert lookup(mmdb, '89.160.20.128') is None
+
+
+def test_mmdb_ipv6(mmdb):
+    if mmdb.ip_version == 4:
+        assert lookup(mmdb, '2a02:cf40::1') is None
+        return
+    assert mmdb.enrich(ipaddress.ip_address('2a02:cf47:ffff::1')) == {'country': 'US', 'asn': 64501, 'as_org': None}
+    assert lookup(mmdb, '2a02:cf48::1') is None
+    assert lookup(mmdb, '::1') is None
+
+
+def test_mmdb_rejects_other_files(tmp_path):
+    path = tmp_path / 'broken.mmdb'
+    path.write_bytes(b'not a database' * 10)
+    with pytest.raises(ValueError):
+        MMDBReader(path)
+
+
+CSV_TEXT = """network,country,asn,org
+# 注释行
+81.2.69.0/24,GB,AS64510,Example Transit
+89.160.20.0,89.160.20.127,SE,64511,
+2a02:cf40::,2a02:cf47:ffff:ffff:ffff:ffff:ffff:ffff,DE,,
+not-an-ip,XX,1,Broken
+8.8.8.0/24,US,,
+"""
+
+
+@pytest.fixture
+def csv_db(tmp_path):
+    path = tmp_path / 'ranges.csv'
+    path.write_text(CSV_TEXT, encoding='utf-8')
+    return open_database(path)
+
+
+def test_csv_range_lookup(csv_db):
+    assert isinstance(csv_db, CSVRangeDatabase)
+    assert len(csv_db) == 4
+    enrich = lambda ip: csv_db.enrich(ipaddress.ip_address(ip))
+    assert enrich('81.2.69.1') == {'country': 'GB', 'asn': 64510, 'as_org': 'Example Transit'}
+    assert enrich('89.160.20.127') == {'country': 'SE', 'asn': 64511, 'as_org': None}
+    assert enrich('8.8.8.8') == {'country': 'US', 'asn': None, 'as_org': None}
+    assert enrich('2a02:cf44::1')['country'] == 'DE'
+    # 首个网段之前、网段之间的空隙、最后一个网段之后
+    assert enrich('1.1.1.1') is None
+    assert enrich('81.2.70.0') is None
+    assert enrich('89.160.20.128') is None
+    assert enrich('200.0.0.1') is None
+    assert enrich('2001:4860::1') is None
+
+
+@pytest.mark.parametrize('ip, category', [
+    ('172.16.0.1', 'private'),
+    ('172.20.10.5', 'private'),
+    ('172.31.255.255', 'private'),
+    ('172.15.255.255', 'public'),
+    ('172.32.0.1', 'public'),
+    ('10.1.2.3', 'private'),
+    ('192.168.1.1', 'private'),
+    ('::ffff:172.16.5.4', 'private'),
+    ('127.0.0.1', 'loopback'),
+    ('::1', 'loopback'),
+    ('169.254.1.1', 'link_local'),
+    ('fe80::1', 'link_local'),
+    ('224.0.0.1', 'multicast'),
+    ('100.64.0.1', 'reserved'),
+    ('81.2.69.160', 'public'),
+])
+def test_classify(ip, category):
+    assert classify(ipaddress.ip_address(ip)) == category
+
+
+def test_resolver_combines_databases(tmp_path, csv_db):
+    data, offsets = build_data()
+    mmdb = MMDBReader(write_mmdb(tmp_path / 'test.mmdb', [('89.160.20.112/28', offsets[1])], data))
+    try:
+        resolver = GeoIPResolver([mmdb, csv_db], cache_size=2)
+        # MMDB 只有国家，ASN 取自 CSV
+        assert resolver.lookup('89.160.20.120')['location'] == 'DE AS64511'
+        assert resolver.lookup('81.2.69.1')['location'] == 'GB AS64510 Example Transit'
+        assert resolver.lookup('::ffff:81.2.69.1')['country'] == 'GB'
+        assert resolver.lookup('172.16.0.9')['location'] == '内网'
+        assert resolver.lookup('127.0.0.1')['location'] == '本地'
+        assert resolver.lookup('1.1.1.1')['location'] == '外网'
+        assert resolver.lookup('bogus')['location'] == '未知'
+        assert resolver.status()['cached'] == 2
+        resolver.lookup('bogus')
+        assert resolver.hits == 1
+    finally:
+        mmdb.close()
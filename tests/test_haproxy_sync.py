@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""HAProxy 运行时 API 增量推送与对账（使用 benchmarks/haproxy_standin.py 替身服务器）"""
+
+import pytest
+
+from conftest import HAPROXY_MAP, HAProxyMapSync, RuntimeAPIClient
+
+
+def map_keys(server):
+    return sorted(server.store.keys(HAPROXY_MAP))
+
+
+def test_removing_hostname_keeps_address_of_ip_entry(haproxy_manager, haproxy_server):
+    manager = haproxy_manager
+    manager.add_ip('198.51.100.7')
+    host_id = manager.add_ip('home.example.org')
+    manager.save_resolutions([(host_id, ['198.51.100.7', '198.51.100.8'], 60, None)])
+    assert '198.51.100.7' in map_keys(haproxy_server)
+    
+    manager.remove_ip(host_id)
+    
+    # 198.51.100.7 仍由IP条目放行，只有主机名独有的地址被删除
+    assert map_keys(haproxy_server) == ['198.51.100.7']
+    assert manager.check_ip('198.51.100.7')['allowed']
+
+
+def test_hostname_resolving_away_keeps_shared_address(haproxy_manager, haproxy_server):
+    manager = haproxy_manager
+    ip_id = manager.add_ip('198.51.100.7')
+    host_id = manager.add_ip('home.example.org')
+    manager.save_resolutions([(host_id, ['198.51.100.7'], 60, None)])
+    
+    manager.save_resolutions([(host_id, ['203.0.113.9'], 60, None)])
+    assert '198.51.100.7' in map_keys(haproxy_server)
+    assert '203.0.113.9' in map_keys(haproxy_server)
+    
+    # 最后一个对应该地址的条目移除后才删除
+    manager.remove_ip(ip_id)
+    assert '198.51.100.7' not in map_keys(haproxy_server)
+
+
+def test_removing_ip_entry_keeps_address_resolved_by_hostname(haproxy_manager, haproxy_server):
+    manager = haproxy_manager
+    host_id = manager.add_ip('home.example.org')
+    manager.save_resolutions([(host_id, ['198.51.100.7'], 60, None)])
+    manager.bulk_add_ips(['198.51.100.7', '10.0.0.0/8'])
+    
+    manager.bulk_remove_ips(['198.51.100.7', '10.0.0.0/8'])
+    
+    assert map_keys(haproxy_server) == ['198.51.100.7']
+
+
+def test_add_and_remove_push_increments_without_nginx_reload(haproxy_manager, haproxy_server):
+    manager = haproxy_manager
+    entry_id = manager.add_ip('198.51.100.7')
+    manager.bulk_add_ips(['203.0.113.0/24', '2001:db8::1'])
+    assert map_keys(haproxy_server) == sorted(['198.51.100.7', '203.0.113.0/24', '2001:db8::1'])
+    
+    manager.remove_ip(entry_id)
+    assert map_keys(haproxy_server) == sorted(['203.0.113.0/24', '2001:db8::1'])
+    assert manager.haproxy_sync.pushed == 4
+    assert manager.reloads == []
+
+
+def test_reconcile_repairs_drift(haproxy_manager, haproxy_server):
+    manager = haproxy_manager
+    sync = manager.haproxy_sync
+    manager.bulk_add_ips(['198.51.100.7', '198.51.100.8'])
+    
+    # 首次对账补齐默认条目
+    assert sync.reconcile() == {'added': 2, 'removed': 0}
+    desired = sorted(manager.build_haproxy_entries())
+    assert map_keys(haproxy_server) == desired
+    
+    # 模拟 HAProxy 中的偏差：丢失的条目、多余的条目和重复的条目
+    store = haproxy_server.store
+    store.execute(f'del map {HAPROXY_MAP} 198.51.100.7')
+    store.execute(f'add map {HAPROXY_MAP} 192.0.2.1 1')
+    store.execute(f'add map {HAPROXY_MAP} 198.51.100.8 1')
+    
+    assert sync.reconcile() == {'added': 2, 'removed': 2}
+    assert map_keys(haproxy_server) == desired
+    assert sync.reconcile() == {'added': 0, 'removed': 0}
+    assert sync.status()['map_entries'] == len(desired)
+
+
+def test_failed_push_is_repaired_by_reconcile(haproxy_manager, haproxy_server):
+    manager = haproxy_manager
+    sync = manager.haproxy_sync
+    sync.reconcile()
+    client = sync.client
+    
+    # HAProxy 不可达时推送失败，白名单修改仍然提交
+    sync.client = RuntimeAPIClient('127.0.0.1:1', timeout=0.5)
+    manager.add_ip('198.51.100.7')
+    assert sync.push_failures == 1 and sync.last_error.startswith('push:')
+    assert '198.51.100.7' not in map_keys(haproxy_server)
+    
+    sync.client = client
+    assert sync.reconcile() == {'added': 1, 'removed': 0}
+    assert '198.51.100.7' in map_keys(haproxy_server)
+    assert sync.last_error is None
+
+
+def test_reconcile_saves_map_file_when_haproxy_is_down(haproxy_manager, tmp_path):
+    manager = haproxy_manager
+    map_path = tmp_path / 'whitelist.map'
+    manager.haproxy_sync = HAProxyMapSync(
+        RuntimeAPIClient('127.0.0.1:1', timeout=0.5), str(map_path),
+        manager.build_haproxy_entries, save_entries=manager.save_haproxy_map
+    )
+    manager.add_ip('198.51.100.7')
+    
+    with pytest.raises(OSError):
+        manager.haproxy_sync.reconcile()
+    
+    lines = [line for line in map_path.read_text().splitlines() if not line.startswith('#')]
+    assert sorted(lines) == sorted(f'{key} 1' for key in manager.build_haproxy_entries())
+    assert manager.haproxy_sync.reconcile_failures == 1
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""主机名白名单条目的后台解析（替身解析器，不进行真实的 DNS 查询）"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import dns_standin
+from conftest import appmod
+
+
+class FakeResolver:
+    """按名称返回预设结果的解析器：records[名称] 为 (地址列表, TTL) 或要抛出的异常"""
+    
+    def __init__(self, records=None):
+        self.records = dict(records or {})
+        self.queries = []
+    
+    def resolve(self, hostname):
+        self.queries.append(hostname)
+        result = self.records[hostname]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def resolver():
+    return FakeResolver()
+
+
+def make_refresher(manager, resolver, min_ttl=0.0, max_ttl=3600.0):
+    # 不启动线程池，run_once() 在当前线程中依次解析
+    return appmod.HostnameRefresher(manager, resolver, min_ttl=min_ttl, max_ttl=max_ttl)
+
+
+def test_reresolution_reloads_only_when_addresses_change(whitelist_manager, resolver):
+    manager = whitelist_manager
+    resolver.records['home.example.org'] = (['198.51.100.7'], 0)
+    entry_id = manager.add_ip('home.example.org')
+    refresher = make_refresher(manager, resolver)
+    reloads = len(manager.reloads)
+    
+    refresher.run_once()
+    assert manager.check_ip('198.51.100.7')['allowed']
+    assert len(manager.reloads) == reloads + 1
+    
+    # TTL 为 0，每轮都重新解析；地址不变时不更新版本号、不重载
+    version = manager.get_version()[0]
+    refresher.run_once()
+    assert resolver.queries == ['home.example.org'] * 2
+    assert manager.get_version()[0] == version
+    assert len(manager.reloads) == reloads + 1
+    
+    resolver.records['home.example.org'] = (['198.51.100.8', '2001:db8::8'], 0)
+    refresher.run_once()
+    assert refresher.last_changed == 1
+    assert not manager.check_ip('198.51.100.7')['allowed']
+    assert manager.check_ip('198.51.100.8')['allowed']
+    assert manager.check_ip('2001:db8::8')['allowed']
+    assert len(manager.reloads) == reloads + 2
+    
+    manager.remove_ip(entry_id)
+    assert not manager.check_ip('198.51.100.8')['allowed']
+
+
+def test_one_reload_per_round(whitelist_manager, resolver):
+    manager = whitelist_manager
+    for index in range(5):
+        resolver.records[f'host{index}.example.org'] = ([f'198.51.100.{index + 1}'], 60)
+    manager.bulk_add_ips(list(resolver.records))
+    reloads = len(manager.reloads)
+    
+    make_refresher(manager, resolver).run_once()
+    
+    assert len(manager.reloads) == reloads + 1
+    assert all(manager.check_ip(f'198.51.100.{index + 1}')['allowed'] for index in range(5))
+
+
+def test_failure_keeps_previous_addresses_and_retries_after_min_ttl(whitelist_manager, resolver):
+    manager = whitelist_manager
+    resolver.records['home.example.org'] = (['198.51.100.7'], 3600)
+    manager.add_ip('home.example.org')
+    refresher = make_refresher(manager, resolver, min_ttl=60)
+    refresher.run_once()
+    
+    # TTL 到期后解析失败：保留上一次的地址，min_ttl 秒后重试
+    resolver.records['home.example.org'] = appmod.DNSError('timed out')
+    later = datetime.utcnow() + timedelta(seconds=3601)
+    results = [refresher.resolve(*item) for item in manager.get_due_hostnames(now=later)]
+    manager.save_resolutions(results, now=later)
+    
+    assert results[0][1] is None
+    assert manager.check_ip('198.51.100.7')['allowed']
+    assert manager.get_due_hostnames(now=later + timedelta(seconds=30)) == []
+    assert len(manager.get_due_hostnames(now=later + timedelta(seconds=60))) == 1
+
+
+def test_ttl_is_clamped(whitelist_manager, resolver):
+    refresher = make_refresher(whitelist_manager, resolver, min_ttl=60, max_ttl=600)
+    assert refresher.clamp_ttl(5) == 60
+    assert refresher.clamp_ttl(86400) == 600
+    assert refresher.clamp_ttl(None) == 600
+
+
+def test_refresh_through_dns_standin(whitelist_manager):
+    server = dns_standin.start_server('127.0.0.1:0', {'home.example.org': [('198.51.100.7', 0)]})
+    try:
+        resolver = appmod.create_resolver(f'127.0.0.1:{server.server_address[1]}', timeout=0.3)
+        manager = whitelist_manager
+        manager.add_ip('home.example.org')
+        refresher = make_refresher(manager, resolver)
+        
+        refresher.run_once()
+        assert manager.check_ip('198.51.100.7')['allowed']
+        
+        server.store.set('home.example.org', [('203.0.113.9', 0)])
+        refresher.run_once()
+        assert manager.check_ip('203.0.113.9')['allowed']
+        assert not manager.check_ip('198.51.100.7')['allowed']
+        
+        # 服务器无响应时保留上一次的地址
+        server.store.drop = True
+        refresher.run_once()
+        assert manager.check_ip('203.0.113.9')['allowed']
+        assert refresher.total_failed == 1
+    finally:
+        server.tcp_server.shutdown()
+        server.shutdown()
+        server.tcp_server.server_close()
+        server.server_close()
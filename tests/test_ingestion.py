@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""连接日志采集：读取游标、日志轮转和采集延迟"""
+
+import os
+
+import pytest
+
+from conftest import appmod
+
+LINE = ('10.0.0.2|proxy:-|final:198.51.100.{n}|public:-|warn:- [17/Oct/2026:18:00:00 +0800] '
+        'TCP 200 1024 2048 1.5 whitelist:1 upstream:127.0.0.1:444\n')
+
+
+@pytest.fixture
+def log_path(api_app, tmp_path, monkeypatch):
+    """API 应用采集的连接日志文件（在连接监控创建之前配置）"""
+    path = tmp_path / 'stream_access.log'
+    path.write_text(''.join(LINE.format(n=n) for n in range(3)))
+    monkeypatch.setitem(api_app.config, 'CONNECTION_LOG_FILES', str(path))
+    return path
+
+
+def test_follower_worker_reports_leader_cursor(client, auth_headers, log_path, monkeypatch):
+    # 本进程不是 leader：采集在其他进程中运行，游标由 leader 写入数据库
+    background = appmod.services.background_services
+    monkeypatch.setattr(background, 'started', True)
+    monkeypatch.setattr(background, 'is_leader', False)
+    monitor = appmod.services.connection_monitor  # 游标在创建时加载，之后由 leader 推进
+    assert monitor.get_ingestion_lag() == log_path.stat().st_size
+    
+    size = log_path.stat().st_size
+    with appmod.services.db_manager.connection() as conn:
+        conn.execute('INSERT INTO log_cursors (path, inode, offset) VALUES (?, ?, ?)',
+                     (str(log_path), os.stat(log_path).st_ino, size))
+        conn.commit()
+    
+    debug = client.get('/api/connections/recent', headers=auth_headers).get_json()['debug']
+    assert debug['cursors'][str(log_path)]['offset'] == size
+    assert debug['ingestion']['bytes_behind'] == 0
+    assert debug['ingestion']['seconds_behind'] == 0
+    
+    ingestion = client.get('/api/connections/ingestion', headers=auth_headers).get_json()['data']
+    assert ingestion['bytes_behind'] == 0
+
+
+def write_lines(path, numbers, mode='a'):
+    with open(path, mode) as f:
+        f.write(''.join(LINE.format(n=n) for n in numbers))
+
+
+def ingested(db_manager):
+    """已写入的连接（按日志行中的编号），用于检查没有丢失或重复"""
+    with db_manager.connection() as conn:
+        rows = conn.execute('SELECT ip_address FROM connection_logs ORDER BY id').fetchall()
+    return [int(row['ip_address'].rsplit('.', 1)[1]) for row in rows]
+
+
+def drain(monitor):
+    # 批次很小，每次只读两行：循环直到没有新数据
+    for _ in range(100):
+        if not monitor.update_connections():
+            return
+    raise AssertionError('ingestion did not settle')
+
+
+@pytest.fixture
+def make_monitor(db_manager, tmp_path):
+    path = tmp_path / 'stream_access.log'
+    
+    def make():
+        return appmod.ConnectionMonitor(db_manager, log_paths=[path], batch_bytes=len(LINE.format(n=10)) * 2)
+    
+    return path, make
+
+
+@pytest.mark.parametrize('restart', [False, True], ids=['open-handle', 'after-restart'])
+def test_rename_rotation(db_manager, make_monitor, restart):
+    path, make = make_monitor
+    write_lines(path, range(0, 3))
+    monitor = make()
+    drain(monitor)
+    assert ingested(db_manager) == [0, 1, 2]
+    
+    # 轮转前又写入了几行，尚未采集
+    write_lines(path, range(3, 8))
+    path.rename(path.with_name(path.name + '.1'))
+    write_lines(path, range(8, 11), mode='w')
+    
+    if restart:
+        # 重启后没有打开的旧文件句柄，按 inode 在同目录中找到轮转后的文件
+        monitor = make()
+    drain(monitor)
+    assert ingested(db_manager) == list(range(11))
+    
+    # 切换到新文件后继续追加
+    write_lines(path, range(11, 13))
+    drain(monitor)
+    assert ingested(db_manager) == list(range(13))
+    assert not monitor._handles.keys() - {(str(path), path.stat().st_ino)}
+
+
+@pytest.mark.parametrize('new_lines', [range(3, 5), range(3, 12)], ids=['shorter', 'longer'])
+def test_copytruncate_rotation(db_manager, make_monitor, new_lines):
+    path, make = make_monitor
+    write_lines(path, range(0, 3))
+    monitor = make()
+    drain(monitor)
+    inode = path.stat().st_ino
+    
+    # copytruncate：复制后原地截断，inode 不变；新内容比读取位置长时只能通过文件开头识别
+    path.with_name(path.name + '.1').write_bytes(path.read_bytes())
+    with open(path, 'r+') as f:
+        f.truncate(0)
+    write_lines(path, new_lines)
+    assert path.stat().st_ino == inode
+    
+    drain(monitor)
+    assert ingested(db_manager) == list(range(new_lines.stop))
+    
+    write_lines(path, [20])
+    drain(monitor)
+    assert ingested(db_manager) == list(range(new_lines.stop)) + [20]
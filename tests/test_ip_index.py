@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""白名单前缀索引：最长前缀匹配、删除和白名单变更后的增量更新"""
+
+import pytest
+
+from ip_index import PrefixIndex
+
+
+PROBES = [
+    '10.0.0.1', '10.1.2.3', '10.1.2.200', '10.1.3.1', '10.2.0.1', '192.0.2.10', '192.0.2.11',
+    '198.51.100.1', '203.0.113.5', '127.0.0.1', '::1', '2001:db8::1', '2001:db8:1::1',
+    '2001:db9::1', '::ffff:10.1.2.3', '::ffff:192.0.2.10', '::ffff:203.0.113.5'
+]
+
+
+def snapshot(index):
+    """索引内容（与插入顺序无关），用于比较增量更新和完整重建的结果"""
+    return {
+        version: {
+            prefixlen: {key: frozenset(values) for key, values in table.items()}
+            for prefixlen, table in tables.items()
+        }
+        for version, tables in index._tables.items()
+    }, dict(index._lengths), len(index)
+
+
+def test_longest_prefix_wins():
+    index = PrefixIndex.build([
+        ('10.0.0.0/8', 'wide'),
+        ('10.1.0.0/16', 'mid'),
+        ('10.1.2.0/24', 'narrow'),
+        ('10.1.2.3', 'host'),
+        ('2001:db8::/32', 'v6-wide'),
+        ('2001:db8::/48', 'v6-narrow'),
+    ])
+    assert index.lookup('10.1.2.3') == ('host', '10.1.2.3/32')
+    assert index.lookup('10.1.2.4') == ('narrow', '10.1.2.0/24')
+    assert index.lookup('10.1.3.1') == ('mid', '10.1.0.0/16')
+    assert index.lookup('10.200.0.1') == ('wide', '10.0.0.0/8')
+    assert index.lookup('11.0.0.1') is None
+    assert index.lookup('2001:db8::1') == ('v6-narrow', '2001:db8::/48')
+    assert index.lookup('2001:db8:1::1') == ('v6-wide', '2001:db8::/32')
+    assert index.lookup('2001:db9::1') is None
+    assert index.lookup_many(['10.1.2.3', '11.0.0.1']) == [('host', '10.1.2.3/32'), None]
+
+
+def test_default_route():
+    index = PrefixIndex.build([('0.0.0.0/0', 'any4'), ('192.0.2.0/24', 'doc')])
+    assert index.lookup('192.0.2.1') == ('doc', '192.0.2.0/24')
+    assert index.lookup('255.255.255.255') == ('any4', '0.0.0.0/0')
+    assert index.lookup('0.0.0.0') == ('any4', '0.0.0.0/0')
+    # IPv4 的 /0 不匹配原生 IPv6 地址，但匹配 IPv4 映射地址
+    assert index.lookup('2001:db8::1') is None
+    assert index.lookup('::ffff:8.8.8.8') == ('any4', '0.0.0.0/0')
+    
+    index.add('::/0', 'any6')
+    assert index.lookup('2001:db8::1') == ('any6', '::/0')
+    assert index.remove('0.0.0.0/0', 'any4')
+    assert index.lookup('8.8.8.8') is None
+
+
+def test_same_prefix_from_several_entries():
+    index = PrefixIndex.build([('192.0.2.0/24', 1), ('192.0.2.7/24', 2), ('192.0.2.0/24', 1)])
+    assert len(index) == 2  # 重复添加同一条目不计数，非严格网段按网络地址归一
+    assert index.lookup('192.0.2.99') == (1, '192.0.2.0/24')
+    
+    assert index.remove('192.0.2.0/24', 1)
+    assert index.lookup('192.0.2.99') == (2, '192.0.2.0/24')
+    assert not index.remove('192.0.2.0/24', 1)
+    assert not index.remove('192.0.2.0/25', 2)
+
+
+def test_remove_last_key_of_prefix_length():
+    index = PrefixIndex.build([('10.0.0.0/8', 'a'), ('10.1.0.0/16', 'b'), ('10.2.0.0/16', 'c')])
+    assert index._lengths[4] == (16, 8)
+    
+    assert index.remove('10.1.0.0/16', 'b')
+    assert index._lengths[4] == (16, 8)
+    assert index.remove('10.2.0.0/16', 'c')
+    # 该前缀长度的最后一个键被删除后，表和长度列表中都不再有 /16
+    assert 16 not in index._tables[4]
+    assert index._lengths[4] == (8,)
+    assert index.lookup('10.1.0.1') == ('a', '10.0.0.0/8')
+    
+    assert index.remove('10.0.0.0/8', 'a')
+    assert index._lengths[4] == () and index._tables[4] == {}
+    assert len(index) == 0
+    assert index.lookup('10.1.0.1') is None
+    
+    index.add('10.2.0.0/16', 'c')
+    assert index.lookup('10.2.3.4') == ('c', '10.2.0.0/16')
+
+
+def test_ipv4_mapped_fallback():
+    index = PrefixIndex.build([('192.0.2.0/24', 'v4'), ('::ffff:198.51.100.0/120', 'mapped')])
+    assert index.lookup('::ffff:192.0.2.10') == ('v4', '192.0.2.0/24')
+    # 原生 IPv6 条目优先，未命中时才按 IPv4 查询
+    assert index.lookup('::ffff:198.51.100.1') == ('mapped', '::ffff:c633:6400/120')
+    assert index.lookup('::ffff:203.0.113.1') is None
+    # 只有 ::ffff:0:0/96 才是 IPv4 映射地址
+    assert index.lookup('::192.0.2.10') is None
+    assert index.lookup('64:ff9b::192.0.2.10') is None
+
+
+@pytest.mark.parametrize('ip', ['', 'not-an-ip', '10.0.0', '10.0.0.256', '2001:db8::g', None])
+def test_invalid_address(ip):
+    with pytest.raises(ValueError):
+        PrefixIndex().lookup(ip)
+
+
+def test_incremental_updates_match_full_rebuild(whitelist_manager):
+    manager = whitelist_manager
+    manager.add_ip('10.0.0.0/8')
+    base_id = manager.add_ip('10.1.2.0/24')
+    index = manager.get_index()
+    
+    manager.add_ip('10.1.2.3')
+    manager.add_ip('2001:db8::/32')
+    manager.bulk_add_ips(['192.0.2.10', '192.0.2.11', '198.51.100.0/24', '2001:db8::/48'])
+    manager.remove_ip(base_id)
+    whitelist = {item['ip']: item['id'] for item in manager.get_whitelist()}
+    manager.bulk_remove_ips([whitelist['192.0.2.11'], '2001:db8::/48'])
+    
+    # 每次变更的版本号都连续，始终走增量路径，没有重建索引
+    assert manager._index is index
+    assert manager._index_version == manager.get_version()[0]
+    incremental = snapshot(index)
+    results = index.lookup_many(PROBES)
+    
+    manager._index = None
+    rebuilt = manager.get_index()
+    assert rebuilt is not index
+    assert snapshot(rebuilt) == incremental
+    assert rebuilt.lookup_many(PROBES) == results
+    assert index.lookup('10.1.2.200') == (whitelist['10.0.0.0/8'], '10.0.0.0/8')
+    assert index.lookup('::ffff:192.0.2.10') == (whitelist['192.0.2.10'], '192.0.2.10/32')
+
+
+def test_version_gap_drops_index(make_whitelist_manager):
+    node = make_whitelist_manager()
+    other = make_whitelist_manager()  # 共享同一数据库的另一个进程
+    node.add_ip('10.0.0.0/8')
+    assert node.get_index().lookup('192.0.2.1') is None
+    
+    other.add_ip('192.0.2.0/24')
+    node.add_ip('198.51.100.0/24')
+    # 版本跳过了另一个进程的变更：不能增量更新，丢弃索引等待重建
+    assert node._index is None
+    assert node.check_ip('192.0.2.1')['allowed']
+    assert node.check_ip('198.51.100.1')['allowed']
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""nginx stream 连接日志解析"""
+
+import pytest
+
+from log_parser import StreamLogParser
+
+ENHANCED = ('10.0.0.2|proxy:-|final:198.51.100.7|public:-|warn:- [17/Oct/2026:18:00:00 +0800] '
+            'TCP 200 1024 2048 1.5 whitelist:1 upstream:{}')
+
+
+@pytest.fixture
+def parser():
+    return StreamLogParser()
+
+
+@pytest.mark.parametrize('upstream, expected', [
+    ('127.0.0.1:444', '127.0.0.1:444'),
+    ('-', None),
+    ('127.0.0.1:444, 127.0.0.1:445', '127.0.0.1:444, 127.0.0.1:445'),
+    ('127.0.0.1:444, 127.0.0.1:445, 127.0.0.1:446', '127.0.0.1:444, 127.0.0.1:445, 127.0.0.1:446'),
+])
+def test_upstream_addresses(parser, upstream, expected):
+    connection = parser.parse_line(ENHANCED.format(upstream))
+    assert connection['upstream'] == expected
+    assert connection['ip'] == '198.51.100.7'
+    assert connection['timestamp'] == '2026-10-17 10:00:00'
+    assert connection['session_time'] == 1.5
+
+
+def test_regex_path_keeps_all_upstream_addresses(parser):
+    # 不带字节数和会话时长的行不走快速路径，由正则解析
+    line = '198.51.100.7 [17/Oct/2026:18:00:00 +0800] TCP 502 whitelist:1 upstream:127.0.0.1:444, 127.0.0.1:445'
+    connection = parser.parse_line(line)
+    assert connection['upstream'] == '127.0.0.1:444, 127.0.0.1:445'
+    assert connection['status_code'] == 502
+    assert connection['bytes_sent'] is None
+
+
+def test_fast_path_and_regex_agree(parser):
+    line = ENHANCED.format('127.0.0.1:444, 127.0.0.1:445')
+    assert parser.parse_line(line) == parser._parse_regex(line)
+    assert parser.failed_lines == 0
+
+
+def test_debug_format(parser):
+    line = '10.0.0.2|proxy:-|final:-|public:- [17/Oct/2026:18:00:00 +0000] TCP 200 whitelist:0 connection:42'
+    connection = parser.parse_line(line)
+    assert connection['ip'] == '10.0.0.2'
+    assert connection['status'] == 'denied'
+    assert connection['upstream'] is None
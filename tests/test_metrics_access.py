@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""/metrics 的访问限制（来源地址白名单和抓取令牌）"""
+
+
+def get_metrics(client, remote_addr, **kwargs):
+    return client.get('/metrics', environ_base={'REMOTE_ADDR': remote_addr}, **kwargs)
+
+
+def test_metrics_allowed_from_loopback(client):
+    assert get_metrics(client, '127.0.0.1').status_code == 200
+    assert get_metrics(client, '::1').status_code == 200
+    assert get_metrics(client, '::ffff:127.0.0.1').status_code == 200
+
+
+def test_metrics_denied_from_remote_address(client):
+    response = get_metrics(client, '203.0.113.5')
+    assert response.status_code == 403
+    assert b'mtproxy_' not in response.data
+
+
+def test_metrics_allow_list(client, api_app, monkeypatch):
+    monkeypatch.setitem(api_app.config, 'METRICS_ALLOW', '10.0.0.0/8, not-a-network')
+    assert get_metrics(client, '10.1.2.3').status_code == 200
+    assert get_metrics(client, '127.0.0.1').status_code == 403
+
+
+def test_metrics_token(client, api_app, monkeypatch):
+    monkeypatch.setitem(api_app.config, 'METRICS_TOKEN', 'scrape-secret')
+    headers = {'Authorization': 'Bearer scrape-secret'}
+    assert get_metrics(client, '203.0.113.5', headers=headers).status_code == 200
+    assert get_metrics(client, '203.0.113.5', headers={'Authorization': 'Bearer wrong'}).status_code == 403
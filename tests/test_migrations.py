@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""数据库迁移"""
+
+from conftest import appmod
+
+
+def index_names(db_manager, table):
+    with db_manager.connection() as conn:
+        return {row['name'] for row in conn.execute(f"PRAGMA index_list({table})")}
+
+
+def test_operation_log_ip_filter_uses_index(db_manager):
+    with db_manager.connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == appmod.DatabaseManager.SCHEMA_VERSION
+        plan = ' '.join(row['detail'] for row in conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT id, timestamp FROM operation_logs
+            WHERE ip_address = ? ORDER BY timestamp DESC, id DESC LIMIT 101
+        ''', ('203.0.113.5',)))
+    assert 'idx_operation_logs_ip_timestamp' in plan
+
+
+def test_upgrade_from_version_5_adds_ip_index(tmp_path):
+    path = str(tmp_path / 'users.db')
+    db_manager = appmod.DatabaseManager(path, pool_size=1)
+    db_manager.init_database(admin_password='test-password')
+    with db_manager.connection() as conn:
+        conn.execute('DROP INDEX idx_operation_logs_ip_timestamp')
+        conn.execute('PRAGMA user_version = 5')
+        conn.commit()
+    db_manager.close_all()
+    
+    db_manager = appmod.DatabaseManager(path, pool_size=1)
+    db_manager.init_database(admin_password='test-password')
+    try:
+        assert 'idx_operation_logs_ip_timestamp' in index_names(db_manager, 'operation_logs')
+    finally:
+        db_manager.close_all()
+
+
+def test_legacy_connection_times_converted_to_utc(tmp_path, monkeypatch):
+    path = str(tmp_path / 'users.db')
+    db_manager = appmod.DatabaseManager(path, pool_size=1)
+    db_manager.init_database(admin_password='test-password')
+    with db_manager.connection() as conn:
+        # 旧版本写入的时间：nginx $time_local（带偏移）、容器本地时间（带微秒）和新格式的UTC时间
+        conn.executemany("INSERT INTO connection_logs (ip_address, status, timestamp) VALUES (?, ?, ?)", [
+            ('198.51.100.7', 'denied', '2024-01-01 10:00:00+08:00'),
+            ('198.51.100.7', 'denied', '2024-01-01 10:30:00.123456'),
+            ('198.51.100.8', 'allowed', '2024-01-01 03:00:00'),
+        ])
+        conn.execute('''
+            INSERT INTO blocked_ip_stats (ip_address, attempt_count, first_attempt, last_attempt)
+            VALUES ('198.51.100.7', 2, '2024-01-01 10:00:00+08:00', '2024-01-01 10:30:00.123456')
+        ''')
+        conn.execute('PRAGMA user_version = 6')
+        conn.commit()
+    db_manager.close_all()
+    
+    # 旧数据写入时容器时区为 UTC+8
+    monkeypatch.setenv('TZ', 'Asia/Shanghai')
+    appmod.time.tzset()
+    try:
+        db_manager = appmod.DatabaseManager(path, pool_size=1)
+        db_manager.init_database(admin_password='test-password')
+    finally:
+        monkeypatch.undo()
+        appmod.time.tzset()
+    
+    try:
+        with db_manager.connection() as conn:
+            times = [row[0] for row in conn.execute('SELECT timestamp FROM connection_logs ORDER BY id')]
+            blocked = tuple(conn.execute('SELECT first_attempt, last_attempt FROM blocked_ip_stats').fetchone())
+            hours = dict(conn.execute('''
+                SELECT bucket, SUM(count) FROM connection_stats_hour GROUP BY bucket
+            ''').fetchall())
+        assert times == ['2024-01-01 02:00:00', '2024-01-01 02:30:00', '2024-01-01 03:00:00']
+        assert blocked == ('2024-01-01 02:00:00', '2024-01-01 02:30:00')
+        assert hours == {'2024-01-01 02': 2, '2024-01-01 03': 1}
+    finally:
+        db_manager.close_all()
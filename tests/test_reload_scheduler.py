@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""重载调度：失败后退避重试，成功应用前保持 dirty"""
+
+import threading
+
+import pytest
+
+from conftest import appmod
+
+
+class FlakyReload:
+    """前 failures 次调用失败的重载函数"""
+    
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self.done = threading.Event()
+    
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError('nginx -t failed')
+        self.done.set()
+        return True
+
+
+@pytest.fixture
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(appmod.ReloadScheduler, 'RETRY_BASE', 0.05)
+
+
+def test_failed_sync_reload_is_retried(fast_retry):
+    reload = FlakyReload(failures=2)
+    scheduler = appmod.ReloadScheduler(reload, window=0)
+    
+    with pytest.raises(RuntimeError):
+        scheduler.mark_dirty()
+    status = scheduler.status()
+    assert status['dirty'] and status['failures'] == 1
+    assert status['last_error'] == 'nginx -t failed'
+    
+    assert reload.done.wait(5)
+    status = scheduler.status()
+    assert reload.calls == 3
+    assert not status['dirty'] and status['failures'] == 0
+    assert status['applied_version'] == 1 and status['last_error'] is None
+
+
+def test_failed_batched_reload_is_retried(fast_retry):
+    reload = FlakyReload(failures=1)
+    scheduler = appmod.ReloadScheduler(reload, window=0.01, max_latency=0.05)
+    
+    scheduler.mark_dirty()
+    scheduler.mark_dirty()
+    
+    assert reload.done.wait(5)
+    status = scheduler.status()
+    assert reload.calls == 2
+    assert status['applied_version'] == 2 and not status['dirty']
+    assert status['reload_count'] == 1
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""主从复制：主节点为临时数据目录上的 Flask 应用，从节点为独立数据库上的白名单管理器，
+通过测试客户端请求主节点的 /api/whitelist/changes 和 /api/whitelist/snapshot"""
+
+import pytest
+
+from conftest import appmod
+
+TOKEN = 'replication-secret'
+
+
+class ClientFollower(appmod.ReplicationFollower):
+    """通过 Flask 测试客户端请求主节点的从节点"""
+    
+    def __init__(self, client, whitelist_manager, **kwargs):
+        super().__init__(whitelist_manager, 'http://primary', token=TOKEN, **kwargs)
+        self.client = client
+        self.requests = []
+    
+    def fetch(self, path, **params):
+        self.requests.append(path)
+        response = self.client.get(path, query_string=params, headers={'Authorization': f'Bearer {self.token}'})
+        if response.status_code != 200:
+            raise RuntimeError(f"{path}: HTTP {response.status_code} from primary")
+        return response.get_json()['data']
+
+
+@pytest.fixture
+def primary(api_app, monkeypatch):
+    monkeypatch.setitem(api_app.config, 'REPLICATION_TOKEN', TOKEN)
+    return appmod.services.whitelist_manager
+
+
+@pytest.fixture
+def follower_manager(make_whitelist_manager):
+    return make_whitelist_manager('follower')
+
+
+@pytest.fixture
+def follower(client, primary, follower_manager):
+    return ClientFollower(client, follower_manager)
+
+
+def active_entries(manager):
+    return {entry['ip']: entry['description'] for entry in manager.get_snapshot()['entries']}
+
+
+def add(client, auth_headers, ip, description=''):
+    response = client.post('/api/whitelist', json={'ip': ip, 'description': description}, headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['id']
+
+
+def test_follower_bootstraps_from_snapshot(client, auth_headers, primary, follower, follower_manager):
+    add(client, auth_headers, '198.51.100.7', 'office')
+    add(client, auth_headers, '203.0.113.0/24')
+    reloads = len(follower_manager.reloads)
+    
+    assert follower.sync_once() == 1
+    
+    assert follower.requests == ['/api/whitelist/snapshot', '/api/whitelist/changes']
+    assert follower.snapshots == 1
+    assert active_entries(follower_manager) == active_entries(primary)
+    assert follower_manager.get_replica_version() == primary.get_version()[0]
+    assert follower_manager.check_ip('203.0.113.9')['allowed']
+    assert len(follower_manager.reloads) == reloads + 1
+
+
+def test_follower_applies_deltas_one_reload_per_batch(client, auth_headers, primary, follower, follower_manager):
+    first = add(client, auth_headers, '198.51.100.7')
+    follower.sync_once()
+    reloads = len(follower_manager.reloads)
+    
+    response = client.post('/api/whitelist/bulk', json={'items': ['198.51.100.8', '198.51.100.9']},
+                           headers=auth_headers)
+    assert response.status_code == 200, response.get_json()
+    client.delete(f'/api/whitelist/{first}', headers=auth_headers)
+    add(client, auth_headers, '198.51.100.7', 'back again')
+    
+    assert follower.sync_once() == 1
+    assert follower.snapshots == 1  # 增量同步，不再拉取快照
+    assert active_entries(follower_manager) == active_entries(primary)
+    assert active_entries(follower_manager)['198.51.100.7'] == 'back again'
+    assert len(follower_manager.reloads) == reloads + 1
+    
+    # 没有新变更时不重载
+    assert follower.sync_once() == 0
+    assert len(follower_manager.reloads) == reloads + 1
+
+
+def test_follower_pages_through_changes(client, auth_headers, primary, follower_manager):
+    follower = ClientFollower(client, follower_manager, batch_size=1)
+    follower.sync_once()
+    for index in range(3):
+        add(client, auth_headers, f'198.51.100.{index + 1}')
+    
+    assert follower.sync_once() == 3
+    assert active_entries(follower_manager) == active_entries(primary)
+    assert follower_manager.get_replica_version() == primary.get_version()[0]
+
+
+def test_follower_ahead_of_primary_resyncs_from_snapshot(client, auth_headers, primary, follower, follower_manager):
+    add(client, auth_headers, '198.51.100.7')
+    follower.sync_once()
+    
+    # 主节点数据被重置（版本号回退）：从节点改为拉取全量快照
+    follower_manager.db_manager.set_meta('replica_version', str(primary.get_version()[0] + 100))
+    assert follower.sync_once() == 1
+    assert follower.snapshots == 2
+    assert active_entries(follower_manager) == active_entries(primary)
+
+
+def test_replication_endpoints_require_token(client):
+    assert client.get('/api/whitelist/snapshot').status_code == 401
+    response = client.get('/api/whitelist/changes?since=0', headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 401
+
+
+def test_follower_rejects_local_writes(client, auth_headers, api_app, monkeypatch):
+    entry_id = add(client, auth_headers, '198.51.100.7')
+    monkeypatch.setitem(api_app.config, 'REPLICATION_PRIMARY', 'http://primary')
+    
+    assert client.post('/api/whitelist', json={'ip': '198.51.100.8'}, headers=auth_headers).status_code == 409
+    assert client.delete(f'/api/whitelist/{entry_id}', headers=auth_headers).status_code == 409
+    assert client.post('/api/whitelist/bulk', json={'items': ['198.51.100.9']},
+                       headers=auth_headers).status_code == 409
+    # 读取不受影响
+    assert client.get('/api/whitelist', headers=auth_headers).status_code == 200
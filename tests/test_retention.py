@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""连接数据保留策略：分批删除过期行并归还空闲页"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import appmod
+
+
+def days_ago(days, fmt='%Y-%m-%d %H:%M:%S'):
+    return (datetime.utcnow() - timedelta(days=days)).strftime(fmt)
+
+
+@pytest.fixture
+def seeded(db_manager):
+    """原始日志 7 天、分钟汇总 30 天、小时汇总 365 天、变更日志 30 天；每张表都有过期和未过期的行"""
+    with db_manager.connection() as conn:
+        conn.executemany(
+            'INSERT INTO connection_logs (ip_address, status, timestamp, user_agent) VALUES (?, ?, ?, ?)',
+            [(f'198.51.100.{n % 250}', 'allowed', days_ago(10), 'x' * 500) for n in range(2000)]
+            + [(f'203.0.113.{n}', 'denied', days_ago(1), None) for n in range(30)]
+        )
+        # 过期和未过期的分钟桶状态相同，按 (bucket, status) 删除时不能误删
+        old_minutes = [days_ago(40, '%Y-%m-%d') + f' {h:02d}:{m:02d}' for h in range(5) for m in range(60)]
+        new_minutes = [days_ago(10, '%Y-%m-%d %H:%M'), days_ago(0, '%Y-%m-%d %H:%M')]
+        conn.executemany(
+            'INSERT INTO connection_stats_minute (bucket, status, count) VALUES (?, ?, 1)',
+            [(bucket, status) for bucket in old_minutes + new_minutes for status in ('allowed', 'denied')]
+        )
+        conn.executemany(
+            'INSERT INTO connection_stats_hour (bucket, status, count) VALUES (?, ?, 1)',
+            [(days_ago(days, '%Y-%m-%d %H'), status) for days in (400, 401, 100) for status in ('allowed', 'denied')]
+        )
+        conn.executemany(
+            'INSERT INTO connection_ip_stats (ip_address, connection_count, first_seen, last_seen) VALUES (?, 1, ?, ?)',
+            [('198.51.100.1', days_ago(500), days_ago(400)), ('198.51.100.2', days_ago(500), days_ago(10))]
+        )
+        conn.executemany(
+            'INSERT INTO blocked_ip_stats (ip_address, first_attempt, last_attempt) VALUES (?, ?, ?)',
+            [('203.0.113.1', days_ago(500), days_ago(400)), ('203.0.113.2', days_ago(500), days_ago(1))]
+        )
+        conn.executemany(
+            "INSERT INTO whitelist_changes (version, action, ip, created_at) VALUES (?, 'add', ?, ?)",
+            [(1, '10.0.0.1', days_ago(50)), (1, '10.0.0.2', days_ago(50)),
+             (2, '10.0.0.3', days_ago(40)), (3, '10.0.0.4', days_ago(1))]
+        )
+        conn.commit()
+    return db_manager
+
+
+def count(db_manager, table, where='1'):
+    with db_manager.connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}').fetchone()[0]
+
+
+def pragma(db_manager, name):
+    with db_manager.connection() as conn:
+        return conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+def test_prune_removes_only_expired_rows(seeded, monkeypatch):
+    monkeypatch.setattr(appmod.RetentionPruner, 'BATCH_PAUSE', 0)
+    pruner = appmod.RetentionPruner(seeded, batch_size=150)
+    
+    deleted = pruner.prune()
+    assert deleted == {
+        'connection_logs': 2000,
+        'connection_stats_minute': 600,
+        'connection_stats_hour': 4,
+        'connection_ip_stats': 1,
+        'blocked_ip_stats': 1,
+        'whitelist_changes': 3,
+    }
+    
+    assert count(seeded, 'connection_logs') == 30
+    assert count(seeded, 'connection_logs', "ip_address LIKE '203.0.113.%'") == 30
+    assert count(seeded, 'connection_stats_minute') == 4
+    assert count(seeded, 'connection_stats_hour') == 2
+    assert count(seeded, 'connection_stats_hour', f"bucket = '{days_ago(100, '%Y-%m-%d %H')}'") == 2
+    assert count(seeded, 'connection_ip_stats', "ip_address = '198.51.100.2'") == 1
+    assert count(seeded, 'blocked_ip_stats', "ip_address = '203.0.113.2'") == 1
+    assert count(seeded, 'connection_ip_stats') == count(seeded, 'blocked_ip_stats') == 1
+    
+    # 变更日志按完整版本删除，起点推进到最后删除的版本
+    assert count(seeded, 'whitelist_changes') == 1
+    with seeded.connection() as conn:
+        assert conn.execute("SELECT value FROM meta WHERE key = 'changelog_start'").fetchone()[0] == '2'
+    
+    # 再次执行没有可删除的行
+    assert pruner.prune() == {}
+    assert pruner.total_deleted['connection_logs'] == 2000
+
+
+def test_prune_returns_free_pages(seeded, monkeypatch):
+    monkeypatch.setattr(appmod.RetentionPruner, 'BATCH_PAUSE', 0)
+    monkeypatch.setattr(appmod.RetentionPruner, 'VACUUM_PAGES_PER_STEP', 50)  # 分多步归还
+    assert pragma(seeded, 'auto_vacuum') == 2  # INCREMENTAL
+    pages_before = pragma(seeded, 'page_count')
+    
+    pruner = appmod.RetentionPruner(seeded, batch_size=500)
+    pruner.prune()
+    
+    assert pruner.vacuumed_pages > 50
+    assert pragma(seeded, 'freelist_count') == 0
+    assert pragma(seeded, 'page_count') <= pages_before - pruner.vacuumed_pages
+    assert seeded.get_storage_info()['freelist_count'] == 0
+
+
+def test_zero_days_keeps_everything(seeded):
+    pruner = appmod.RetentionPruner(seeded, raw_days=0, minute_days=0, hour_days=0, changelog_days=0)
+    assert pruner.prune() == {}
+    assert count(seeded, 'connection_logs') == 2030
+    assert count(seeded, 'whitelist_changes') == 4
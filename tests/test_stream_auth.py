@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""实时事件流的票据认证：URL 中只接受短期票据，不接受登录 token"""
+
+
+def get_ticket(client, auth_headers):
+    response = client.post('/api/connections/stream/ticket', headers=auth_headers)
+    assert response.status_code == 200
+    return response.get_json()['ticket']
+
+
+def open_stream(client, **kwargs):
+    response = client.get('/api/connections/stream', buffered=False, **kwargs)
+    first = next(response.response) if response.status_code == 200 else None
+    response.close()
+    return response.status_code, first
+
+
+def test_stream_accepts_ticket(client, auth_headers):
+    status, first = open_stream(client, query_string={'ticket': get_ticket(client, auth_headers)})
+    assert status == 200
+    assert first.startswith(b'retry:')
+
+
+def test_stream_rejects_login_token_in_query(client, auth_headers):
+    token = auth_headers['Authorization'][len('Bearer '):]
+    assert open_stream(client, query_string={'token': token})[0] == 401
+    assert open_stream(client, query_string={'ticket': token})[0] == 401
+
+
+def test_stream_accepts_authorization_header(client, auth_headers):
+    assert open_stream(client, headers=auth_headers)[0] == 200
+
+
+def test_ticket_requires_login(client):
+    assert client.post('/api/connections/stream/ticket').status_code == 401
+
+
+def test_ticket_is_single_purpose(client, auth_headers):
+    ticket = get_ticket(client, auth_headers)
+    response = client.get('/api/whitelist', headers={'Authorization': f'Bearer {ticket}'})
+    assert response.status_code == 401
+
+
+def test_expired_ticket_is_rejected(client, auth_headers, api_app, monkeypatch):
+    monkeypatch.setitem(api_app.config, 'SSE_TICKET_TTL', -1)
+    assert open_stream(client, query_string={'ticket': get_ticket(client, auth_headers)})[0] == 401
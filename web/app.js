@@ -12,6 +12,9 @@ class MTProxyManager {
         this.connectionStats = {};
         this.monitoringEnabled = true;
         this.monitorInterval = null;
+        this.eventSource = null;
+        this.streamAttempt = 0; // 每次建立或关闭事件流时递增，丢弃过时的票据请求
+        this.maxConnections = 100; // 实时视图最多保留的连接记录数
         this.currentTab = 'recent';
         
         this.init();
@@ -119,6 +122,7 @@ class MTProxyManager {
     }
     
     handleLogout() {
+        this.stopConnectionStream();
         this.token = null;
         this.currentUser = null;
         localStorage.removeItem('authToken');
@@ -146,9 +150,12 @@ class MTProxyManager {
     async handleAddIP() {
         const ipInput = document.getElementById('ip-input');
         const descriptionInput = document.getElementById('description-input');
+        const expiryInput = document.getElementById('expiry-input');
         
         const ip = ipInput.value.trim();
         const description = descriptionInput.value.trim();
+        // 有效期（秒），为空表示永久有效，到期后由服务端自动移除
+        const expiresIn = expiryInput.value ? Number(expiryInput.value) : null;
         
         if (!ip) {
             this.showNotification('请输入IP地址', 'error');
@@ -163,7 +170,8 @@ class MTProxyManager {
         try {
             const response = await this.apiCall('POST', '/whitelist', {
                 ip,
-                description
+                description,
+                expires_in: expiresIn
             });
             
             if (response.success) {
@@ -174,6 +182,7 @@ class MTProxyManager {
                 // 清空表单
                 ipInput.value = '';
                 descriptionInput.value = '';
+                expiryInput.value = '';
             } else {
                 this.showNotification(response.message || 'IP添加失败', 'error');
             }
@@ -228,10 +237,15 @@ class MTProxyManager {
             return true;
         }
         
-        return false;
+        // 主机名（动态DNS），由服务端在后台解析
+        const hostnameRegex = /^(?=.{1,253}\.?$)([a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z][a-zA-Z0-9-]*[a-zA-Z0-9]\.?$/;
+        return hostnameRegex.test(ip);
     }
     
     getIPType(ip) {
+        if (/[a-zA-Z]/.test(ip) && !ip.includes(':')) {
+            return 'hostname';
+        }
         if (ip.includes(':')) {
             return ip.includes('/') ? 'range' : 'ipv6';
         } else {
@@ -257,17 +271,25 @@ class MTProxyManager {
             const typeLabel = {
                 'ipv4': 'IPv4',
                 'ipv6': 'IPv6',
-                'range': '网段'
+                'range': '网段',
+                'hostname': '域名'
             }[type];
+            // 主机名条目显示后台解析得到的地址
+            const resolved = type === 'hostname'
+                ? `<br><small class="form-hint">${(item.addresses || []).join(', ') || (item.resolve_error ? '解析失败' : '等待解析')}</small>`
+                : '';
             
             return `
                 <tr>
-                    <td class="col-ip">${item.ip}</td>
+                    <td class="col-ip">${item.ip}${resolved}</td>
                     <td class="col-type">
                         <span class="type-badge ${typeClass}">${typeLabel}</span>
                     </td>
                     <td class="col-description">${item.description || '-'}</td>
-                    <td class="col-added">${this.formatDate(item.created_at)}</td>
+                    <td class="col-added">
+                        ${this.formatDate(item.created_at)}
+                        ${item.expires_at ? `<br><small class="form-hint">到期: ${this.formatDate(item.expires_at.replace(' ', 'T') + 'Z')}</small>` : ''}
+                    </td>
                     <td class="col-actions">
                         <button class="delete-btn" onclick="app.handleDeleteIP('${item.id}')">
                             删除
@@ -447,12 +469,155 @@ class MTProxyManager {
     // 连接监控相关方法
     async startConnectionMonitoring() {
         await this.loadConnectionData();
-        if (this.monitoringEnabled) {
-            this.monitorInterval = setInterval(() => {
-                if (this.monitoringEnabled) {
-                    this.loadConnectionData();
+        if (!this.monitoringEnabled) return;
+        
+        // 优先使用服务器推送的实时事件，不支持时退回轮询
+        if (window.EventSource) {
+            this.startConnectionStream();
+        } else {
+            this.startPolling();
+        }
+    }
+    
+    startPolling() {
+        if (this.monitorInterval) return;
+        this.monitorInterval = setInterval(() => {
+            if (this.monitoringEnabled) {
+                this.loadConnectionData();
+            }
+        }, 10000); // 每10秒更新一次
+    }
+    
+    async startConnectionStream() {
+        this.stopConnectionStream();
+        const attempt = this.streamAttempt;
+        
+        // URL 中只传递短期的事件流票据，登录 token 不出现在 URL 中
+        let ticket;
+        try {
+            ticket = (await this.apiCall('POST', '/connections/stream/ticket')).ticket;
+        } catch (error) {
+            if (attempt === this.streamAttempt && this.monitoringEnabled) {
+                this.startPolling();
+            }
+            return;
+        }
+        if (attempt !== this.streamAttempt || !this.monitoringEnabled) return;
+        
+        const url = `${this.apiBase}/connections/stream?ticket=${encodeURIComponent(ticket)}`;
+        const source = new EventSource(url);
+        this.eventSource = source;
+        let opened = false;
+        source.onopen = () => { opened = true; };
+        
+        source.addEventListener('connections', (event) => {
+            this.appendConnections(JSON.parse(event.data).items || []);
+        });
+        
+        source.addEventListener('stats', (event) => {
+            this.applyStatsDelta(JSON.parse(event.data));
+        });
+        
+        // 服务器丢弃了部分事件（客户端处理过慢），重新加载完整数据
+        source.addEventListener('reset', () => this.loadConnectionData());
+        
+        // token 过期，交给接口调用触发重新登录
+        source.addEventListener('expired', () => {
+            this.stopConnectionStream();
+            this.checkAuth();
+        });
+        
+        source.onerror = () => {
+            if (source.readyState !== EventSource.CLOSED || source !== this.eventSource) return;
+            this.eventSource = null;
+            if (!this.monitoringEnabled) return;
+            if (opened) {
+                // 已建立的连接断开后浏览器用原票据重连，票据过期时被拒绝：重新获取票据
+                setTimeout(() => {
+                    if (attempt === this.streamAttempt && this.monitoringEnabled) {
+                        this.startConnectionStream();
+                    }
+                }, 5000);
+            } else {
+                // 连接无法建立时（如服务不支持或并发过多）退回轮询
+                this.startPolling();
+            }
+        };
+    }
+    
+    stopConnectionStream() {
+        this.streamAttempt++;
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+        if (this.monitorInterval) {
+            clearInterval(this.monitorInterval);
+            this.monitorInterval = null;
+        }
+    }
+    
+    appendConnections(items) {
+        if (items.length === 0) return;
+        
+        // 新记录在前，只插入新增的行，超出上限的旧行从末尾移除
+        const newest = items.slice().reverse();
+        const hadConnections = this.connections.length > 0;
+        this.connections = newest.concat(this.connections).slice(0, this.maxConnections);
+        
+        newest.filter(conn => conn.status === 'denied').forEach(conn => this.updateBlockedIP(conn));
+        
+        if (this.currentTab === 'recent') {
+            const tbody = document.getElementById('connections-tbody');
+            if (!hadConnections) {
+                this.renderConnections();
+            } else {
+                tbody.insertAdjacentHTML('afterbegin', newest.slice(0, this.maxConnections).map(conn => this.connectionItemHtml(conn)).join(''));
+                while (tbody.children.length > this.maxConnections) {
+                    tbody.removeChild(tbody.lastElementChild);
                 }
-            }, 10000); // 每10秒更新一次
+            }
+        }
+        if (this.currentTab === 'blocked') {
+            this.renderBlockedIPs();
+        }
+    }
+    
+    updateBlockedIP(conn) {
+        const index = this.blockedIPs.findIndex(item => item.ip === conn.ip);
+        if (index >= 0) {
+            const item = this.blockedIPs[index];
+            item.attempt_count += 1;
+            item.last_attempt = conn.timestamp;
+            this.blockedIPs.splice(index, 1);
+            this.blockedIPs.unshift(item);
+        } else {
+            this.blockedIPs.unshift({
+                ip: conn.ip,
+                attempt_count: 1,
+                first_attempt: conn.timestamp,
+                last_attempt: conn.timestamp,
+                location: conn.location
+            });
+        }
+    }
+    
+    applyStatsDelta(delta) {
+        const stats = this.connectionStats;
+        stats.allowed_today = (stats.allowed_today || 0) + delta.allowed;
+        stats.denied_today = (stats.denied_today || 0) + delta.denied;
+        stats.total_connections = (stats.total_connections || 0) + delta.allowed + delta.denied;
+        
+        // 计入当前小时（统计按UTC小时）
+        const hour = stats.hourly_data && stats.hourly_data.find(item => item.hour === new Date().getUTCHours());
+        if (hour) {
+            hour.allowed += delta.allowed;
+            hour.denied += delta.denied;
+        }
+        
+        this.updateConnectionStats();
+        if (this.currentTab === 'statistics') {
+            this.renderConnectionChart();
         }
     }
     
@@ -468,10 +633,7 @@ class MTProxyManager {
         } else {
             icon.textContent = '▶️';
             btn.childNodes[1].textContent = ' 开始监控';
-            if (this.monitorInterval) {
-                clearInterval(this.monitorInterval);
-                this.monitorInterval = null;
-            }
+            this.stopConnectionStream();
         }
     }
     
@@ -595,26 +757,28 @@ class MTProxyManager {
             return;
         }
         
-        tbody.innerHTML = this.connections.map(conn => {
-            const statusClass = conn.status === 'allowed' ? 'status-allowed' : 'status-denied';
-            const statusText = conn.status === 'allowed' ? '允许' : '拒绝';
-            const timeStr = this.formatTime(conn.timestamp);
-            
-            return `
-                <div class="connection-item">
-                    <div class="connection-time">${timeStr}</div>
-                    <div class="connection-ip">${conn.ip}</div>
-                    <div class="connection-status ${statusClass}">${statusText}</div>
-                    <div class="connection-location">${conn.location || '未知'}</div>
-                    <div class="connection-action">
-                        ${conn.status === 'denied' ? 
-                            `<button class="action-btn add-whitelist" onclick="app.addToWhitelist('${conn.ip}')">添加白名单</button>` : 
-                            ''
-                        }
-                    </div>
+        tbody.innerHTML = this.connections.map(conn => this.connectionItemHtml(conn)).join('');
+    }
+    
+    connectionItemHtml(conn) {
+        const statusClass = conn.status === 'allowed' ? 'status-allowed' : 'status-denied';
+        const statusText = conn.status === 'allowed' ? '允许' : '拒绝';
+        const timeStr = this.formatTime(conn.timestamp);
+        
+        return `
+            <div class="connection-item">
+                <div class="connection-time">${timeStr}</div>
+                <div class="connection-ip">${conn.ip}</div>
+                <div class="connection-status ${statusClass}">${statusText}</div>
+                <div class="connection-location">${conn.location || '未知'}</div>
+                <div class="connection-action">
+                    ${conn.status === 'denied' ? 
+                        `<button class="action-btn add-whitelist" onclick="app.addToWhitelist('${conn.ip}')">添加白名单</button>` : 
+                        ''
+                    }
                 </div>
-            `;
-        }).join('');
+            </div>
+        `;
     }
     
     renderBlockedIPs() {
@@ -727,7 +891,9 @@ class MTProxyManager {
     
     formatTime(timestamp) {
         if (!timestamp) return '-';
-        const date = new Date(timestamp);
+        // 连接时间以UTC保存（YYYY-MM-DD HH:MM:SS），按UTC解析后显示为本地时间
+        const isUTC = /^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$/.test(timestamp);
+        const date = new Date(isUTC ? `${timestamp.replace(' ', 'T')}Z` : timestamp);
         return date.toLocaleTimeString('zh-CN', {
             hour: '2-digit',
             minute: '2-digit',